@@ -3,30 +3,31 @@ from datetime import timedelta
 
 from nicegui import ui
 
+from beaverhabits.storage.storage import Habit
 
-def build_weeks_text_alternative(
-    today: datetime.date, ticked_days: list[datetime.date]
-) -> str:
+
+def build_weeks_text_alternative(today: datetime.date, habit: Habit) -> str:
     text = "last 3 weeks progress: "
+    buckets = habit.buckets
     for i in range(3):
         end = today - timedelta(days=today.weekday() + 7 * i)
-        start = end - timedelta(days=7 * (i + 1))
-        count = sum(1 for day in ticked_days if start <= day < end)
+        # Whole ISO weeks [end - 7 * (i + 1), end)
+        count = sum(buckets.week(end - timedelta(weeks=w + 1)) for w in range(i + 1))
         text += f"{count} "
 
     return text
 
 
-def build_months_text_alternative(
-    today: datetime.date, ticked_days: list[datetime.date]
-) -> str:
+def build_months_text_alternative(today: datetime.date, habit: Habit) -> str:
     text = "last 3 months progress: "
+    buckets = habit.buckets
 
     end = today
     for _ in range(3):
         end = end.replace(day=1) - timedelta(days=1)
         start = end.replace(day=1) - timedelta(days=1)
-        count = sum(1 for day in ticked_days if start <= day <= end)
+        # The month of end, plus the last day of the month before
+        count = buckets.month(end) + habit.ticked_count(start, start)
         text += f"{count} "
 
     return text
@@ -39,5 +40,5 @@ def description(text: str):
         ui.html(text, sanitize=False)
 
 
-def index_total_badge_alternative_text(today: datetime.date, habit):
-    return f"{build_weeks_text_alternative(today, habit.ticked_days)}; {build_months_text_alternative(today, habit.ticked_days)}"
+def index_total_badge_alternative_text(today: datetime.date, habit: Habit):
+    return f"{build_weeks_text_alternative(today, habit)}; {build_months_text_alternative(today, habit)}"
@@ -1,59 +1,320 @@
 import contextlib
+import datetime
+import hashlib
+import json
 import uuid
+from dataclasses import dataclass, field
 from typing import Sequence
 from uuid import UUID
 
-from sqlalchemy import select
+from sqlalchemy import delete, select, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
 
 from beaverhabits.logger import logger
 
 from .db import (
+    HabitJournalModel,
     HabitListModel,
+    HabitModel,
+    HabitRecordModel,
+    JSONText,
     User,
     UserApiTokenModel,
     UserConfigsModel,
     UserIdentityModel,
     UserNoteImageModel,
+    engine,
     get_async_session,
 )
+from .token_cache import invalidate_user_tokens
 
 get_async_session_context = contextlib.asynccontextmanager(get_async_session)
 
+# (day, done, text), text is None when the record has no note
+RecordRow = tuple[datetime.date, bool, str | None]
+
+
+@dataclass
+class HabitRowChanges:
+    # Everything but the habits, stored in the habit_list row
+    list_data: dict | None = None
+    # habit id -> (position, data)
+    habits: dict[str, tuple[int, dict]] = field(default_factory=dict)
+    removed_habits: set[str] = field(default_factory=set)
+    # habit id -> rows to upsert / days to delete
+    records: dict[str, list[RecordRow]] = field(default_factory=dict)
+    removed_records: dict[str, list[datetime.date]] = field(default_factory=dict)
+
+    def __bool__(self) -> bool:
+        return bool(
+            self.list_data is not None
+            or self.habits
+            or self.removed_habits
+            or any(self.records.values())
+            or any(self.removed_records.values())
+        )
+
+
+def _upsert(model, index_elements: list[str]):
+    # INSERT ... ON CONFLICT DO UPDATE, both dialects share the syntax
+    insert = postgresql.insert if engine.dialect.name == "postgresql" else sqlite.insert
+    stmt = insert(model)
+    updates = {
+        c.name: stmt.excluded[c.name]
+        for c in model.__table__.columns
+        if c.name not in index_elements and not c.primary_key and c.name != "created_at"
+    }
+    return stmt.on_conflict_do_update(index_elements=index_elements, set_=updates)
+
+
+def habit_list_json(data: dict | JSONText) -> JSONText:
+    # Canonical, so equal lists have equal digests
+    if isinstance(data, JSONText):
+        return data
+    return JSONText(json.dumps(data, sort_keys=True, separators=(",", ":")))
+
+
+def habit_list_digest(data: dict | JSONText) -> str:
+    content = habit_list_json(data)
+    return hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+
 
-async def update_user_habit_list(user: User, data: dict) -> None:
+def _habit_list_query(user: User):
+    # Core updates and upserts bypass the identity map of a session shared by
+    # the request, refresh what it already holds
+    return (
+        select(HabitListModel)
+        .where(HabitListModel.user_id == user.id)
+        .execution_options(populate_existing=True)
+    )
+
+
+def _habit_list_values(data: dict) -> dict:
+    # Every write of the list takes a new version
+    return dict(
+        data=data,
+        digest=habit_list_digest(data),
+        version=HabitListModel.version + 1,
+    )
+
+
+async def update_user_habit_list(user: User, data: dict | JSONText) -> None:
     async with get_async_session_context() as session:
         assert data, "Habit list data cannot be empty"
 
-        stmt = select(HabitListModel).where(HabitListModel.user_id == user.id)
+        stmt = _habit_list_query(user)
         result = await session.execute(stmt)
         habit_list = result.scalar()
         logger.info(f"[CRUD] User {user.id} habit list query")
 
         if not habit_list:
             session.add(
-                HabitListModel(data=data, user_id=user.id),
+                HabitListModel(
+                    data=data, digest=habit_list_digest(data), user_id=user.id
+                ),
             )
             await session.commit()
             logger.info(f"[CRUD] User {user.id} habit list created")
             return
 
-        if habit_list.data == data:
+        if habit_list.digest == habit_list_digest(data):
             logger.warning(f"[CRUD] User {user.id} habit list unchanged")
             return
 
-        habit_list.data = data
+        stmt = (
+            update(HabitListModel)
+            .where(HabitListModel.id == habit_list.id)
+            .values(**_habit_list_values(data))
+        )
+        await session.execute(stmt)
         await session.commit()
         logger.info(f"[CRUD] User {user.id} habit list updated")
 
 
+async def save_user_habit_list(
+    user: User, data: dict | JSONText, digest: str, version: int
+) -> bool:
+    # A single conditional write, False if the list moved past the version
+    async with get_async_session_context() as session:
+        stmt = (
+            update(HabitListModel)
+            .where(HabitListModel.user_id == user.id)
+            .where(HabitListModel.version == version)
+            .values(data=data, digest=digest, version=version + 1)
+        )
+        result = await session.execute(stmt)
+        await session.commit()
+        logger.info(f"[CRUD] User {user.id} habit list saved: {result.rowcount}")
+        return result.rowcount == 1
+
+
 async def get_user_habit_list(user: User) -> HabitListModel | None:
     async with get_async_session_context() as session:
-        stmt = select(HabitListModel).where(HabitListModel.user_id == user.id)
+        stmt = _habit_list_query(user)
         result = await session.execute(stmt)
         logger.info(f"[CRUD] User {user.id} habit list query")
         return result.scalar()
 
 
+async def get_user_habit_rows(
+    user: User,
+) -> tuple[Sequence[HabitModel], dict[int, list[RecordRow]]]:
+    async with get_async_session_context() as session:
+        stmt = (
+            select(HabitModel)
+            .where(HabitModel.user_id == user.id)
+            .order_by(HabitModel.position)
+            .execution_options(populate_existing=True)
+        )
+        habits = (await session.execute(stmt)).scalars().all()
+
+        # Range scan over the (habit_id, day) index
+        stmt = (
+            select(
+                HabitRecordModel.habit_id,
+                HabitRecordModel.day,
+                HabitRecordModel.done,
+                HabitRecordModel.text,
+            )
+            .join(HabitModel)
+            .where(HabitModel.user_id == user.id)
+            .order_by(HabitRecordModel.habit_id, HabitRecordModel.day)
+        )
+        records: dict[int, list[RecordRow]] = {}
+        for habit_id, day, done, text in await session.execute(stmt):
+            records.setdefault(habit_id, []).append((day, done, text))
+
+        logger.info(f"[CRUD] User {user.id} habit rows query: {len(habits)}")
+        return habits, records
+
+
+async def migrate_user_habit_list(
+    user: User,
+    habits: list[tuple[str, dict, list[RecordRow]]],
+    list_data: dict,
+    version: int,
+) -> bool:
+    # Move the habits out of the document read at version, all or nothing
+    async with get_async_session_context() as session:
+        stmt = _habit_list_query(user)
+        habit_list = (await session.execute(stmt)).scalar()
+        if habit_list is None or habit_list.version != version:
+            return False
+
+        models = [
+            HabitModel(user_id=user.id, habit_id=habit_id, position=i, data=data)
+            for i, (habit_id, data, _) in enumerate(habits)
+        ]
+        session.add_all(models)
+        await session.flush()
+
+        rows = [
+            dict(habit_id=model.id, day=day, done=done, text=text)
+            for model, (_, _, records) in zip(models, habits)
+            for day, done, text in records
+        ]
+        if rows:
+            await session.execute(HabitRecordModel.__table__.insert(), rows)
+
+        habit_list.data = list_data
+        habit_list.digest = habit_list_digest(list_data)
+        habit_list.version += 1
+        await session.commit()
+        logger.info(f"[CRUD] User {user.id} habit list migrated: {len(rows)} records")
+        return True
+
+
+async def update_user_habit_rows(
+    user: User, changes: HabitRowChanges, pks: dict[str, int]
+) -> dict[str, int]:
+    # Write only the rows that changed, returns the habit primary keys
+    pks = dict(pks)
+    async with get_async_session_context() as session:
+        if changes.list_data is not None:
+            stmt = (
+                update(HabitListModel)
+                .where(HabitListModel.user_id == user.id)
+                .values(**_habit_list_values(changes.list_data))
+            )
+            await session.execute(stmt)
+
+        if changes.removed_habits:
+            ids = [pks.pop(x) for x in changes.removed_habits if x in pks]
+            stmt = delete(HabitRecordModel).where(HabitRecordModel.habit_id.in_(ids))
+            await session.execute(stmt)
+            stmt = delete(HabitModel).where(HabitModel.id.in_(ids))
+            await session.execute(stmt)
+
+        if changes.habits:
+            stmt = _upsert(HabitModel, ["user_id", "habit_id"]).returning(
+                HabitModel.habit_id, HabitModel.id
+            )
+            rows = [
+                dict(user_id=user.id, habit_id=x, position=position, data=data)
+                for x, (position, data) in changes.habits.items()
+            ]
+            for habit_id, pk in await session.execute(stmt, rows):
+                pks[habit_id] = pk
+
+        rows = [
+            dict(habit_id=pks[x], day=day, done=done, text=text)
+            for x, records in changes.records.items()
+            for day, done, text in records
+        ]
+        if rows:
+            await session.execute(_upsert(HabitRecordModel, ["habit_id", "day"]), rows)
+
+        keys = [
+            (pks[x], day) for x, days in changes.removed_records.items() for day in days
+        ]
+        if keys:
+            stmt = delete(HabitRecordModel).where(
+                tuple_(HabitRecordModel.habit_id, HabitRecordModel.day).in_(keys)
+            )
+            await session.execute(stmt)
+
+        await session.commit()
+        logger.info(f"[CRUD] User {user.id} habit rows updated: {len(rows)} records")
+        return pks
+
+
+async def get_user_habit_journal(user: User) -> Sequence[HabitJournalModel]:
+    async with get_async_session_context() as session:
+        stmt = (
+            select(HabitJournalModel)
+            .where(HabitJournalModel.user_id == user.id)
+            .order_by(HabitJournalModel.id)
+        )
+        entries = (await session.execute(stmt)).scalars().all()
+        logger.info(f"[CRUD] User {user.id} habit journal query: {len(entries)}")
+        return entries
+
+
+async def append_user_habit_journal(user: User, entries: list[dict]) -> None:
+    async with get_async_session_context() as session:
+        rows = [dict(user_id=user.id, entry=entry) for entry in entries]
+        await session.execute(HabitJournalModel.__table__.insert(), rows)
+        await session.commit()
+        logger.info(f"[CRUD] User {user.id} habit journal appended: {len(rows)}")
+
+
+async def compact_user_habit_journal(user: User, data: dict, last_id: int) -> None:
+    # Replace the snapshot and drop the entries it covers, all or nothing
+    async with get_async_session_context() as session:
+        stmt = (
+            update(HabitListModel)
+            .where(HabitListModel.user_id == user.id)
+            .values(**_habit_list_values(data))
+        )
+        await session.execute(stmt)
+        stmt = delete(HabitJournalModel).where(
+            HabitJournalModel.user_id == user.id, HabitJournalModel.id <= last_id
+        )
+        await session.execute(stmt)
+        await session.commit()
+        logger.info(f"[CRUD] User {user.id} habit journal compacted")
+
+
 async def get_user_count() -> int:
     async with get_async_session_context() as session:
         stmt = select(User)
@@ -131,7 +392,9 @@ async def get_or_create_user_identity(
         return user_identity
 
 
-async def update_user_identity(customer_id: str, data: dict, activate: bool) -> None:
+async def update_user_identity(
+    customer_id: str, data: dict, activate: bool
+) -> UserIdentityModel:
     async with get_async_session_context() as session:
         stmt = select(UserIdentityModel).where(
             UserIdentityModel.customer_id == customer_id
@@ -145,6 +408,7 @@ async def update_user_identity(customer_id: str, data: dict, activate: bool) ->
         user_identity.activated = activate
         await session.commit()
         logger.info(f"[CRUD] User identity updated: {user_identity}")
+        return user_identity
 
 
 async def get_user_configs(user: User) -> dict | None:
@@ -240,6 +504,7 @@ async def reset_user_api_token(user: User) -> str:
             session.add(token_model)
             await session.commit()
             logger.info(f"[CRUD] User {user.id} API token created (via reset)")
+        invalidate_user_tokens(user.id)
         return new_token
 
 
@@ -252,16 +517,16 @@ async def delete_user_api_token(user: User) -> None:
             await session.delete(token_model)
             await session.commit()
             logger.info(f"[CRUD] User {user.id} API token deleted")
+        invalidate_user_tokens(user.id)
 
 
 async def get_user_by_api_token(token: str) -> User | None:
     async with get_async_session_context() as session:
-        stmt = select(UserApiTokenModel).where(UserApiTokenModel.token == token)
+        stmt = (
+            select(User)
+            .join(UserApiTokenModel, UserApiTokenModel.user_id == User.id)
+            .where(UserApiTokenModel.token == token)
+        )
         result = await session.execute(stmt)
-        token_model = result.scalar()
-        if token_model:
-            user_stmt = select(User).where(User.id == token_model.user_id)
-            user_result = await session.execute(user_stmt)
-            return user_result.scalar()
-        return None
+        return result.scalar()
         return user_image
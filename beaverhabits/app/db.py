@@ -1,11 +1,27 @@
+import asyncio
+import contextlib
 import datetime
-from typing import AsyncGenerator
+import json
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import AsyncGenerator, AsyncIterator
 from uuid import UUID
 
 from fastapi import Depends
 from fastapi_users.db import SQLAlchemyBaseUserTableUUID, SQLAlchemyUserDatabase
 from fastapi_users_db_sqlalchemy.generics import GUID
-from sqlalchemy import JSON, DateTime, ForeignKey, func
+from sqlalchemy import (
+    JSON,
+    Connection,
+    Date,
+    DateTime,
+    ForeignKey,
+    UniqueConstraint,
+    event,
+    func,
+    inspect,
+    text,
+)
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import (
     DeclarativeBase,
@@ -43,6 +59,12 @@ class User(TimestampMixin, SQLAlchemyBaseUserTableUUID, Base):
     note_images: Mapped["UserNoteImageModel"] = relationship(
         back_populates="user", uselist=True, cascade="all, delete-orphan"
     )
+    habits: Mapped[list["HabitModel"]] = relationship(
+        back_populates="user", cascade="all, delete-orphan"
+    )
+    habit_journal: Mapped[list["HabitJournalModel"]] = relationship(
+        cascade="all, delete-orphan"
+    )
 
 
 class HabitListModel(TimestampMixin, Base):
@@ -50,11 +72,58 @@ class HabitListModel(TimestampMixin, Base):
 
     id: Mapped[int] = mapped_column(primary_key=True, index=True)
     data: Mapped[dict] = mapped_column(JSON, nullable=False)
+    # Bumped on every write, writers expect the version they loaded
+    version: Mapped[int] = mapped_column(default=0, server_default="0")
+    # Content hash of data, to skip writing an unchanged list
+    digest: Mapped[str | None] = mapped_column(default=None)
 
     user_id = mapped_column(GUID, ForeignKey("user.id"), index=True)
     user = relationship("User", back_populates="habit_list")
 
 
+class HabitModel(TimestampMixin, Base):
+    """One row per habit, used by the relational storage."""
+
+    __tablename__ = "habit"
+    __table_args__ = (UniqueConstraint("user_id", "habit_id"),)
+
+    id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    habit_id: Mapped[str] = mapped_column()
+    position: Mapped[int] = mapped_column(default=0)
+    # Habit fields other than id and records, e.g. name, tags, period
+    data: Mapped[dict] = mapped_column(JSON, nullable=False)
+
+    user_id = mapped_column(GUID, ForeignKey("user.id"), index=True)
+    user = relationship("User", back_populates="habits")
+    records: Mapped[list["HabitRecordModel"]] = relationship(
+        cascade="all, delete-orphan", passive_deletes=True
+    )
+
+
+class HabitRecordModel(Base):
+    """One row per habit and day, unique on (habit_id, day)."""
+
+    __tablename__ = "habit_record"
+    __table_args__ = (UniqueConstraint("habit_id", "day"),)
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    habit_id: Mapped[int] = mapped_column(ForeignKey("habit.id", ondelete="CASCADE"))
+    day: Mapped[datetime.date] = mapped_column(Date)
+    done: Mapped[bool] = mapped_column(default=False)
+    text: Mapped[str | None] = mapped_column(default=None)
+
+
+class HabitJournalModel(Base):
+    """Habit list changes appended since the snapshot, used by the journal mode."""
+
+    __tablename__ = "habit_journal"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    entry: Mapped[dict] = mapped_column(JSON, nullable=False)
+
+    user_id = mapped_column(GUID, ForeignKey("user.id"), index=True)
+
+
 class UserIdentityModel(TimestampMixin, Base):
     __tablename__ = "customer"
 
@@ -109,20 +178,129 @@ class UserApiTokenModel(TimestampMixin, Base):
 connect_args = {}
 if settings.DATABASE_URL.startswith("postgresql"):
     connect_args = {"ssl": "allow"}
+
+
+class JSONText(str):
+    """JSON already serialized, bound to JSON columns as it is."""
+
+
+def json_serializer(value) -> str:
+    if isinstance(value, JSONText):
+        return value
+    return json.dumps(value)
+
+
 engine = create_async_engine(
-    DATABASE_URL, connect_args=connect_args, pool_pre_ping=True
+    DATABASE_URL,
+    connect_args=connect_args,
+    pool_pre_ping=True,
+    json_serializer=json_serializer,
 )
 async_session_maker = async_sessionmaker(engine, expire_on_commit=False)
 
 
+def add_missing_columns(conn: Connection) -> None:
+    # create_all only creates tables, add the columns new to existing ones.
+    # They are all nullable or have a server default.
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = f"{column.type.compile(conn.dialect)}"
+            if column.server_default is not None:
+                ddl += f" DEFAULT {column.server_default.arg}"
+            conn.execute(
+                text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {ddl}')
+            )
+
+
 async def create_db_and_tables():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(add_missing_columns)
+
+
+@dataclass
+class RequestSession:
+    """
+    The session shared by everything handling one request: auth, crud and
+    the habit list storage, in whichever task they run.
+
+    It is used by one task at a time, a task asking while another one is
+    using it gets a session of its own. So does anything still running once
+    the request is done.
+    """
+
+    session: AsyncSession | None = None
+    owner: asyncio.Task | None = None
+    users: int = 0
+    closed: bool = False
+
+    # Metrics
+    sessions: int = 0
+    queries: int = 0
+
+    async def close(self) -> None:
+        self.closed = True
+        if self.session is not None and not self.users:
+            await self.session.close()
+
+
+request_session: ContextVar[RequestSession | None] = ContextVar(
+    "request_session", default=None
+)
+
+
+@contextlib.asynccontextmanager
+async def request_session_scope() -> AsyncIterator[RequestSession]:
+    scope = RequestSession()
+    token = request_session.set(scope)
+    try:
+        yield scope
+    finally:
+        request_session.reset(token)
+        await scope.close()
+
+
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def count_request_query(*_) -> None:
+    scope = request_session.get()
+    if scope is not None and not scope.closed:
+        scope.queries += 1
 
 
 async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
-    async with async_session_maker() as session:
-        yield session
+    scope = request_session.get()
+    task = asyncio.current_task()
+    if scope is None or scope.closed or (scope.users and scope.owner is not task):
+        if scope is not None and not scope.closed:
+            scope.sessions += 1
+        async with async_session_maker() as session:
+            yield session
+        return
+
+    if scope.session is None:
+        scope.session = async_session_maker()
+        scope.sessions += 1
+
+    scope.users += 1
+    scope.owner = task
+    try:
+        yield scope.session
+    except BaseException:
+        # Usable again by the rest of the request, like a new session
+        await scope.session.rollback()
+        raise
+    finally:
+        scope.users -= 1
+        if not scope.users:
+            scope.owner = None
+            if scope.closed:
+                await scope.session.close()
 
 
 async def get_user_db(session: AsyncSession = Depends(get_async_session)):
@@ -6,12 +6,14 @@ from starlette.status import HTTP_401_UNAUTHORIZED
 
 from beaverhabits import views
 from beaverhabits.app.auth import (
+    jwt_expiry,
     user_from_reset_token,
     user_from_token,
     user_get_by_email,
 )
 from beaverhabits.app.crud import get_user_by_api_token
 from beaverhabits.app.db import User
+from beaverhabits.app.token_cache import cache_token_user, get_token_user
 from beaverhabits.configs import settings
 from beaverhabits.logger import logger
 
@@ -39,6 +41,22 @@ def get_trusted_local_email() -> Optional[str]:
     return settings.TRUSTED_LOCAL_EMAIL
 
 
+async def user_from_credentials(credentials: str) -> Optional[User]:
+    if user := get_token_user(credentials):
+        return user
+
+    if user := await user_from_token(credentials):
+        cache_token_user(credentials, user, jwt_expiry(credentials))
+        return user
+
+    # Check API token (permanent tokens for integrations)
+    if user := await get_user_by_api_token(credentials):
+        cache_token_user(credentials, user)
+        return user
+
+    return None
+
+
 async def current_active_user(
     credentials: Annotated[Optional[str], Depends(get_bearer_token)],
     trusted_header_email: Annotated[Optional[str], Depends(get_trusted_header_email)],
@@ -61,11 +79,7 @@ async def current_active_user(
         user = await views.register_user(trusted_local_email)
         return user
 
-    if credentials and (user := await user_from_token(credentials)):
-        return user
-
-    # Check API token (permanent tokens for integrations)
-    if credentials and (user := await get_user_by_api_token(credentials)):
+    if credentials and (user := await user_from_credentials(credentials)):
         return user
 
     # ref: fastapi.security.oauth2.OAuth2PasswordBearer
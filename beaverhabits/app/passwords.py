@@ -0,0 +1,117 @@
+import asyncio
+import contextlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from typing import AsyncIterator, Callable, Iterable, TypeVar
+
+from fastapi_users.password import PasswordHelper
+
+from beaverhabits.configs import settings
+
+T = TypeVar("T")
+
+# Results worked out ahead by the pool, for the PooledPasswordHelper calls
+# of the current task
+_ahead: ContextVar[dict[tuple, object]] = ContextVar("password_ahead", default={})
+
+
+class PooledPasswordHelper(PasswordHelper):
+    """
+    A PasswordHelper serving what PasswordPool.ahead computed.
+
+    BaseUserManager calls its helper synchronously, so the hash can't be
+    awaited there. Calls with nothing computed ahead still run inline.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.inline = 0
+
+    def hash(self, password: str) -> str:
+        if (result := _ahead.get().get(("hash", password))) is not None:
+            return result  # type: ignore[return-value]
+        self.inline += 1
+        return super().hash(password)
+
+    def verify_and_update(
+        self, plain_password: str, hashed_password: str
+    ) -> tuple[bool, str | None]:
+        key = ("verify", plain_password, hashed_password)
+        if (result := _ahead.get().get(key)) is not None:
+            return result  # type: ignore[return-value]
+        self.inline += 1
+        return super().verify_and_update(plain_password, hashed_password)
+
+
+class PasswordPool:
+    """
+    Password hashing and verification in worker threads.
+
+    A hash takes hundreds of ms of CPU, which would stall every connected
+    page when run on the event loop. argon2 and bcrypt release the GIL, so
+    threads are enough; there are as many as hashes allowed at once (each
+    argon2 hash also takes 64 MiB), the others queue.
+    """
+
+    def __init__(self, concurrency: int, helper: PasswordHelper | None = None):
+        self.helper = helper or PasswordHelper()
+        self.executor = ThreadPoolExecutor(concurrency, thread_name_prefix="password")
+
+        # Metrics
+        self.in_flight = 0
+        self.count = 0
+        self.queue_seconds = 0.0
+        self.run_seconds = 0.0
+
+    async def _run(self, func: Callable[..., T], *args) -> T:
+        def run() -> tuple[float, T]:
+            return time.perf_counter(), func(*args)
+
+        submitted = time.perf_counter()
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            started, result = await loop.run_in_executor(self.executor, run)
+        finally:
+            self.in_flight -= 1
+
+        self.count += 1
+        self.queue_seconds += started - submitted
+        self.run_seconds += time.perf_counter() - started
+        return result
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.helper.hash, password)
+
+    async def verify_and_update(
+        self, plain_password: str, hashed_password: str
+    ) -> tuple[bool, str | None]:
+        return await self._run(
+            self.helper.verify_and_update, plain_password, hashed_password
+        )
+
+    @contextlib.asynccontextmanager
+    async def ahead(
+        self,
+        hash: Iterable[str] = (),
+        verify: Iterable[tuple[str, str]] = (),
+    ) -> AsyncIterator[None]:
+        # Work out in the pool what the PooledPasswordHelper will be asked
+        results = dict(_ahead.get())
+        for password in hash:
+            results["hash", password] = await self.hash(password)
+        for plain_password, hashed_password in verify:
+            results["verify", plain_password, hashed_password] = (
+                await self.verify_and_update(plain_password, hashed_password)
+            )
+
+        token = _ahead.set(results)
+        try:
+            yield
+        finally:
+            _ahead.reset(token)
+
+
+password_pool = PasswordPool(settings.PASSWORD_HASH_CONCURRENCY)
+password_helper = PooledPasswordHelper()
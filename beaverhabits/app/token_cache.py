@@ -0,0 +1,57 @@
+import time
+from dataclasses import dataclass
+from typing import Any
+
+from cachetools import TLRUCache
+from fastapi_users_db_sqlalchemy import UUID_ID
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+from beaverhabits.app.db import User
+from beaverhabits.configs import settings
+
+
+@dataclass(frozen=True)
+class _CachedUser:
+    # Column values of the user, each hit gets an instance of its own
+    fields: tuple[tuple[str, Any], ...]
+    # Wall clock expiry of a JWT, API tokens do not expire
+    expires: float | None = None
+
+
+def _ttu(_: str, value: _CachedUser, now: float) -> float:
+    ttl = settings.TOKEN_CACHE_TTL
+    if value.expires is not None:
+        ttl = min(ttl, value.expires - time.time())
+    return now + ttl
+
+
+# Users resolved from bearer tokens, JWTs and API tokens alike
+token_cache: TLRUCache[str, _CachedUser] = TLRUCache(
+    maxsize=settings.TOKEN_CACHE_SIZE, ttu=_ttu
+)
+token_cache_stats = {"hits": 0, "misses": 0}
+
+
+def get_token_user(token: str) -> User | None:
+    if (cached := token_cache.get(token)) is not None:
+        token_cache_stats["hits"] += 1
+        # Detached, as if just loaded, and shared with no other request
+        user = User(**dict(cached.fields))
+        make_transient_to_detached(user)
+        return user
+
+    token_cache_stats["misses"] += 1
+    return None
+
+
+def cache_token_user(token: str, user: User, expires: float | None = None) -> None:
+    fields = tuple((x.key, getattr(user, x.key)) for x in inspect(User).column_attrs)
+    token_cache[token] = _CachedUser(fields, expires)
+
+
+def invalidate_user_tokens(user_id: UUID_ID) -> None:
+    # Rare enough to go through the whole cache
+    for token, cached in list(token_cache.items()):
+        if str(dict(cached.fields)["id"]) == str(user_id):
+            token_cache.pop(token, None)
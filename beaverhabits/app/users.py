@@ -1,19 +1,30 @@
 import uuid
-from typing import Optional
+from typing import Any, Optional
 
+import jwt
 from fastapi import Depends, Request
-from fastapi_users import BaseUserManager, FastAPIUsers, UUIDIDMixin
+from fastapi.security import OAuth2PasswordRequestForm
+from fastapi_users import (
+    BaseUserManager,
+    FastAPIUsers,
+    UUIDIDMixin,
+    exceptions,
+    schemas,
+)
 from fastapi_users.authentication import (
     AuthenticationBackend,
     BearerTransport,
     JWTStrategy,
 )
 from fastapi_users.db import SQLAlchemyUserDatabase
+from fastapi_users.jwt import decode_jwt
 
 from beaverhabits.configs import settings
 from beaverhabits.logger import logger
 
 from .db import User, get_user_db
+from .passwords import password_helper, password_pool
+from .token_cache import invalidate_user_tokens
 
 JWT_SECRET = settings.JWT_SECRET
 JWT_LIFETIME_SECONDS = settings.JWT_LIFETIME_SECONDS
@@ -26,6 +37,9 @@ class UserManager(UUIDIDMixin, BaseUserManager[User, uuid.UUID]):
     async def on_after_register(self, user: User, request: Optional[Request] = None):
         logger.info(f"User has registered: {user.email}({user.id})")
 
+    async def on_after_delete(self, user: User, request: Optional[Request] = None):
+        invalidate_user_tokens(user.id)
+
     async def on_after_forgot_password(
         self, user: User, token: str, request: Optional[Request] = None
     ):
@@ -38,9 +52,70 @@ class UserManager(UUIDIDMixin, BaseUserManager[User, uuid.UUID]):
             f"Verification requested for user {user.id}. Verification token: {token}"
         )
 
+    # The password work of BaseUserManager (fastapi-users 14.0) done ahead in
+    # the password pool. oauth_callback hashes a password it generates itself
+    # and still does it inline, no OAuth router is mounted.
+
+    async def create(
+        self,
+        user_create: schemas.UC,
+        safe: bool = False,
+        request: Optional[Request] = None,
+    ) -> User:
+        async with password_pool.ahead(hash=[user_create.password]):
+            return await super().create(user_create, safe, request)
+
+    async def authenticate(
+        self, credentials: OAuth2PasswordRequestForm
+    ) -> Optional[User]:
+        try:
+            user = await self.get_by_email(credentials.username)
+        except exceptions.UserNotExists:
+            # Hashed anyway to mitigate timing attacks
+            ahead = password_pool.ahead(hash=[credentials.password])
+        else:
+            ahead = password_pool.ahead(
+                verify=[(credentials.password, user.hashed_password)]
+            )
+        async with ahead:
+            return await super().authenticate(credentials)
+
+    async def forgot_password(
+        self, user: User, request: Optional[Request] = None
+    ) -> None:
+        # The token holds a hash of the password hash
+        async with password_pool.ahead(hash=[user.hashed_password]):
+            await super().forgot_password(user, request)
+
+    async def reset_password(
+        self, token: str, password: str, request: Optional[Request] = None
+    ) -> User:
+        verify = []
+        try:
+            data = decode_jwt(
+                token,
+                self.reset_password_token_secret,
+                [self.reset_password_token_audience],
+            )
+            user = await self.get(self.parse_id(data["sub"]))
+            verify.append((user.hashed_password, data["password_fgpt"]))
+        except (jwt.PyJWTError, KeyError, exceptions.FastAPIUsersException):
+            # Rejected by BaseUserManager with the matching error
+            pass
+        async with password_pool.ahead(verify=verify):
+            return await super().reset_password(token, password, request)
+
+    async def _update(self, user: User, update_dict: dict[str, Any]) -> User:
+        password = update_dict.get("password")
+        async with password_pool.ahead(hash=[password] if password else []):
+            updated_user = await super()._update(user, update_dict)
+        # Every change of a user goes through here, a reset password included
+        invalidate_user_tokens(updated_user.id)
+        return updated_user
+
 
 async def get_user_manager(user_db: SQLAlchemyUserDatabase = Depends(get_user_db)):
-    yield UserManager(user_db)
+    yield UserManager(user_db, password_helper)
 
 
 bearer_transport = BearerTransport(tokenUrl="auth/jwt/login")
@@ -15,6 +15,14 @@ class StorageType(Enum):
     SESSION = "SESSION"
     USER_DATABASE = "DATABASE"
     USER_DISK = "USER_DISK"
+    USER_RELATIONAL = "RELATIONAL"
+
+
+class StorageCodec(Enum):
+    JSON = "JSON"
+    # Records as delta encoded varint days, optionally zlib compressed
+    VARINT = "VARINT"
+    VARINT_ZLIB = "VARINT_ZLIB"
 
 
 class TagSelectionMode(Enum):
@@ -41,6 +49,10 @@ class Settings(BaseSettings):
     PADDLE_PRODUCT_ID: str = ""
     PADDLE_PRICE_ID: str = ""
     PADDLE_CALLBACK_KEY: str = ""
+    # Pro plan status per user, kept for at most this long (in seconds).
+    # Invalidated by the Paddle callbacks, other workers wait it out
+    ENTITLEMENT_CACHE_SIZE: int = 1024
+    ENTITLEMENT_CACHE_TTL: int = 10 * 60
     HIGHLIGHT_IO_PROJECT_ID: str = ""
 
     # Email
@@ -56,9 +68,33 @@ class Settings(BaseSettings):
     # Storage
     HABITS_STORAGE: StorageType = StorageType.USER_DATABASE
     DATABASE_URL: str = f"sqlite+aiosqlite:///./{USER_DATA_FOLDER}/habits.db"
+    # Encoding of stored habit lists (DATABASE and USER_DISK) and backups,
+    # lists written with any of them can always be read
+    HABITS_CODEC: StorageCodec = StorageCodec.JSON
+    # Habit list writes are coalesced per user within this window (in seconds)
+    DATABASE_FLUSH_WINDOW: float = 0.25
+    # Append changes to a journal instead of rewriting the habit list (DATABASE
+    # and USER_DISK), compacted into the snapshot every this many entries
+    HABITS_JOURNAL: bool = False
+    HABITS_JOURNAL_COMPACT_SIZE: int = 1000
+    # Users whose habit list stays loaded in memory, and for how long after
+    # their last access (in seconds). Unset, the USER_DISK_CACHE_* values
+    # they were named before are used
+    USER_CACHE_MAX_SIZE: int | None = None
+    USER_CACHE_TTL: int | None = None
+    USER_DISK_CACHE_SIZE: int = 1024
+    USER_DISK_CACHE_TTL: int = 60 * 60
+    # Users whose waits for the habit list write lock are exported as metrics
+    HABIT_LIST_LOCK_TRACKED: int = 32
     MAX_USER_COUNT: int = -1
     JWT_SECRET: str = "SECRET"
     JWT_LIFETIME_SECONDS: int = 0
+    # Users resolved from bearer tokens (JWTs and API tokens), kept for at most
+    # this long (in seconds). Invalidated locally, other workers wait it out
+    TOKEN_CACHE_SIZE: int = 1024
+    TOKEN_CACHE_TTL: int = 5 * 60
+    # Password hashes computed at once, in threads off the event loop
+    PASSWORD_HASH_CONCURRENCY: int = 2
 
     # Auth
     TRUSTED_EMAIL_HEADER: str = ""
@@ -105,5 +141,15 @@ class Settings(BaseSettings):
     def is_trusted_env(self):
         return self.TRUSTED_LOCAL_EMAIL
 
+    def user_cache_max_size(self) -> int:
+        if self.USER_CACHE_MAX_SIZE is not None:
+            return self.USER_CACHE_MAX_SIZE
+        return self.USER_DISK_CACHE_SIZE
+
+    def user_cache_ttl(self) -> int:
+        if self.USER_CACHE_TTL is not None:
+            return self.USER_CACHE_TTL
+        return self.USER_DISK_CACHE_TTL
+
 
 settings = Settings()
@@ -4,7 +4,9 @@ from io import BytesIO
 
 import requests
 
+from beaverhabits.configs import settings
 from beaverhabits.logger import logger
+from beaverhabits.storage.codec import encode_habit_list
 from beaverhabits.storage.dict import DictHabitList
 from beaverhabits.storage.storage import HabitList
 
@@ -28,5 +30,6 @@ def backup_to_telegram(token: str, chat_id: str, habit_list: HabitList):
     if not isinstance(habit_list, DictHabitList):
         raise TypeError("Habit list must be of type DictHabitList")
 
-    binary_data = io.BytesIO(json.dumps(habit_list.data).encode())
+    data = encode_habit_list(habit_list.data, settings.HABITS_CODEC)
+    binary_data = io.BytesIO(json.dumps(data).encode())
     send_json_file(file=binary_data, token=token, chat_id=chat_id)
@@ -1,6 +1,9 @@
 import datetime
 from collections import defaultdict
 from enum import Enum, auto
+from typing import Iterable
+
+from cachetools import LRUCache
 
 from beaverhabits.logger import logger
 from beaverhabits.storage.storage import EVERY_DAY, Habit, HabitFrequency
@@ -12,7 +15,7 @@ CStatus = Enum("CStatus", [("DONE", auto()), ("PERIOD_DONE", auto())])
 def done(
     habit: Habit, start: datetime.date, end: datetime.date
 ) -> dict[datetime.date, CStatus] | None:
-    return {day: CStatus.DONE for day in habit.ticked_days if start <= day <= end}
+    return {day: CStatus.DONE for day in habit.ticked_between(start, end)}
 
 
 class PeriodIterator:
@@ -34,6 +37,36 @@ class PeriodIterator:
         return start, end
 
 
+def period_days(cache: list[datetime.date], p: HabitFrequency) -> list[datetime.date]:
+    # Sweep the periods in order: both bounds only move forward, so the done
+    # days of each period are counted with two pointers over the sorted cache
+    result: list[datetime.date] = []
+    lo = hi = 0
+    prev_left, marked_until = None, datetime.date.min
+    for left, right in PeriodIterator(cache, p):
+        if left == prev_left:
+            continue
+        prev_left = left
+
+        while lo < len(cache) and cache[lo] < left:
+            lo += 1
+        while hi < len(cache) and cache[hi] < right:
+            hi += 1
+        done_days = hi - lo
+        logger.debug(
+            f"Start: {left}, End: {right}, done: {done_days}, target: {p.target_count}"
+        )
+        if done_days >= p.target_count:
+            # Mark them as completed, skipping days of the previous period
+            day = max(left, marked_until)
+            while day < right:
+                result.append(day)
+                day += datetime.timedelta(days=1)
+            marked_until = max(marked_until, right)
+
+    return result
+
+
 @timeit(3)
 def period(
     habit: Habit, start: datetime.date, end: datetime.date
@@ -52,31 +85,30 @@ def period(
     # Cache
     days_min = date_move(start, -p.period_count, p.period_type)
     days_max = date_move(end, p.period_count, p.period_type)
-    cache = [x for x in habit.ticked_days if days_min <= x <= days_max]
+    cache = habit.ticked_between(days_min, days_max)
     logger.debug(f"cache: {cache}, {days_min} <= day <= {days_max}")
 
-    # Iterate over the completion days
-    result: set[datetime.date] = set()
-    for left, right in PeriodIterator(cache, p):
-        # Identify current period start point
-        done_days = sum(1 for d in cache if left <= d < right)
-        logger.debug(
-            f"Start: {left}, End: {right}, done: {done_days}, target: {p.target_count}"
-        )
-        if done_days >= p.target_count:
-            # Mark them as completed
-            for i in range((right - left).days):
-                result.add(left + datetime.timedelta(days=i))
-
-    return {day: CStatus.PERIOD_DONE for day in result}
+    return {day: CStatus.PERIOD_DONE for day in period_days(cache, p)}
 
 
 COMPLETION_HANDLERS = [period, done]
 
+# Results keyed by (habit id, revision, start, end), a new revision is taken
+# on every tick, merge and period change so entries never go stale
+COMPLETION_CACHE_SIZE = 1024
+completion_cache: LRUCache = LRUCache(maxsize=COMPLETION_CACHE_SIZE)
+completion_cache_stats = {"hits": 0, "misses": 0}
+
 
 def get_habit_date_completion(
     habit: Habit, start: datetime.date, end: datetime.date
 ) -> dict[datetime.date, list[CStatus]]:
+    key = (habit.id, habit.revision, start, end)
+    if (cached := completion_cache.get(key)) is not None:
+        completion_cache_stats["hits"] += 1
+        return cached
+    completion_cache_stats["misses"] += 1
+
     result = defaultdict(list)
     for handler in COMPLETION_HANDLERS:
         completion = handler(habit, start, end)
@@ -84,4 +116,16 @@ def get_habit_date_completion(
             continue
         for day, status in completion.items():
             result[day].append(status)
-    return result
+
+    # Shared between callers, plain dict so lookups never insert
+    completion_cache[key] = dict(result)
+    return completion_cache[key]
+
+
+@timeit(10)
+def get_habits_date_completion(
+    habits: Iterable[Habit], start: datetime.date, end: datetime.date
+) -> dict[str, dict[datetime.date, list[CStatus]]]:
+    # Completion status of a whole habit list over the same window,
+    # keyed by habit id
+    return {str(h.id): get_habit_date_completion(h, start, end) for h in habits}
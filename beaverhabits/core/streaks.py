@@ -0,0 +1,126 @@
+import datetime
+from bisect import bisect_left, bisect_right
+
+from beaverhabits.core.completions import COMPLETION_HANDLERS
+from beaverhabits.storage.storage import EVERY_DAY, Habit
+from beaverhabits.utils import date_move, get_period_fist_day
+
+ONE_DAY = datetime.timedelta(days=1)
+
+
+def completed_days(habit: Habit, start: datetime.date, end: datetime.date) -> list[int]:
+    # Ordinals of the days in [start, end] with any completion status
+    days: set[datetime.date] = set()
+    for handler in COMPLETION_HANDLERS:
+        days.update(handler(habit, start, end) or ())
+    return sorted(d.toordinal() for d in days if start <= d <= end)
+
+
+def runs_of(ordinals: list[int]) -> list[tuple[int, int]]:
+    runs: list[tuple[int, int]] = []
+    for x in ordinals:
+        if runs and runs[-1][1] + 1 >= x:
+            runs[-1] = (runs[-1][0], max(runs[-1][1], x))
+        else:
+            runs.append((x, x))
+    return runs
+
+
+class StreakIndex:
+    """
+    Streaks of a habit as run-length encoded segments, sorted by day:
+
+    starts: first day ordinal of each streak
+    ends:   last day ordinal of each streak, inclusive
+
+    A day is part of a streak when it is done or covered by a completed
+    period. Segments never touch, two adjacent runs are always merged.
+    """
+
+    __slots__ = ("habit", "starts", "ends", "_longest")
+
+    def __init__(self, habit: Habit) -> None:
+        self.habit = habit
+        self.starts: list[int] = []
+        self.ends: list[int] = []
+        self._longest: int | None = None
+
+        ticked_days = habit.ticked_days
+        if ticked_days:
+            self._splice(*self._affected(ticked_days[0], ticked_days[-1]))
+
+    def _affected(
+        self, first: datetime.date, last: datetime.date
+    ) -> tuple[datetime.date, datetime.date]:
+        # Days whose status may depend on ticks in [first, last]
+        p = self.habit.period
+        if not p or p == EVERY_DAY:
+            return first, last
+
+        start = get_period_fist_day(first, p.period_type)
+        end = get_period_fist_day(last, p.period_type)
+        return (
+            date_move(start, -p.period_count, p.period_type),
+            date_move(end, p.period_count, p.period_type) - ONE_DAY,
+        )
+
+    def _splice(self, start: datetime.date, end: datetime.date) -> None:
+        lo, hi = start.toordinal(), end.toordinal()
+
+        # Segments overlapping or touching [lo, hi]
+        i = bisect_left(self.ends, lo - 1)
+        j = bisect_right(self.starts, hi + 1)
+
+        pieces = runs_of(completed_days(self.habit, start, end))
+        if i < j and self.starts[i] < lo:
+            pieces.insert(0, (self.starts[i], lo - 1))
+        if i < j and self.ends[j - 1] > hi:
+            pieces.append((hi + 1, self.ends[j - 1]))
+
+        merged: list[tuple[int, int]] = []
+        for a, b in pieces:
+            if merged and merged[-1][1] + 1 >= a:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], b))
+            else:
+                merged.append((a, b))
+
+        self.starts[i:j] = [a for a, _ in merged]
+        self.ends[i:j] = [b for _, b in merged]
+        self._longest = None
+
+    def update(self, day: datetime.date) -> None:
+        # Re-evaluate the periods around a ticked day
+        self._splice(*self._affected(day, day))
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def current(self, today: datetime.date) -> int:
+        # Length of the streak running through today or ending yesterday
+        i = bisect_right(self.starts, today.toordinal()) - 1
+        if i < 0 or self.ends[i] < today.toordinal() - 1:
+            return 0
+        return min(self.ends[i], today.toordinal()) - self.starts[i] + 1
+
+    def longest(self) -> int:
+        if self._longest is None:
+            self._longest = max(
+                (b - a + 1 for a, b in zip(self.starts, self.ends)), default=0
+            )
+        return self._longest
+
+    def recent(
+        self, n: int, start: datetime.date = datetime.date.min
+    ) -> list[tuple[datetime.date, int]]:
+        # Last n streaks as (first day, length), oldest first, cut at the
+        # period holding start: completed periods are always counted whole
+        p = self.habit.period
+        if p and p != EVERY_DAY and start > datetime.date.min:
+            start = get_period_fist_day(start, p.period_type)
+
+        lo = start.toordinal()
+        i = max(bisect_left(self.ends, lo), len(self.starts) - n)
+        return [
+            (datetime.date.fromordinal(max(a, lo)), b - max(a, lo) + 1)
+            for a, b in zip(self.starts[i:], self.ends[i:])
+        ]
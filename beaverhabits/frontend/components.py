@@ -135,7 +135,8 @@ async def habit_tick_dialog(habit: Habit, day: datetime.date):
 
     # if one week ago or earlier, show date label
     if (day + datetime.timedelta(days=10)) > today:
-        start = min(habit.ticked_days, default=day)
+        ticked_days = habit.ticked_days
+        start = ticked_days[0] if ticked_days else day
         label = utils.format_date_difference(start, day)
     else:
         label = f"{(today - day).days} days ago"
@@ -784,16 +785,11 @@ def grid(columns: int, rows: int | None = 1) -> ui.grid:
 def habit_history(today: datetime.date, habit: Habit, total_months: int = 13):
     # get lastest 6 months, e.g. Feb
     months, data = [], []
+    buckets = habit.buckets
     for i in range(total_months, 0, -1):
         offset_date = today - relativedelta(months=i)
         months.append(offset_date.strftime("%b"))
-
-        count = sum(
-            1
-            for x in habit.ticked_days
-            if x.month == offset_date.month and x.year == offset_date.year
-        )
-        data.append(count)
+        data.append(buckets.month(offset_date))
 
     echart = ui.echart(
         {
@@ -857,7 +853,7 @@ class HabitStreakBadge(ui.badge):
 class HabitTotalBadge(ui.badge):
     def __init__(self, habit: Habit) -> None:
         super().__init__()
-        self.bind_text_from(habit, "ticked_days", backward=lambda x: str(len(x)))
+        self.bind_text_from(habit, "buckets", backward=lambda x: str(x.total))
 
 
 class IndexBadge(ui.badge):
@@ -872,10 +868,9 @@ class IndexStreakBadge(HabitStreakBadge, IndexBadge):
         super().__init__(today, habit)
 
         # Accessibility
-        ticked_days = habit.ticked_days
         self.props(
             f' tabindex="0" '
-            f'aria-label="total completion: {len(ticked_days)};'
+            f'aria-label="total completion: {habit.buckets.total};'
             f'{index_total_badge_alternative_text(today, habit)}"'
         )
 
@@ -885,10 +880,9 @@ class IndexTotalBadge(HabitTotalBadge, IndexBadge):
         super().__init__(habit)
 
         # Accessibility
-        ticked_days = habit.ticked_days
         self.props(
             f' tabindex="0" '
-            f'aria-label="total completion: {len(ticked_days)};'
+            f'aria-label="total completion: {habit.buckets.total};'
             f'{index_total_badge_alternative_text(today, habit)}"'
         )
 
@@ -939,27 +933,13 @@ def habit_notes(habit: Habit, limit: int = 10):
 
 
 def compose_habit_streaks(today: datetime.date, habit: Habit):
-    status = get_habit_date_completion(habit, today.replace(year=today.year - 1), today)
-    dates = sorted(status.keys(), reverse=True)
-    if len(dates) <= 1:
+    # Last five streaks within a year
+    streaks = habit.streaks.recent(5, today.replace(year=today.year - 1))
+    if not streaks or streaks == [(streaks[0][0], 1)]:
         return
 
-    # find the streaks of the dates
-    months, data = [], []
-    streak_count = 1
-    for i in range(1, len(dates)):
-        if (dates[i] - dates[i - 1]).days == -1:
-            streak_count += 1
-        else:
-            months.insert(0, dates[i - 1])
-            data.insert(0, streak_count)
-            streak_count = 1
-            if len(months) >= 5:
-                break
-    else:
-        months.insert(0, dates[-1])
-        data.insert(0, streak_count)
-
+    months = [day for day, _ in streaks]
+    data = [length for _, length in streaks]
     return {"months": months, "data": data}
 
 
@@ -9,8 +9,10 @@ from beaverhabits.app.db import User
 from beaverhabits.frontend import icons
 from beaverhabits.frontend.layout import layout
 from beaverhabits.logger import logger
+from beaverhabits.storage.codec import decode_habit_list
 from beaverhabits.storage.dict import DictHabitList
 from beaverhabits.storage.storage import HabitList, HabitListBuilder, HabitStatus
+from beaverhabits.storage.writes import write_locks
 from beaverhabits.views import user_storage
 
 
@@ -29,7 +31,8 @@ async def import_from_json(text: str) -> HabitList:
             },
             ...
     """
-    habit_list = DictHabitList(json.loads(text))
+    # Backups may be written with a storage codec
+    habit_list = DictHabitList(decode_habit_list(json.loads(text)))
     if not habit_list.habits:
         raise ValueError("No habits found")
     return habit_list
@@ -101,7 +104,8 @@ def import_ui_page(user: User):
 
             # 1. Merge habtis with same habit id
             # 2. Add new habits
-            await habit_list.merge(other)
+            async with write_locks.hold(user):
+                await habit_list.merge(other)
 
             ui.notify(
                 f"Imported {len(added) + len(merged)} habits",
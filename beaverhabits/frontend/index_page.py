@@ -4,7 +4,7 @@ from typing import List
 from nicegui import ui
 
 from beaverhabits.configs import settings
-from beaverhabits.core.completions import get_habit_date_completion
+from beaverhabits.core.completions import CStatus, get_habits_date_completion
 from beaverhabits.frontend import javascript, textarea
 from beaverhabits.frontend.components import (
     HabitCheckBox,
@@ -63,13 +63,17 @@ def day_headers(days: list[datetime.date]):
         yield "#"
 
 
-def habit_row(habit: Habit, tag: str, days: list[datetime.date]):
+def habit_row(
+    habit: Habit,
+    tag: str,
+    days: list[datetime.date],
+    status_map: dict[datetime.date, list[CStatus]],
+):
     name = habit_name_menu(habit, index_page_ui.refresh)
     name.classes(LEFT_CLASSES)
     name.props(f'role="heading" aria-level="2" aria-label="{habit.name}"')
 
     today = max(days)
-    status_map = get_habit_date_completion(habit, min(days), today)
     for day in days:
         status = status_map.get(day, [])
         checkbox = HabitCheckBox(
@@ -104,6 +108,7 @@ def habit_list_ui(days: list[datetime.date], active_habits: List[Habit]):
 
         # Habit Rows
         groups = habits_by_tags(active_habits)
+        status_maps = get_habits_date_completion(active_habits, min(days), max(days))
 
         for tag, habit_list in groups.items():
             if not habit_list:
@@ -112,7 +117,7 @@ def habit_list_ui(days: list[datetime.date], active_habits: List[Habit]):
             for habit in habit_list:
                 with ui.card().classes(COMPAT_CLASSES).classes("theme-card-shadow"):
                     with grid(columns, 1):
-                        habit_row(habit, tag, days)
+                        habit_row(habit, tag, days, status_maps[str(habit.id)])
 
             ui.space()
 
@@ -5,13 +5,15 @@ from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 
 from beaverhabits.app.app import init_auth_routes
-from beaverhabits.app.db import create_db_and_tables
+from beaverhabits.app.db import create_db_and_tables, request_session_scope
 from beaverhabits.configs import settings
 from beaverhabits.logger import logger
 from beaverhabits.routes.api import init_api_routes
 from beaverhabits.routes.metrics import init_metrics_routes
+from beaverhabits.routes.middleware import DynamicMiddleware
 from beaverhabits.routes.routes import init_gui_routes
 from beaverhabits.scheduler import daily_backup_task
+from beaverhabits.storage.flusher import flusher
 
 logger.info("Starting BeaverHabits...")
 
@@ -41,6 +43,9 @@ async def lifespan(_: FastAPI):
 
     yield
 
+    # Write pending habit lists before NiceGUI cancels background tasks
+    await flusher.flush_all()
+
 
 app = FastAPI(lifespan=lifespan)
 
@@ -66,18 +71,22 @@ if settings.SENTRY_DSN:
     sentry_sdk.init(settings.SENTRY_DSN, send_default_pii=True)
 
 
-@app.middleware("http")
 async def Digest(request: Request, call_next):
     start_time = time.perf_counter()
-    response = await call_next(request)
+    async with request_session_scope() as scope:
+        response = await call_next(request)
     process_time = (time.perf_counter() - start_time) * 1000
     response.headers["X-Process-Time"] = str(process_time)
+    response.headers["X-DB-Queries"] = str(scope.queries)
     logger.info(
-        f"DIGEST {request.method} {request.url.path} {response.status_code} {process_time:.0f}ms"
+        f"DIGEST {request.method} {request.url.path} {response.status_code} {process_time:.0f}ms {scope.queries}q/{scope.sessions}s"
     )
     return response
 
 
+app.add_middleware(DynamicMiddleware, dispatch=Digest)
+
+
 if __name__ == "__main__":
     import uvicorn
 
@@ -0,0 +1,52 @@
+from dataclasses import dataclass
+
+from cachetools import TTLCache
+
+from beaverhabits.app import crud
+from beaverhabits.configs import settings
+
+# Whether a user (by email) is on the pro plan, checked on most clicks
+entitlement_cache: TTLCache[str, bool] = TTLCache(
+    maxsize=settings.ENTITLEMENT_CACHE_SIZE, ttl=settings.ENTITLEMENT_CACHE_TTL
+)
+entitlement_cache_stats = {"hits": 0, "misses": 0}
+
+
+@dataclass
+class _Lookups:
+    # Lookups of an email in flight, and invalidations of it since the first
+    count: int = 0
+    generation: int = 0
+
+
+# Only emails being looked up, so a lookup racing with an invalidation of
+# the same email is not cached
+_lookups: dict[str, _Lookups] = {}
+
+
+async def get_entitlement(email: str) -> bool:
+    if (activated := entitlement_cache.get(email)) is not None:
+        entitlement_cache_stats["hits"] += 1
+        return activated
+
+    entitlement_cache_stats["misses"] += 1
+    lookups = _lookups.setdefault(email, _Lookups())
+    lookups.count += 1
+    generation = lookups.generation
+    try:
+        customer = await crud.get_user_identity(email)
+    finally:
+        lookups.count -= 1
+        if not lookups.count:
+            del _lookups[email]
+
+    activated = bool(customer and customer.activated)
+    if generation == lookups.generation:
+        entitlement_cache[email] = activated
+    return activated
+
+
+def invalidate_entitlement(email: str) -> None:
+    if (lookups := _lookups.get(email)) is not None:
+        lookups.generation += 1
+    entitlement_cache.pop(email, None)
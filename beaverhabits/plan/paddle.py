@@ -11,6 +11,7 @@ from paddle_billing.Notifications.Requests.Headers import Headers
 from beaverhabits.app import crud
 from beaverhabits.configs import settings
 from beaverhabits.logger import logger
+from beaverhabits.plan.entitlements import invalidate_entitlement
 
 router = APIRouter()
 
@@ -63,7 +64,8 @@ async def transaction(data: dict) -> None:
     if not customer_id:
         logger.warning("Transaction completed missing customer_id in payload")
         return
-    await crud.update_user_identity(customer_id, data=data, activate=True)
+    customer = await crud.update_user_identity(customer_id, data=data, activate=True)
+    invalidate_entitlement(customer.email)
     logger.info(f"Transaction completed for customer_id: {customer_id}")
 
 
@@ -78,7 +80,8 @@ async def refund(data: dict) -> None:
         return
 
     customer_id = data["customer_id"]
-    await crud.update_user_identity(customer_id, data=data, activate=False)
+    customer = await crud.update_user_identity(customer_id, data=data, activate=False)
+    invalidate_entitlement(customer.email)
     logger.info(f"Refund for customer_id: {customer_id}")
 
 
@@ -3,10 +3,11 @@ import random
 
 from nicegui import app, ui
 
-from beaverhabits.app import crud
-from beaverhabits.app.auth import user_from_token
+from beaverhabits.app.auth import jwt_expiry, user_from_token
+from beaverhabits.app.token_cache import cache_token_user, get_token_user
 from beaverhabits.configs import settings
 from beaverhabits.logger import logger
+from beaverhabits.plan.entitlements import get_entitlement
 from beaverhabits.storage.meta import page_path
 from beaverhabits.storage.storage import HabitList, HabitStatus
 
@@ -33,12 +34,16 @@ async def check_pro() -> bool:
         return True
 
     token = app.storage.user.get("auth_token")
-    user = await user_from_token(token)
-    if user:
-        customer = await crud.get_user_identity(user.email)
-        if customer and customer.activated:
-            logger.info(f"User is Pro: {user.email}, {customer.id}")
-            return True
+    if not token:
+        return False
+
+    # Both lookups are in memory after the first click
+    user = get_token_user(token)
+    if user is None and (user := await user_from_token(token)):
+        cache_token_user(token, user, jwt_expiry(token))
+    if user and await get_entitlement(user.email):
+        logger.info(f"User is Pro: {user.email}")
+        return True
 
     return False
 
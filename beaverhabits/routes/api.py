@@ -8,7 +8,11 @@ from pydantic import BaseModel
 from beaverhabits import views
 from beaverhabits.app.db import User
 from beaverhabits.app.dependencies import current_active_user
-from beaverhabits.core.completions import CStatus, get_habit_date_completion
+from beaverhabits.core.completions import (
+    CStatus,
+    get_habit_date_completion,
+    get_habits_date_completion,
+)
 from beaverhabits.storage.storage import (
     Habit,
     HabitFrequency,
@@ -16,6 +20,7 @@ from beaverhabits.storage.storage import (
     HabitListBuilder,
     HabitStatus,
 )
+from beaverhabits.storage.writes import write_locks
 
 api_router = APIRouter()
 
@@ -42,19 +47,41 @@ async def get_habits_meta(
 async def put_habits_meta(
     meta: HabitListMeta,
     habit_list: HabitList = Depends(current_habit_list),
+    user: User = Depends(current_active_user),
 ):
-    if meta.order is not None:
-        habit_list.order = meta.order
+    async with write_locks.hold(user):
+        if meta.order is not None:
+            habit_list.order = meta.order
     return {"order": habit_list.order}
 
 
 @api_router.get("/habits", tags=["habits"])
 async def get_habits(
     status: HabitStatus = HabitStatus.ACTIVE,
+    date_fmt: str = "%d-%m-%Y",
+    date_start: str | None = None,
+    date_end: str | None = None,
     habit_list: HabitList = Depends(current_habit_list),
 ):
     habits = HabitListBuilder(habit_list).status(status).build()
-    return [{"id": x.id, "name": x.name} for x in habits]
+    if not date_start or not date_end:
+        return [{"id": x.id, "name": x.name} for x in habits]
+
+    # Include completions of all habits within the date range
+    start, end = parse_date_range(date_start, date_end, date_fmt)
+    status_maps = get_habits_date_completion(habits, start, end)
+    return [
+        {
+            "id": x.id,
+            "name": x.name,
+            "completions": [
+                day.strftime(date_fmt)
+                for day, stat in sorted(status_maps[str(x.id)].items())
+                if CStatus.DONE in stat
+            ],
+        }
+        for x in habits
+    ]
 
 
 class CreateHabit(BaseModel):
@@ -66,11 +93,11 @@ async def post_habits(
     habit: CreateHabit,
     user: User = Depends(current_active_user),
 ):
-    habit_list = await views.get_or_create_user_habit_list(
-        user, views.dummy_empty_habit_list()
-    )
-
-    id = await habit_list.add(habit.name)
+    async with write_locks.hold(user):
+        habit_list = await views.get_or_create_user_habit_list(
+            user, views.dummy_empty_habit_list()
+        )
+        id = await habit_list.add(habit.name)
     logger.info(f"Created new habit {id} for user {user.email}")
 
     return {"id": id, "name": habit.name}
@@ -104,21 +131,22 @@ async def put_habit(
     habit: UpdateHabit,
     user: User = Depends(current_active_user),
 ):
-    existing_habit = await views.get_user_habit(user, habit_id)
-    if habit.name is not None:
-        existing_habit.name = habit.name
-    if habit.star is not None:
-        existing_habit.star = habit.star
-    if habit.status is not None:
-        existing_habit.status = habit.status
-    if habit.period is not None:
-        existing_habit.period = HabitFrequency(
-            target_count=habit.period.target_count,
-            period_count=habit.period.period_count,
-            period_type=habit.period.period_type,
-        )
-    if habit.tags is not None:
-        existing_habit.tags = habit.tags
+    async with write_locks.hold(user):
+        existing_habit = await views.get_user_habit(user, habit_id)
+        if habit.name is not None:
+            existing_habit.name = habit.name
+        if habit.star is not None:
+            existing_habit.star = habit.star
+        if habit.status is not None:
+            existing_habit.status = habit.status
+        if habit.period is not None:
+            existing_habit.period = HabitFrequency(
+                target_count=habit.period.target_count,
+                period_count=habit.period.period_count,
+                period_type=habit.period.period_type,
+            )
+        if habit.tags is not None:
+            existing_habit.tags = habit.tags
 
     return format_json_response(existing_habit)
 
@@ -128,23 +156,15 @@ async def delete_habit(
     habit_id: str,
     user: User = Depends(current_active_user),
 ):
-    habit = await views.get_user_habit(user, habit_id)
-    await views.remove_user_habit(user, habit)
+    async with write_locks.hold(user):
+        habit = await views.get_user_habit(user, habit_id)
+        await views.remove_user_habit(user, habit)
     return format_json_response(habit)
 
 
-@api_router.get("/habits/{habit_id}/completions", tags=["habits"])
-async def get_habit_completions(
-    habit_id: str,
-    status: str | None = None,
-    date_fmt: str = "%d-%m-%Y",
-    date_start: str | None = None,
-    date_end: str | None = None,
-    limit: int | None = 10,
-    sort="asc",
-    user: User = Depends(current_active_user),
-):
-    # Parse date range
+def parse_date_range(
+    date_start: str | None, date_end: str | None, date_fmt: str
+) -> tuple[datetime.date, datetime.date]:
     start, end = datetime.date.min, datetime.date.max
     if date_start:
         try:
@@ -160,6 +180,21 @@ async def get_habit_completions(
         raise HTTPException(
             status_code=400, detail="date_start cannot be after date_end"
         )
+    return start, end
+
+
+@api_router.get("/habits/{habit_id}/completions", tags=["habits"])
+async def get_habit_completions(
+    habit_id: str,
+    status: str | None = None,
+    date_fmt: str = "%d-%m-%Y",
+    date_start: str | None = None,
+    date_end: str | None = None,
+    limit: int | None = 10,
+    sort="asc",
+    user: User = Depends(current_active_user),
+):
+    start, end = parse_date_range(date_start, date_end, date_fmt)
 
     # Parse status filter
     cstatus_list = [CStatus.DONE]
@@ -207,11 +242,62 @@ async def put_habit_completions(
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid date format")
 
-    habit = await views.get_user_habit(user, habit_id)
-    await habit.tick(day, tick.done, tick.text)
+    async with write_locks.hold(user):
+        habit = await views.get_user_habit(user, habit_id)
+        await habit.tick(day, tick.done, tick.text)
     return {"day": day.strftime(tick.date_fmt), "done": tick.done}
 
 
+class BatchTick(Tick):
+    habit_id: str
+
+
+class BatchTicks(BaseModel):
+    ticks: list[BatchTick]
+
+
+MAX_BATCH_TICKS = 1000
+
+
+@api_router.post("/completions:batch", tags=["habits"])
+async def post_completions_batch(
+    batch: BatchTicks,
+    user: User = Depends(current_active_user),
+):
+    if len(batch.ticks) > MAX_BATCH_TICKS:
+        raise HTTPException(
+            status_code=400, detail=f"At most {MAX_BATCH_TICKS} ticks per batch"
+        )
+
+    # All ticks under one lock, the habit list is then written once
+    results = []
+    async with write_locks.hold(user):
+        habit_list = await views.get_user_habit_list(user)
+        if not habit_list:
+            raise HTTPException(status_code=404, detail="No habits found")
+        habits = {h.id: h for h in habit_list.habits}
+
+        for tick in batch.ticks:
+            result = {"habit_id": tick.habit_id, "day": tick.date, "done": tick.done}
+            results.append(result)
+            try:
+                day = datetime.datetime.strptime(
+                    tick.date, tick.date_fmt.strip()
+                ).date()
+            except ValueError:
+                result.update(status=400, detail="Invalid date format")
+                continue
+            if (habit := habits.get(tick.habit_id)) is None:
+                result.update(status=404, detail="Habit not found")
+                continue
+
+            await habit.tick(day, tick.done, tick.text)
+            result.update(day=day.strftime(tick.date_fmt), status=200)
+
+    logger.info(f"Applied {len(results)} batched ticks for user {user.email}")
+    return results
+
+
 def format_json_response(habit: Habit) -> dict:
     return {
         "id": habit.id,
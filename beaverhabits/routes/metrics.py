@@ -1,5 +1,7 @@
 import asyncio
 import gc
+import hashlib
+import heapq
 import platform
 import tracemalloc
 
@@ -9,6 +11,20 @@ from fastapi import APIRouter, FastAPI, HTTPException, status
 from fastapi.responses import Response
 from psutil._common import bytes2human
 
+from beaverhabits.app.passwords import password_helper, password_pool
+from beaverhabits.app.token_cache import token_cache, token_cache_stats
+from beaverhabits.core.completions import completion_cache, completion_cache_stats
+from beaverhabits.plan.entitlements import entitlement_cache, entitlement_cache_stats
+from beaverhabits.storage import (
+    user_database_storage,
+    user_disk_storage,
+    user_relational_storage,
+)
+from beaverhabits.storage.flusher import flusher
+from beaverhabits.storage.residency import Residency
+from beaverhabits.storage.user_db import write_stats
+from beaverhabits.storage.writes import UserWriteLocks, write_locks
+
 try:
     from beaverhabits.version import IDENTITY
 except:
@@ -54,11 +70,150 @@ mem_available {mem_available}
 uncollectable_count {uncollectable_count}
 # TYPE object_count gauge
 object_count {object_count}
+# HELP completion_cache_hits Habit completion lookups served from cache.
+# TYPE completion_cache_hits counter
+completion_cache_hits {completion_cache_hits}
+# TYPE completion_cache_misses counter
+completion_cache_misses {completion_cache_misses}
+# TYPE completion_cache_size gauge
+completion_cache_size {completion_cache_size}
+# HELP token_cache_hits Bearer tokens resolved from cache.
+# TYPE token_cache_hits counter
+token_cache_hits {token_cache_hits}
+# TYPE token_cache_misses counter
+token_cache_misses {token_cache_misses}
+# TYPE token_cache_size gauge
+token_cache_size {token_cache_size}
+# HELP entitlement_cache_hits Pro plan checks answered from cache.
+# TYPE entitlement_cache_hits counter
+entitlement_cache_hits {entitlement_cache_hits}
+# TYPE entitlement_cache_misses counter
+entitlement_cache_misses {entitlement_cache_misses}
+# TYPE entitlement_cache_size gauge
+entitlement_cache_size {entitlement_cache_size}
+# HELP password_hash_in_flight Password hashes queued or running.
+# TYPE password_hash_in_flight gauge
+password_hash_in_flight {password_hash_in_flight}
+# HELP password_hash_queue_seconds Time password hashes waited for a thread.
+# TYPE password_hash_queue_seconds summary
+password_hash_queue_seconds_sum {password_hash_queue_seconds_sum}
+password_hash_queue_seconds_count {password_hash_count}
+# TYPE password_hash_seconds summary
+password_hash_seconds_sum {password_hash_seconds_sum}
+password_hash_seconds_count {password_hash_count}
+# HELP password_hash_inline Password hashes run on the event loop.
+# TYPE password_hash_inline counter
+password_hash_inline {password_hash_inline}
+# HELP habit_list_flush_queue Habit lists waiting to be written.
+# TYPE habit_list_flush_queue gauge
+habit_list_flush_queue {habit_list_flush_queue}
+# TYPE habit_list_flush_coalesced counter
+habit_list_flush_coalesced {habit_list_flush_coalesced}
+# TYPE habit_list_flush_seconds summary
+habit_list_flush_seconds_sum {habit_list_flush_seconds_sum}
+habit_list_flush_seconds_count {habit_list_flush_seconds_count}
+# HELP habit_list_write_skipped Flushes skipped as the list was unchanged.
+# TYPE habit_list_write_skipped counter
+habit_list_write_skipped {habit_list_write_skipped}
+# HELP habit_list_write_conflicts Writes retried after another writer.
+# TYPE habit_list_write_conflicts counter
+habit_list_write_conflicts {habit_list_write_conflicts}
+# HELP habit_list_lock_acquired Habit list write locks taken.
+# TYPE habit_list_lock_acquired counter
+habit_list_lock_acquired {habit_list_lock_acquired}
+# HELP habit_list_lock_wait_seconds Waits for a lock held for the same user.
+# TYPE habit_list_lock_wait_seconds summary
+habit_list_lock_wait_seconds_sum {habit_list_lock_wait_seconds_sum}
+habit_list_lock_wait_seconds_count {habit_list_lock_wait_seconds_count}
+# HELP habit_list_lock_user_wait_seconds Waits of the most contended recent users, by hashed id.
+# TYPE habit_list_lock_user_wait_seconds summary
+{habit_list_lock_user_wait_seconds}
+# HELP user_disk_resident User files loaded in memory.
+# TYPE user_disk_resident gauge
+user_disk_resident {user_disk_resident}
+# TYPE user_disk_hits counter
+user_disk_hits {user_disk_hits}
+# TYPE user_disk_misses counter
+user_disk_misses {user_disk_misses}
+# TYPE user_disk_shared counter
+user_disk_shared {user_disk_shared}
+# HELP user_disk_revived Evicted user files reused while still referenced.
+# TYPE user_disk_revived counter
+user_disk_revived {user_disk_revived}
+# TYPE user_disk_evicted counter
+user_disk_evicted {user_disk_evicted}
+# TYPE user_disk_expired counter
+user_disk_expired {user_disk_expired}
+# HELP user_db_resident Database habit lists loaded in memory.
+# TYPE user_db_resident gauge
+user_db_resident {user_db_resident}
+# TYPE user_db_hits counter
+user_db_hits {user_db_hits}
+# TYPE user_db_misses counter
+user_db_misses {user_db_misses}
+# HELP user_db_shared Loads joining one already in flight.
+# TYPE user_db_shared counter
+user_db_shared {user_db_shared}
+# TYPE user_db_revived counter
+user_db_revived {user_db_revived}
+# TYPE user_db_evicted counter
+user_db_evicted {user_db_evicted}
+# TYPE user_db_expired counter
+user_db_expired {user_db_expired}
+# HELP user_relational_resident Relational habit lists loaded in memory.
+# TYPE user_relational_resident gauge
+user_relational_resident {user_relational_resident}
+# TYPE user_relational_hits counter
+user_relational_hits {user_relational_hits}
+# TYPE user_relational_misses counter
+user_relational_misses {user_relational_misses}
+# TYPE user_relational_shared counter
+user_relational_shared {user_relational_shared}
+# TYPE user_relational_revived counter
+user_relational_revived {user_relational_revived}
+# TYPE user_relational_evicted counter
+user_relational_evicted {user_relational_evicted}
+# TYPE user_relational_expired counter
+user_relational_expired {user_relational_expired}
 """
 
 
+# Contended users exported, those that waited the longest
+LOCK_CONTENTION_TOP = 10
+
+
+def user_label(user_id) -> str:
+    # Never the id itself, a short hash is enough to tell hot accounts apart
+    return hashlib.blake2b(str(user_id).encode(), digest_size=6).hexdigest()
+
+
+def lock_contention_metrics(locks: UserWriteLocks) -> str:
+    top = heapq.nlargest(
+        LOCK_CONTENTION_TOP, locks.users.items(), key=lambda x: x[1].wait_seconds
+    )
+    text = ""
+    for user_id, x in top:
+        label = user_label(user_id)
+        text += (
+            f'habit_list_lock_user_wait_seconds_sum{{user="{label}"}} {x.wait_seconds}\n'
+            f'habit_list_lock_user_wait_seconds_count{{user="{label}"}} {x.waits}\n'
+        )
+    return text
+
+
+def residency_metrics(prefix: str, *residencies: Residency) -> dict:
+    return {
+        f"{prefix}_resident": sum(len(x) for x in residencies),
+        **{
+            f"{prefix}_{name}": sum(getattr(x, name) for x in residencies)
+            for name in ("hits", "misses", "shared", "revived", "evicted", "expired")
+        },
+    }
+
+
 @router.get("/metrics", tags=["metrics"])
-def exporter():
+async def exporter():
+    # On the loop: the caches and locks read here are only changed there
     # Memory heap and stats
     process = psutil.Process()
     memory_info = process.memory_info()
@@ -69,6 +224,33 @@ def exporter():
         mem_available=ram.available,  # available memory
         uncollectable_count=len(gc.garbage),  # number of uncollectable objects
         object_count=len(gc.get_objects()),
+        completion_cache_hits=completion_cache_stats["hits"],
+        completion_cache_misses=completion_cache_stats["misses"],
+        completion_cache_size=len(completion_cache),
+        token_cache_hits=token_cache_stats["hits"],
+        token_cache_misses=token_cache_stats["misses"],
+        token_cache_size=len(token_cache),
+        entitlement_cache_hits=entitlement_cache_stats["hits"],
+        entitlement_cache_misses=entitlement_cache_stats["misses"],
+        entitlement_cache_size=len(entitlement_cache),
+        password_hash_in_flight=password_pool.in_flight,
+        password_hash_queue_seconds_sum=password_pool.queue_seconds,
+        password_hash_seconds_sum=password_pool.run_seconds,
+        password_hash_count=password_pool.count,
+        password_hash_inline=password_helper.inline,
+        habit_list_flush_queue=len(flusher.dirty),
+        habit_list_flush_coalesced=flusher.coalesced,
+        habit_list_flush_seconds_sum=flusher.flush_seconds,
+        habit_list_flush_seconds_count=flusher.flush_count,
+        habit_list_write_skipped=write_stats["skipped"],
+        habit_list_write_conflicts=write_stats["conflicts"],
+        habit_list_lock_acquired=write_locks.acquired,
+        habit_list_lock_wait_seconds_sum=write_locks.wait_seconds,
+        habit_list_lock_wait_seconds_count=write_locks.contended,
+        habit_list_lock_user_wait_seconds=lock_contention_metrics(write_locks),
+        **residency_metrics("user_disk", user_disk_storage.habit_lists),
+        **residency_metrics("user_db", user_database_storage.habit_lists),
+        **residency_metrics("user_relational", user_relational_storage.habit_lists),
     )
 
     return Response(content=text, media_type="text/plain")
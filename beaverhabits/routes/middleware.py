@@ -0,0 +1,38 @@
+from starlette.datastructures import MutableHeaders
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.types import Message, Receive, Scope, Send
+
+# Assets served as files: no session, no auth header and no digest log
+STATIC_PATH_PREFIXES = ("/_nicegui/", "/statics/", "/_astro/", "/favicon.ico")
+STATIC_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def is_static_path(path: str) -> bool:
+    return path.startswith(STATIC_PATH_PREFIXES)
+
+
+def static_cache_send(send: Send) -> Send:
+    # Assets NiceGUI does not set a Cache-Control on, e.g. non-versioned ones
+    async def wrapped(message: Message) -> None:
+        if message["type"] == "http.response.start" and message["status"] < 400:
+            headers = MutableHeaders(scope=message)
+            headers.setdefault("Cache-Control", STATIC_CACHE_CONTROL)
+        await send(message)
+
+    return wrapped
+
+
+class DynamicMiddleware(BaseHTTPMiddleware):
+    """
+    An http middleware static asset requests go around.
+
+    A page load fetches dozens of assets, each of them would otherwise pay
+    for the dispatch, and the task and stream BaseHTTPMiddleware wraps
+    around the rest of the stack.
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and is_static_path(scope["path"]):
+            await self.app(scope, receive, static_cache_send(send))
+            return
+        await super().__call__(scope, receive, send)
@@ -40,6 +40,7 @@ from beaverhabits.frontend.streaks import heatmap_page
 from beaverhabits.frontend.tokens_page import tokens_page
 from beaverhabits.logger import logger
 from beaverhabits.routes.google_one_tap import google_one_tap_login
+from beaverhabits.routes.middleware import DynamicMiddleware
 from beaverhabits.storage import image_storage
 from beaverhabits.storage.meta import GUI_ROOT_PATH
 from beaverhabits.utils import dummy_days, fetch_user_dark_mode, get_user_today_date
@@ -331,7 +332,6 @@ def init_gui_routes(fastapi_app: FastAPI):
             if exception.status_code == status.HTTP_429_TOO_MANY_REQUESTS:
                 ui.notify(f"An error occurred: {exception}", type="negative")
 
-    @app.middleware("http")
     async def AuthMiddleware(request: Request, call_next):
         logger.debug(f"AuthMiddleware: {request.url.path}")
         if token := app.storage.user.get("auth_token"):
@@ -352,14 +352,8 @@ def init_gui_routes(fastapi_app: FastAPI):
 
         return response
 
-    @app.middleware("http")
-    async def StaticFilesCacheMiddleware(request: Request, call_next):
-        response = await call_next(request)
-
-        path = request.url.path
-        if path.startswith("/_nicegui/"):
-            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
-        return response
+    # Static assets go around it, with a Cache-Control unless they have one
+    app.add_middleware(DynamicMiddleware, dispatch=AuthMiddleware)
 
     oneyear = 365 * 24 * 60 * 60
     app.add_static_files("/statics", "statics", max_cache_age=oneyear)
@@ -4,11 +4,12 @@ from beaverhabits.storage.session_memory import SessionDictStorage
 from beaverhabits.storage.storage import SessionStorage, UserStorage
 from beaverhabits.storage.user_db import UserDatabaseStorage
 from beaverhabits.storage.user_file import UserDiskStorage
+from beaverhabits.storage.user_relational import UserRelationalStorage
 
 session_storage = SessionDictStorage()
 user_disk_storage = UserDiskStorage()
 user_database_storage = UserDatabaseStorage()
-sqlite_storage = None
+user_relational_storage = UserRelationalStorage()
 
 # TODO: retrieve image storage backend for each user
 image_storage = DatabaseImageStorage()
@@ -25,4 +26,7 @@ def get_user_dict_storage() -> UserStorage:
     if settings.HABITS_STORAGE == StorageType.USER_DATABASE:
         return user_database_storage
 
+    if settings.HABITS_STORAGE == StorageType.USER_RELATIONAL:
+        return user_relational_storage
+
     raise NotImplementedError("Storage type not implemented")
@@ -0,0 +1,138 @@
+import base64
+import datetime
+import json
+import zlib
+
+from beaverhabits.configs import StorageCodec
+from beaverhabits.storage.columnar import RecordColumns
+
+# Stored habit lists carrying this key are encoded, the others are plain JSON
+FORMAT_KEY = "format"
+VARINT_FORMAT = "varint"
+VARINT_ZLIB_FORMAT = "varint+zlib"
+
+
+def write_varint(out: bytearray, n: int) -> None:
+    while n >= 0x80:
+        out.append(n & 0x7F | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def read_varint(buf: bytes, pos: int) -> tuple[int, int]:
+    n = shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        n |= (b & 0x7F) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+
+def encode_records(records: list[dict]) -> str:
+    """
+    Records of a habit as base64 of:
+
+    count                   varint
+    day ordinals            varint each, delta from the previous day
+    done                    bitmap, (count + 7) // 8 bytes, little endian
+    note count              varint
+    notes                   varint index, varint length, utf-8 text
+    """
+    columns = RecordColumns.from_records(records)
+    out = bytearray()
+
+    write_varint(out, len(columns.days))
+    prev = 0
+    for ordinal in columns.days:
+        write_varint(out, ordinal - prev)
+        prev = ordinal
+    out += columns.done.to_bytes((len(columns.days) + 7) // 8, "little")
+
+    write_varint(out, len(columns.notes))
+    for i, ordinal in enumerate(columns.days):
+        if ordinal in columns.notes:
+            text = columns.notes[ordinal].encode()
+            write_varint(out, i)
+            write_varint(out, len(text))
+            out += text
+
+    return base64.b64encode(out).decode("ascii")
+
+
+def decode_records(blob: str) -> list[dict]:
+    buf = base64.b64decode(blob)
+
+    count, pos = read_varint(buf, 0)
+    days, prev = [], 0
+    for _ in range(count):
+        # Most deltas are a few days, a single byte
+        if buf[pos] < 0x80:
+            prev += buf[pos]
+            pos += 1
+        else:
+            delta, pos = read_varint(buf, pos)
+            prev += delta
+        days.append(prev)
+    size = (count + 7) // 8
+    done = int.from_bytes(buf[pos : pos + size], "little")
+    pos += size
+
+    # Least significant bit first, isoformat is DAY_MASK and cheaper
+    bits = f"{done:b}"[::-1].ljust(count, "0")
+    fromordinal = datetime.date.fromordinal
+    records = [
+        {"day": fromordinal(x).isoformat(), "done": b == "1"}
+        for x, b in zip(days, bits)
+    ]
+
+    note_count, pos = read_varint(buf, pos)
+    for _ in range(note_count):
+        i, pos = read_varint(buf, pos)
+        length, pos = read_varint(buf, pos)
+        records[i]["text"] = buf[pos : pos + length].decode()
+        pos += length
+
+    return records
+
+
+def encode_habit_list(data: dict, codec: StorageCodec) -> dict:
+    if codec == StorageCodec.JSON:
+        return data
+
+    encoded = {k: v for k, v in data.items() if k != "habits"}
+    encoded["habits"] = [
+        {**habit, "records": encode_records(habit.get("records", []))}
+        for habit in data.get("habits", [])
+    ]
+    encoded[FORMAT_KEY] = VARINT_FORMAT
+    if codec == StorageCodec.VARINT:
+        return encoded
+
+    payload = zlib.compress(json.dumps(encoded).encode())
+    return {
+        FORMAT_KEY: VARINT_ZLIB_FORMAT,
+        "payload": base64.b64encode(payload).decode("ascii"),
+    }
+
+
+def decode_habit_list(data: dict) -> dict:
+    # Chosen by the marker, so rows written with any codec can be read
+    format = data.get(FORMAT_KEY)
+    if format is None:
+        return data
+
+    if format == VARINT_ZLIB_FORMAT:
+        data = json.loads(zlib.decompress(base64.b64decode(data["payload"])))
+        format = data.get(FORMAT_KEY)
+
+    if format != VARINT_FORMAT:
+        raise ValueError(f"Unknown habit list format: {format}")
+
+    decoded = {k: v for k, v in data.items() if k not in ("habits", FORMAT_KEY)}
+    decoded["habits"] = [
+        {**habit, "records": decode_records(habit["records"])}
+        for habit in data.get("habits", [])
+    ]
+    return decoded
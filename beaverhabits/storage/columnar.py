@@ -0,0 +1,184 @@
+import datetime
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter
+from typing import Iterable, Self
+
+DAY_MASK = "%Y-%m-%d"
+
+
+def parse_day(value: str) -> datetime.date:
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        # e.g. "2024-1-1" from CSV imports
+        return datetime.datetime.strptime(value, DAY_MASK).date()
+
+
+class CalendarBuckets:
+    """
+    Done counts bucketed by calendar period:
+
+    weeks:  {(ISO year, ISO week): count}
+    months: {(year, month): count}
+    years:  {year: count}
+    """
+
+    __slots__ = ("weeks", "months", "years", "total")
+
+    def __init__(self) -> None:
+        self.weeks: Counter[tuple[int, int]] = Counter()
+        self.months: Counter[tuple[int, int]] = Counter()
+        self.years: Counter[int] = Counter()
+        self.total = 0
+
+    @classmethod
+    def from_days(cls, days: Iterable[datetime.date]) -> Self:
+        buckets = cls()
+        for day in days:
+            buckets.add(day)
+        return buckets
+
+    def add(self, day: datetime.date, count: int = 1) -> None:
+        self.weeks[day.isocalendar()[:2]] += count
+        self.months[(day.year, day.month)] += count
+        self.years[day.year] += count
+        self.total += count
+
+    def week(self, day: datetime.date) -> int:
+        return self.weeks[day.isocalendar()[:2]]
+
+    def month(self, day: datetime.date) -> int:
+        return self.months[(day.year, day.month)]
+
+    def year(self, day: datetime.date) -> int:
+        return self.years[day.year]
+
+
+class RecordColumns:
+    """
+    Read index over the JSON records of a habit, laid out column by
+    column and sorted by day:
+
+    days:   day ordinals, array('i')
+    done:   bitmap, bit i is set when days[i] is done
+    notes:  sparse {ordinal: text}, only for records carrying a note
+    rows:   position of each record in the list it was built from,
+            -1 if unknown
+
+    One entry per day, the last record wins when indexing duplicates.
+
+    The records stay the source of truth, the index is only ever built
+    from them and rows points back into them.
+    """
+
+    __slots__ = ("days", "done", "notes", "rows", "_ticked_days", "_buckets")
+
+    def __init__(self) -> None:
+        self.days = array("i")
+        self.done = 0
+        self.notes: dict[int, str] = {}
+        self.rows = array("i")
+        self._ticked_days: list[datetime.date] | None = None
+        self._buckets: CalendarBuckets | None = None
+
+    @classmethod
+    def from_records(cls, records: Iterable[dict]) -> Self:
+        latest: dict[int, tuple[int, dict]] = {}
+        for row, record in enumerate(records):
+            latest[parse_day(record["day"]).toordinal()] = (row, record)
+
+        columns = cls()
+        for i, ordinal in enumerate(sorted(latest)):
+            row, record = latest[ordinal]
+            columns.days.append(ordinal)
+            columns.rows.append(row)
+            if record.get("done", False):
+                columns.done |= 1 << i
+            if "text" in record:
+                columns.notes[ordinal] = record["text"]
+
+        return columns
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+    def index(self, day: datetime.date) -> int | None:
+        ordinal = day.toordinal()
+        i = bisect_left(self.days, ordinal)
+        if i < len(self.days) and self.days[i] == ordinal:
+            return i
+        return None
+
+    def is_done(self, i: int) -> bool:
+        return bool(self.done >> i & 1)
+
+    def set(
+        self, day: datetime.date, done: bool, text: str | None = None, row: int = -1
+    ) -> int:
+        ordinal = day.toordinal()
+        i = bisect_left(self.days, ordinal)
+        if i < len(self.days) and self.days[i] == ordinal:
+            was_done = self.is_done(i)
+            mask = 1 << i
+            self.done = self.done | mask if done else self.done & ~mask
+            if row >= 0:
+                self.rows[i] = row
+        else:
+            was_done = False
+            self.days.insert(i, ordinal)
+            self.rows.insert(i, row)
+            low = self.done & ((1 << i) - 1)
+            self.done = low | (self.done >> i << (i + 1)) | (int(done) << i)
+
+        if was_done != done:
+            if self._buckets is not None:
+                self._buckets.add(day, 1 if done else -1)
+            if (ticked := self._ticked_days) is not None:
+                if done:
+                    insort(ticked, day)
+                else:
+                    del ticked[bisect_left(ticked, day)]
+
+        if text is not None:
+            self.notes[ordinal] = text
+
+        return i
+
+    def _span(self, start: datetime.date, end: datetime.date) -> tuple[int, int]:
+        lo = bisect_left(self.days, start.toordinal())
+        hi = bisect_right(self.days, end.toordinal())
+        return lo, max(lo, hi)
+
+    def _done_bits(self, lo: int, hi: int) -> int:
+        return self.done >> lo & ((1 << (hi - lo)) - 1)
+
+    def ticked_count(self, start: datetime.date, end: datetime.date) -> int:
+        lo, hi = self._span(start, end)
+        return self._done_bits(lo, hi).bit_count()
+
+    def ticked_between(
+        self, start: datetime.date, end: datetime.date
+    ) -> list[datetime.date]:
+        lo, hi = self._span(start, end)
+        if lo == hi:
+            return []
+
+        # Least significant bit first, without the "0b" prefix
+        bits = bin(self._done_bits(lo, hi))[:1:-1]
+        days, fromordinal = self.days, datetime.date.fromordinal
+        return [fromordinal(days[lo + i]) for i, b in enumerate(bits) if b == "1"]
+
+    @property
+    def ticked_days(self) -> list[datetime.date]:
+        if self._ticked_days is None:
+            self._ticked_days = self.ticked_between(
+                datetime.date.min, datetime.date.max
+            )
+        return self._ticked_days
+
+    @property
+    def buckets(self) -> CalendarBuckets:
+        if self._buckets is None:
+            self._buckets = CalendarBuckets.from_days(self.ticked_days)
+        return self._buckets
@@ -1,7 +1,15 @@
 import datetime
+import itertools
 from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
 
 from beaverhabits.logger import logger
+from beaverhabits.storage.columnar import (
+    DAY_MASK,
+    CalendarBuckets,
+    RecordColumns,
+    parse_day,
+)
 from beaverhabits.storage.storage import (
     Backup,
     CheckedRecord,
@@ -13,9 +21,15 @@ from beaverhabits.storage.storage import (
 )
 from beaverhabits.utils import generate_short_hash
 
-DAY_MASK = "%Y-%m-%d"
+if TYPE_CHECKING:
+    from beaverhabits.core.streaks import StreakIndex
+
 MONTH_MASK = "%Y/%m"
 
+# Habit revisions come from one process-wide counter, so a (habit id, revision)
+# pair is never reused, not even by two wrappers of the same habit
+_revisions = itertools.count(1)
+
 
 @dataclass(init=False)
 class DictStorage:
@@ -41,8 +55,7 @@ class DictRecord(CheckedRecord, DictStorage):
 
     @property
     def day(self) -> datetime.date:
-        date = datetime.datetime.strptime(self.data["day"], DAY_MASK)
-        return date.date()
+        return parse_day(self.data["day"])
 
     @property
     def done(self) -> bool:
@@ -67,8 +80,50 @@ class HabitDataCache:
         self.refresh()
 
     def refresh(self):
-        self.ticked_days = [r.day for r in self.habit.records if r.done]
-        self.ticked_data = {r.day: r for r in self.habit.records}
+        # Rebuilt from the records, which remain the only copy stored
+        self.columns = RecordColumns.from_records(self.habit.data["records"])
+        self._ticked_data: dict[datetime.date, DictRecord] | None = None
+        self._streaks: "StreakIndex | None" = None
+
+    def update(self, record: DictRecord, row: int = -1) -> None:
+        # Index a single record just inserted or updated in the records
+        self.columns.set(record.day, record.done, record.data.get("text"), row)
+        if self._ticked_data is not None:
+            self._ticked_data[record.day] = record
+        if self._streaks is not None:
+            self._streaks.update(record.day)
+
+    def reset_streaks(self) -> None:
+        self._streaks = None
+
+    @property
+    def streaks(self) -> "StreakIndex":
+        # core.completions imports the storage package
+        from beaverhabits.core.streaks import StreakIndex
+
+        if self._streaks is None:
+            self._streaks = StreakIndex(self.habit)
+        return self._streaks
+
+    def record_by(self, day: datetime.date) -> DictRecord | None:
+        i = self.columns.index(day)
+        if i is None:
+            return None
+        return DictRecord(self.habit.data["records"][self.columns.rows[i]])
+
+    @property
+    def ticked_days(self) -> list[datetime.date]:
+        return self.columns.ticked_days
+
+    @property
+    def ticked_data(self) -> dict[datetime.date, DictRecord]:
+        if self._ticked_data is None:
+            records = self.habit.data["records"]
+            self._ticked_data = {
+                datetime.date.fromordinal(x): DictRecord(records[row])
+                for x, row in zip(self.columns.days, self.columns.rows)
+            }
+        return self._ticked_data
 
 
 @dataclass
@@ -78,6 +133,15 @@ class DictHabit(Habit[DictRecord], DictStorage):
         self.data = data
         self._habit_list = habit_list
         self.cache = HabitDataCache(self)
+        self._revision = next(_revisions)
+
+    @property
+    def revision(self) -> int:
+        return self._revision
+
+    def touch(self) -> None:
+        # Called on every change that affects completions
+        self._revision = next(_revisions)
 
     @property
     def habit_list(self) -> HabitList:
@@ -100,6 +164,7 @@ class DictHabit(Habit[DictRecord], DictStorage):
     @name.setter
     def name(self, value: str) -> None:
         self.data["name"] = value
+        self._habit_list.version += 1
 
     @property
     def tags(self) -> list[str]:
@@ -108,6 +173,7 @@ class DictHabit(Habit[DictRecord], DictStorage):
     @tags.setter
     def tags(self, value: list[str]) -> None:
         self.data["tags"] = list(value)
+        self._habit_list.version += 1
 
     @property
     def star(self) -> bool:
@@ -116,6 +182,7 @@ class DictHabit(Habit[DictRecord], DictStorage):
     @star.setter
     def star(self, value: int) -> None:
         self.data["star"] = value
+        self._habit_list.version += 1
 
     @property
     def status(self) -> HabitStatus:
@@ -134,6 +201,7 @@ class DictHabit(Habit[DictRecord], DictStorage):
     @status.setter
     def status(self, value: HabitStatus) -> None:
         self.data["status"] = value.value
+        self._habit_list.version += 1
 
     @property
     def records(self) -> list[DictRecord]:
@@ -154,6 +222,8 @@ class DictHabit(Habit[DictRecord], DictStorage):
 
     @period.setter
     def period(self, value: HabitFrequency | None) -> None:
+        self.touch()
+        self.cache.reset_streaks()
         if value is None:
             self.data["period"] = None
             return
@@ -180,17 +250,34 @@ class DictHabit(Habit[DictRecord], DictStorage):
         if end is None:
             end = datetime.date.max
 
-        return sum(1 for day in self.ticked_days if start <= day <= end)
+        return self.cache.columns.ticked_count(start, end)
+
+    def ticked_between(
+        self, start: datetime.date, end: datetime.date
+    ) -> list[datetime.date]:
+        return self.cache.columns.ticked_between(start, end)
 
     @property
     def ticked_data(self) -> dict[datetime.date, DictRecord]:
         return self.cache.ticked_data
 
+    @property
+    def streaks(self) -> "StreakIndex":
+        return self.cache.streaks
+
+    @property
+    def buckets(self) -> CalendarBuckets:
+        return self.cache.columns.buckets
+
+    def record_by(self, day: datetime.date) -> DictRecord | None:
+        return self.cache.record_by(day)
+
     async def tick(
         self, day: datetime.date, done: bool, text: str | None = None
     ) -> CheckedRecord:
         # Find the record in the cache
-        record = self.ticked_data.get(day)
+        record = self.record_by(day)
+        row = -1
 
         if record is not None:
             # Update only if necessary to avoid unnecessary writes
@@ -208,11 +295,15 @@ class DictHabit(Habit[DictRecord], DictStorage):
             if text is not None:
                 data["text"] = text
             self.data["records"].append(data)
+            # Wrap the stored (possibly observable) dict, not the local one
+            row = len(self.data["records"]) - 1
+            record = DictRecord(self.data["records"][row])
 
         # Update the cache
-        self.cache.refresh()
+        self.cache.update(record, row)
+        self.touch()
 
-        return self.ticked_data[day]
+        return record
 
     async def merge(self, other: "DictHabit") -> None:
         self_ticks = {r.day for r in self.records if r.done}
@@ -221,6 +312,8 @@ class DictHabit(Habit[DictRecord], DictStorage):
         self.data["records"] = [
             {"day": day.strftime(DAY_MASK), "done": True} for day in result
         ]
+        self.cache.refresh()
+        self.touch()
 
     def copy(self) -> "Habit":
         new_data = {
@@ -249,9 +342,25 @@ class DictHabit(Habit[DictRecord], DictStorage):
 
 @dataclass
 class DictHabitList(HabitList[DictHabit], DictStorage):
+    # Habit wrappers keyed by habit id, reused across accesses
+    pool: dict[str, DictHabit] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+    version: int = field(default=0, init=False, repr=False, compare=False)
+    views: dict[tuple, list[DictHabit]] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+
     @property
     def habits(self) -> list[DictHabit]:
-        return [DictHabit(d, self) for d in self.data["habits"]]
+        habits = []
+        for d in self.data["habits"]:
+            habit = self.pool.get(d.get("id"))
+            if habit is None or habit.data is not d:
+                habit = DictHabit(d, self)
+                self.pool[habit.id] = habit
+            habits.append(habit)
+        return habits
 
     @property
     def order(self) -> list[str]:
@@ -260,6 +369,7 @@ class DictHabitList(HabitList[DictHabit], DictStorage):
     @order.setter
     def order(self, value: list[str]) -> None:
         self.data["order"] = value
+        self.version += 1
 
     @property
     def order_by(self) -> HabitOrder:
@@ -277,6 +387,7 @@ class DictHabitList(HabitList[DictHabit], DictStorage):
     @order_by.setter
     def order_by(self, value: HabitOrder) -> None:
         self.data["order_by"] = value.value
+        self.version += 1
 
     @property
     def backup(self) -> Backup:
@@ -304,10 +415,22 @@ class DictHabitList(HabitList[DictHabit], DictStorage):
         id = generate_short_hash(name)
         d = {"name": name, "records": [], "id": id, "tags": tags or []}
         self.data["habits"].append(d)
+        self.pool.pop(id, None)
+        self.version += 1
         return id
 
     async def remove(self, item: DictHabit) -> None:
         self.data["habits"].remove(item.data)
+        self.pool.pop(item.id, None)
+        self.version += 1
+
+    def refresh(self) -> None:
+        # The data was changed underneath the wrappers, by a merge of a
+        # concurrent write for instance
+        for habit in self.pool.values():
+            habit.cache.refresh()
+            habit.touch()
+        self.version += 1
 
     async def merge(self, other: "DictHabitList") -> None:
         # Add new habits
@@ -322,3 +445,6 @@ class DictHabitList(HabitList[DictHabit], DictStorage):
             for other_habit in other.habits:
                 if self_habit == other_habit:
                     await self_habit.merge(other_habit)
+
+        self.pool.clear()
+        self.version += 1
@@ -0,0 +1,104 @@
+import asyncio
+import time
+from typing import Hashable, Protocol
+
+from loguru import logger
+from nicegui import background_tasks
+
+from beaverhabits.app.db import User, request_session
+from beaverhabits.configs import settings
+from beaverhabits.storage.writes import write_locks
+
+
+class PendingWrite(Protocol):
+    user: User
+
+    @property
+    def flush_key(self) -> Hashable: ...
+
+    async def flush(self) -> None: ...
+
+
+class HabitListFlusher:
+    """
+    Coalesces habit list writes: a changed list is marked dirty and written
+    by a worker at most once per window, whatever the number of mutations
+    in between.
+    """
+
+    def __init__(self, window: float) -> None:
+        self.window = window
+        self.dirty: dict[Hashable, PendingWrite] = {}
+        self.writing: dict[Hashable, PendingWrite] = {}
+        self.workers: dict[Hashable, asyncio.Task] = {}
+
+        # Metrics
+        self.coalesced = 0
+        self.flush_count = 0
+        self.flush_seconds = 0.0
+
+    def mark(self, d: PendingWrite) -> None:
+        key = d.flush_key
+        if key in self.dirty:
+            self.coalesced += 1
+        self.dirty[key] = d
+
+        if key not in self.workers:
+            self.workers[key] = background_tasks.create(
+                self._worker(key), name=f"flush-{d.user.email}"
+            )
+
+    async def _worker(self, key: Hashable) -> None:
+        # Started by a request, but writing on sessions of its own
+        request_session.set(None)
+        try:
+            # Changes made while writing are picked up by the next round
+            while key in self.dirty:
+                await asyncio.sleep(self.window)
+                await self._flush(key)
+        finally:
+            self.workers.pop(key, None)
+
+    async def _flush(self, key: Hashable) -> None:
+        d = self.dirty.get(key)
+        if d is None:
+            return
+
+        # One write per user at a time, none while a handler is changing it
+        async with write_locks.hold(d.user):
+            # Changes made while waiting go out with this write
+            d = self.dirty.pop(key, None)
+            if d is None:
+                return
+
+            start = time.perf_counter()
+            self.writing[key] = d
+            try:
+                await d.flush()
+            except Exception as e:
+                logger.exception(
+                    f"[backup]failed to update habit list for user {d.user.email}: {e}"
+                )
+            finally:
+                self.writing.pop(key, None)
+                self.flush_count += 1
+                self.flush_seconds += time.perf_counter() - start
+
+    def pending(self, user: User) -> list[PendingWrite]:
+        # Lists of the user with changes not written yet, newer than the
+        # stored ones
+        writes = {id(d): d for d in (*self.dirty.values(), *self.writing.values())}
+        return [d for d in writes.values() if str(d.user.id) == str(user.id)]
+
+    async def flush(self, d: PendingWrite) -> None:
+        # Write one list now, after the write of it going on if any
+        async with write_locks.hold(d.user):
+            await self._flush(d.flush_key)
+
+    async def flush_all(self) -> None:
+        # Write everything pending now, without waiting for the window
+        for key in list(self.dirty):
+            await self._flush(key)
+
+
+flusher = HabitListFlusher(settings.DATABASE_FLUSH_WINDOW)
@@ -0,0 +1,160 @@
+import copy
+from abc import ABC, abstractmethod
+from typing import Any, Iterable
+
+from beaverhabits.app.crud import HabitRowChanges
+from beaverhabits.app.db import User
+from beaverhabits.configs import settings
+from beaverhabits.logger import logger
+from beaverhabits.storage.columnar import DAY_MASK, parse_day
+from beaverhabits.storage.user_relational import (
+    HABITS,
+    RECORDS,
+    HabitRowsDict,
+    habit_fields,
+    habit_ids,
+    record_rows,
+    to_record,
+)
+
+# Journal entries, one per changed row:
+#
+# {"op": "list", "data": {...}}                    list fields but the habits
+# {"op": "habit", "id": ..., "position": 0, "data": {...}}
+# {"op": "remove", "id": ...}
+# {"op": "record", "id": ..., "day": "2024-01-01", "done": true, "text": ...}
+# {"op": "unrecord", "id": ..., "day": "2024-01-01"}
+
+
+def journal_entries(changes: HabitRowChanges) -> list[dict]:
+    entries: list[dict] = []
+    if changes.list_data is not None:
+        entries.append({"op": "list", "data": changes.list_data})
+    for habit_id in sorted(changes.removed_habits):
+        entries.append({"op": "remove", "id": habit_id})
+    for habit_id, (position, data) in changes.habits.items():
+        entries.append(
+            {"op": "habit", "id": habit_id, "position": position, "data": data}
+        )
+    for habit_id, days in changes.removed_records.items():
+        for day in days:
+            entries.append(
+                {"op": "unrecord", "id": habit_id, "day": day.strftime(DAY_MASK)}
+            )
+    for habit_id, rows in changes.records.items():
+        for row in rows:
+            entries.append({"op": "record", "id": habit_id, **to_record(row)})
+    return entries
+
+
+def replay(snapshot: dict, entries: Iterable[dict]) -> dict:
+    # Apply the entries in order, every entry sets a whole row so replaying
+    # one twice gives the same list
+    habits = snapshot.get(HABITS, [])
+    list_data = {k: copy.deepcopy(v) for k, v in snapshot.items() if k != HABITS}
+    rows = {
+        habit_id: [i, habit_fields(habit), record_rows(habit)]
+        for i, (habit_id, habit) in enumerate(zip(habit_ids(habits), habits))
+    }
+
+    for entry in entries:
+        op = entry["op"]
+        if op == "list":
+            list_data = copy.deepcopy(entry["data"])
+        elif op == "remove":
+            rows.pop(entry["id"], None)
+        elif op == "habit":
+            row = rows.setdefault(entry["id"], [0, {}, {}])
+            row[0], row[1] = entry["position"], copy.deepcopy(entry["data"])
+        elif entry["id"] in rows:
+            records = rows[entry["id"]][2]
+            day = parse_day(entry["day"])
+            if op == "record":
+                records[day] = (day, entry["done"], entry.get("text"))
+            else:
+                records.pop(day, None)
+
+    data = list_data
+    data[HABITS] = [
+        {
+            **fields,
+            "id": habit_id,
+            RECORDS: [to_record(row) for row in sorted(records.values())],
+        }
+        for habit_id, (_, fields, records) in sorted(
+            rows.items(), key=lambda x: x[1][0]
+        )
+    ]
+    return data
+
+
+def has_stable_ids(snapshot: dict) -> bool:
+    ids = [habit.get("id") for habit in snapshot.get(HABITS, [])]
+    return None not in ids and len(set(ids)) == len(ids)
+
+
+class Journal(ABC):
+    """
+    A habit list stored as a snapshot plus the changes made since.
+
+    Each flush appends a few small entries; once there are enough of them
+    the journal is replayed into a new snapshot and truncated.
+    """
+
+    @abstractmethod
+    async def read(self) -> tuple[dict, list[dict], Any]:
+        """Snapshot, entries and the position after the last entry."""
+
+    @abstractmethod
+    async def append(self, entries: list[dict]) -> None: ...
+
+    @abstractmethod
+    async def write(self, data: dict, position: Any) -> None:
+        """Store a snapshot covering the entries up to position."""
+
+    async def load(self) -> tuple[dict, int]:
+        snapshot, entries, position = await self.read()
+        data = replay(snapshot, entries)
+
+        # Entries refer to habits by id, pin the ones just assigned
+        if not has_stable_ids(snapshot):
+            await self.write(data, position)
+            return data, 0
+
+        return data, len(entries)
+
+    async def compact(self) -> None:
+        snapshot, entries, position = await self.read()
+        if entries:
+            await self.write(replay(snapshot, entries), position)
+
+
+class JournalPersistentDict(HabitRowsDict):
+    def __init__(self, user: User, data: dict, journal: Journal, size: int) -> None:
+        self.journal = journal
+        self.size = size
+        super().__init__(user, data)
+
+    async def flush(self) -> None:
+        changes = self.changes()
+        if not changes:
+            return
+
+        entries = journal_entries(changes)
+        try:
+            await self.journal.append(entries)
+        except Exception:
+            self.rewind()
+            raise
+        self.written(changes)
+
+        self.size += len(entries)
+        if self.size < settings.HABITS_JOURNAL_COMPACT_SIZE:
+            return
+
+        try:
+            await self.journal.compact()
+            self.size = 0
+        except Exception as e:
+            # The entries are kept, compaction is tried again on the next flush
+            logger.exception(f"Failed to compact journal of {self.user.email}: {e}")
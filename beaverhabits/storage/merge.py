@@ -0,0 +1,91 @@
+import copy
+import datetime
+
+from beaverhabits.app.crud import RecordRow
+from beaverhabits.storage.columnar import parse_day
+from beaverhabits.storage.user_relational import (
+    HABITS,
+    RECORDS,
+    record_rows,
+    to_record,
+)
+
+_MISSING = object()
+
+
+def _merge_fields(ours: dict, base: dict, theirs: dict, skip: set[str]) -> None:
+    # Fields they changed and we did not
+    for key in (base.keys() | theirs.keys()) - skip:
+        value, base_value = theirs.get(key, _MISSING), base.get(key, _MISSING)
+        if value == base_value or ours.get(key, _MISSING) != base_value:
+            continue
+        if value is _MISSING:
+            ours.pop(key, None)
+        else:
+            ours[key] = copy.deepcopy(value)
+
+
+def _set_record(records: list, day: datetime.date, row: RecordRow | None) -> None:
+    rows = [i for i, record in enumerate(records) if parse_day(record["day"]) == day]
+    if row is None:
+        for i in reversed(rows):
+            del records[i]
+        return
+
+    record = to_record(row)
+    if not rows:
+        records.append(record)
+        return
+
+    # The last record of a day is the one read, drop the others
+    for i in reversed(rows[:-1]):
+        del records[i]
+    target = records[rows[-1] - len(rows) + 1]
+    target.update(record)
+    if "text" not in record:
+        target.pop("text", None)
+
+
+def _merge_records(ours: dict, base: dict, theirs: dict) -> None:
+    base_rows, their_rows = record_rows(base), record_rows(theirs)
+    our_rows = record_rows(ours)
+    for day in base_rows.keys() | their_rows.keys():
+        row = their_rows.get(day)
+        if row == base_rows.get(day) or our_rows.get(day) != base_rows.get(day):
+            continue
+        _set_record(ours.setdefault(RECORDS, []), day, row)
+
+
+def _by_id(habits: list[dict]) -> dict[str, dict]:
+    return {habit["id"]: habit for habit in habits if "id" in habit}
+
+
+def merge_habit_list(ours: dict, base: dict, theirs: dict) -> None:
+    """
+    Three-way merge of a habit list written elsewhere into ours, in place.
+
+    base is the list both started from. Their changes to the list fields,
+    habits and records are applied where we did not change the same field,
+    habit or day; where both did, ours is kept.
+    """
+    _merge_fields(ours, base, theirs, {HABITS})
+
+    base_habits = _by_id(base.get(HABITS, []))
+    their_habits = _by_id(theirs.get(HABITS, []))
+    our_habits = _by_id(ours.get(HABITS, []))
+
+    # Removed by them and left alone by us
+    for habit_id in base_habits.keys() - their_habits.keys():
+        habit = our_habits.pop(habit_id, None)
+        if habit is not None and habit == base_habits[habit_id]:
+            ours[HABITS].remove(habit)
+
+    for habit_id, habit in their_habits.items():
+        if habit_id not in base_habits:
+            # Added by them
+            if habit_id not in our_habits:
+                ours[HABITS].append(copy.deepcopy(habit))
+        elif habit_id in our_habits:
+            base_habit, our_habit = base_habits[habit_id], our_habits[habit_id]
+            _merge_fields(our_habit, base_habit, habit, {"id", RECORDS})
+            _merge_records(our_habit, base_habit, habit)
@@ -0,0 +1,129 @@
+import asyncio
+import weakref
+from typing import Awaitable, Callable, Generic, Hashable, TypeVar
+
+from cachetools import Cache, TTLCache
+from nicegui import background_tasks
+
+from beaverhabits.logger import logger
+
+V = TypeVar("V")
+
+
+class _ResidentCache(TTLCache):
+    def __init__(self, maxsize: int, ttl: float, residency: "Residency") -> None:
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self.residency = residency
+
+    def expire(self, time=None):
+        expired = super().expire(time)
+        self.residency.expired += len(expired)
+        for key, value in expired:
+            self.residency.evict(key, value)
+        return expired
+
+    def popitem(self):
+        key, value = super().popitem()
+        self.residency.evicted += 1
+        self.residency.evict(key, value)
+        return key, value
+
+
+class Residency(Generic[V]):
+    """
+    Loaded documents kept in memory: at most maxsize of them, each until it
+    has been idle for ttl seconds.
+
+    An evicted document is flushed, and kept until its pending writes have
+    landed. It may also still be referenced, by an open page for instance.
+    Either way it is revived on the next access instead of being loaded
+    again, so there is never more than one live copy per key and a pending
+    write is never read back stale.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: float,
+        flush: Callable[[V], Awaitable[None]] | None = None,
+    ) -> None:
+        self.resident: TTLCache = _ResidentCache(maxsize, ttl, self)
+        self.alive: weakref.WeakValueDictionary[Hashable, V] = (
+            weakref.WeakValueDictionary()
+        )
+        self.flush = flush
+        # Evicted documents whose writes have not landed yet
+        self.flushing: dict[Hashable, V] = {}
+        self.loading: dict[Hashable, asyncio.Future[V]] = {}
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.revived = 0
+        self.evicted = 0
+        self.expired = 0
+        self.shared = 0
+
+    def get(self, key: Hashable) -> V | None:
+        self.resident.expire()
+
+        value = self.resident.get(key)
+        if value is not None:
+            self.hits += 1
+        elif (value := self.alive.get(key)) is not None:
+            self.revived += 1
+        else:
+            self.misses += 1
+            return None
+
+        # Idle time counts from the last access
+        self.resident[key] = value
+        return value
+
+    def put(self, key: Hashable, value: V) -> None:
+        self.resident[key] = value
+        self.alive[key] = value
+
+    def evict(self, key: Hashable, value: V) -> None:
+        if self.flush is None:
+            return
+
+        self.flushing[key] = value
+        background_tasks.create(self._flush(key, value), name=f"evict-{key}")
+
+    async def _flush(self, key: Hashable, value: V) -> None:
+        try:
+            await self.flush(value)
+        except Exception as e:
+            logger.exception(f"Failed to flush evicted document {key}: {e}")
+        finally:
+            if self.flushing.get(key) is value:
+                del self.flushing[key]
+
+    async def get_or_load(self, key: Hashable, load: Callable[[], Awaitable[V]]) -> V:
+        if (value := self.get(key)) is not None:
+            return value
+
+        # Concurrent loads of the same key share the first one
+        future = self.loading.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._load(key, load))
+            self.loading[key] = future
+        else:
+            self.shared += 1
+
+        # A cancelled caller must not cancel the load for the others
+        return await asyncio.shield(future)
+
+    async def _load(self, key: Hashable, load: Callable[[], Awaitable[V]]) -> V:
+        try:
+            value = await load()
+            self.put(key, value)
+            return value
+        finally:
+            self.loading.pop(key, None)
+
+    def __len__(self) -> int:
+        # Idle documents still count: TTLCache's own len would expire (and
+        # evict) them, which must only happen on access, on the loop
+        return Cache.__len__(self.resident)
@@ -2,13 +2,17 @@ import datetime
 import re
 from dataclasses import asdict, dataclass
 from enum import Enum, auto
-from typing import List, Literal, Optional, Protocol, Self
+from typing import TYPE_CHECKING, List, Literal, Optional, Protocol, Self
 
 from dataclasses_json import DataClassJsonMixin
 
 from beaverhabits.app.db import User
 from beaverhabits.utils import PERIOD_TYPES, D
 
+if TYPE_CHECKING:
+    from beaverhabits.core.streaks import StreakIndex
+    from beaverhabits.storage.columnar import CalendarBuckets
+
 
 class CheckedRecord(Protocol):
     @property
@@ -145,6 +149,9 @@ class Habit[R: CheckedRecord](Protocol):
     @chips.setter
     def chips(self, value: list[str]) -> None: ...
 
+    @property
+    def revision(self) -> int: ...
+
     @property
     def ticked_days(self) -> list[datetime.date]: ...
 
@@ -152,9 +159,19 @@ class Habit[R: CheckedRecord](Protocol):
         self, start: datetime.date | None = None, end: datetime.date | None = None
     ) -> int: ...
 
+    def ticked_between(
+        self, start: datetime.date, end: datetime.date
+    ) -> list[datetime.date]: ...
+
     @property
     def ticked_data(self) -> dict[datetime.date, R]: ...
 
+    @property
+    def streaks(self) -> "StreakIndex": ...
+
+    @property
+    def buckets(self) -> "CalendarBuckets": ...
+
     def record_by(self, day: datetime.date) -> Optional[R]:
         return self.ticked_data.get(day)
 
@@ -185,6 +202,10 @@ class Backup(DataClassJsonMixin):
 
 
 class HabitList[H: Habit](Protocol):
+    # Bumped on every change to the habits, their order or sorting fields
+    version: int
+    # Lists built by HabitListBuilder, keyed by version and filters
+    views: dict[tuple, List[H]]
 
     @property
     def habits(self) -> List[H]: ...
@@ -240,26 +261,39 @@ class HabitListBuilder:
         return self
 
     def build(self) -> List[Habit]:
-        # Deep copy the list
-        habits = [x for x in self.habit_list.habits if x.status in self.status_list]
-
-        # sort by order
-        if self.habit_list.order_by == HabitOrder.NAME:
-            habits.sort(key=lambda x: x.name.lower())
-        elif self.habit_list.order_by == HabitOrder.CATEGORY:
-            habits.sort(key=lambda x: (0, x.tags[0].lower()) if x.tags else (1, ""))
-        elif o := self.habit_list.order:
-            habits.sort(
-                key=lambda x: (o.index(str(x.id)) if str(x.id) in o else float("inf"))
+        habit_list = self.habit_list
+        views = habit_list.views
+        key = (habit_list.version, self.status_list, habit_list.order_by)
+        if (habits := views.get(key)) is None:
+            # Views of an older version are stale, the others are kept
+            if views and next(iter(views))[0] != habit_list.version:
+                views.clear()
+            habits = self._sort(
+                [x for x in habit_list.habits if x.status in self.status_list]
             )
+            views[key] = habits
 
-        # sort by star
-        habits.sort(key=lambda x: x.star, reverse=True)
+        # Shallow copy the list
+        return list(habits)
 
-        # Sort by status
-        all_status = HabitStatus.all()
-        habits.sort(key=lambda x: all_status.index(x.status))
+    def _sort(self, habits: List[Habit]) -> List[Habit]:
+        # Sort by status, then star, then order in one pass
+        all_status = {x: i for i, x in enumerate(HabitStatus.all())}
 
+        order_by = self.habit_list.order_by
+        if order_by == HabitOrder.NAME:
+            order = lambda x: x.name.lower()
+        elif order_by == HabitOrder.CATEGORY:
+            order = lambda x: (0, x.tags[0].lower()) if x.tags else (1, "")
+        elif o := self.habit_list.order:
+            position: dict[str, float] = {}
+            for i, habit_id in enumerate(o):
+                position.setdefault(habit_id, i)
+            order = lambda x: position.get(str(x.id), float("inf"))
+        else:
+            order = lambda x: 0
+
+        habits.sort(key=lambda x: (all_status[x.status], not x.star, order(x)))
         return habits
 
 
@@ -1,44 +1,181 @@
-from loguru import logger
-from nicegui import background_tasks, core
+import json
+import weakref
+from typing import Hashable
+
+from nicegui import core
 from nicegui.storage import observables
 
 from beaverhabits.app import crud
-from beaverhabits.app.db import User
+from beaverhabits.app.db import HabitListModel, User
+from beaverhabits.configs import settings
+from beaverhabits.logger import logger
+from beaverhabits.storage.codec import decode_habit_list, encode_habit_list
 from beaverhabits.storage.dict import DictHabitList
+from beaverhabits.storage.flusher import flusher
+from beaverhabits.storage.journal import Journal, JournalPersistentDict
+from beaverhabits.storage.merge import merge_habit_list
+from beaverhabits.storage.residency import Residency
 from beaverhabits.storage.storage import UserStorage
 
+# Writes expecting a version someone else has moved past are merged with
+# the newer one and retried, a few times at most
+MAX_WRITE_ATTEMPTS = 3
+write_stats = {"skipped": 0, "conflicts": 0}
+
 
 class DatabasePersistentDict(observables.ObservableDict):
 
-    def __init__(self, user: User, data: dict) -> None:
+    def __init__(
+        self,
+        user: User,
+        data: dict,
+        version: int = 0,
+        digest: str | None = None,
+        written: str | None = None,
+    ) -> None:
         self.user = user
+        # Version, content hash and json of the stored list, the last one is
+        # the base changes written elsewhere are merged against
+        self.version = version
+        self.digest = digest
+        self.written = written
+        # The live list wrapping this dict, refreshed after a merge
+        self.habit_list: weakref.ref[DictHabitList] | None = None
         super().__init__(data, on_change=self.backup)
 
-    def backup(self) -> None:
-        async def async_backup() -> None:
-            try:
-                await crud.update_user_habit_list(self.user, self)
-            except Exception as e:
-                logger.exception(
-                    f"[backup]failed to update habit list for user {self.user.email}: {e}"
-                )
+    @property
+    def flush_key(self) -> Hashable:
+        # The whole document is written, the latest one wins
+        return self.user.id
 
-        if core.loop and core.loop.is_running():
-            background_tasks.create_lazy(
-                async_backup(), name=f"backup-{self.user.email}"
+    async def flush(self) -> None:
+        # Serialized once, before any await: edits made while it is being
+        # saved are neither stored nor taken as the merge base
+        content = crud.habit_list_json(encode_habit_list(self, settings.HABITS_CODEC))
+        digest = crud.habit_list_digest(content)
+        if digest == self.digest:
+            write_stats["skipped"] += 1
+            return
+
+        for _ in range(MAX_WRITE_ATTEMPTS):
+            if await crud.save_user_habit_list(
+                self.user, content, digest, self.version
+            ):
+                self.version, self.digest = self.version + 1, digest
+                self.written = content
+                return
+
+            stored = await crud.get_user_habit_list(self.user)
+            if stored is None:
+                await crud.update_user_habit_list(self.user, content)
+                self.version, self.digest = 0, digest
+                self.written = content
+                return
+
+            write_stats["conflicts"] += 1
+            logger.warning(
+                f"Habit list of {self.user.email} was written elsewhere: "
+                f"version {self.version} -> {stored.version}"
             )
+            self.merge(stored)
+            content = crud.habit_list_json(
+                encode_habit_list(self, settings.HABITS_CODEC)
+            )
+            digest = crud.habit_list_digest(content)
+            if digest == self.digest:
+                return
+
+        raise Exception(
+            f"Habit list of {self.user.email} kept changing, "
+            f"gave up after {MAX_WRITE_ATTEMPTS} attempts"
+        )
+
+    def wrap(self) -> DictHabitList:
+        habit_list = DictHabitList(self)
+        self.habit_list = weakref.ref(habit_list)
+        return habit_list
+
+    def merge(self, stored: HabitListModel) -> None:
+        # Their changes go under ours, the retry writes both
+        base = decode_habit_list(json.loads(self.written)) if self.written else {}
+        merge_habit_list(self, base, decode_habit_list(stored.data))
+        self.version, self.digest = stored.version, stored.digest
+        self.written = json.dumps(stored.data)
+
+        habit_list = self.habit_list() if self.habit_list else None
+        if habit_list is not None:
+            habit_list.refresh()
+
+    def backup(self) -> None:
+        if core.loop and core.loop.is_running():
+            flusher.mark(self)
         else:
             raise RuntimeError("No event loop found for scheduling backup")
 
 
+class DatabaseJournal(Journal):
+    """Snapshot in the habit_list row, entries in the habit_journal table."""
+
+    def __init__(self, user: User) -> None:
+        self.user = user
+
+    async def read(self) -> tuple[dict, list[dict], int]:
+        user_habit_list = await crud.get_user_habit_list(self.user)
+        if user_habit_list is None:
+            raise Exception(f"User habit list not found for user {self.user.email}")
+
+        rows = await crud.get_user_habit_journal(self.user)
+        snapshot = decode_habit_list(user_habit_list.data)
+        return snapshot, [x.entry for x in rows], rows[-1].id if rows else 0
+
+    async def append(self, entries: list[dict]) -> None:
+        await crud.append_user_habit_journal(self.user, entries)
+
+    async def write(self, data: dict, position: int) -> None:
+        data = encode_habit_list(data, settings.HABITS_CODEC)
+        await crud.compact_user_habit_journal(self.user, data, position)
+
+
 class UserDatabaseStorage(UserStorage[DictHabitList]):
+    def __init__(self) -> None:
+        # Live habit lists, written through by the flusher, and before they
+        # may be dropped
+        self.habit_lists: Residency[DictHabitList] = Residency(
+            settings.user_cache_max_size(),
+            settings.user_cache_ttl(),
+            flush=lambda habit_list: flusher.flush(habit_list.data),
+        )
+
     async def get_user_habit_list(self, user: User) -> DictHabitList:
+        return await self.habit_lists.get_or_load(
+            user.id, lambda: self._load_habit_list(user)
+        )
+
+    async def _load_habit_list(self, user: User) -> DictHabitList:
+        # Dropped with a write still queued, the stored list is older
+        for d in flusher.pending(user):
+            if isinstance(d, DatabasePersistentDict):
+                return d.wrap()
+            if isinstance(d, JournalPersistentDict):
+                return DictHabitList(d)
+
+        if settings.HABITS_JOURNAL:
+            journal = DatabaseJournal(user)
+            data, size = await journal.load()
+            return DictHabitList(JournalPersistentDict(user, data, journal, size))
+
         user_habit_list = await crud.get_user_habit_list(user)
         if user_habit_list is None:
             raise Exception(f"User habit list not found for user {user.email}")
 
-        d = DatabasePersistentDict(user, user_habit_list.data)
-        return DictHabitList(d)
+        d = DatabasePersistentDict(
+            user,
+            decode_habit_list(user_habit_list.data),
+            user_habit_list.version,
+            user_habit_list.digest,
+            json.dumps(user_habit_list.data),
+        )
+        return d.wrap()
 
     async def init_user_habit_list(self, user: User, habit_list: DictHabitList) -> None:
         user_habit_list = await crud.get_user_habit_list(user)
@@ -47,4 +184,5 @@ class UserDatabaseStorage(UserStorage[DictHabitList]):
                 f"User habit list already exists for user {user.email}, cannot overwrite"
             )
 
-        await crud.update_user_habit_list(user, habit_list.data)
+        data = encode_habit_list(habit_list.data, settings.HABITS_CODEC)
+        await crud.update_user_habit_list(user, data)
@@ -1,77 +1,277 @@
+import asyncio
+import contextlib
 import json
+import os
 from pathlib import Path
-from typing import Optional
+from typing import Any, Callable, Iterator, Optional
 
 import aiofiles
-from fastapi_users_db_sqlalchemy import UUID_ID
 from nicegui import background_tasks, core, observables
 
 from beaverhabits.app.db import User
-from beaverhabits.configs import USER_DATA_FOLDER
+from beaverhabits.configs import USER_DATA_FOLDER, settings
 from beaverhabits.logger import logger
+from beaverhabits.storage.codec import decode_habit_list, encode_habit_list
 from beaverhabits.storage.dict import DictHabitList
+from beaverhabits.storage.flusher import flusher
+from beaverhabits.storage.journal import Journal, JournalPersistentDict
+from beaverhabits.storage.residency import Residency
 from beaverhabits.storage.storage import UserStorage
+from beaverhabits.storage.writes import write_locks
 
 KEY_NAME = "data"
 
+# Habit lists are split down to each habit's fields when serialized
+JSON_CHUNK_DEPTH = 4
+
+
+def iter_json(value: Any, depth: int = JSON_CHUNK_DEPTH) -> Iterator[str]:
+    # json.dumps in pieces: the encoder holds the GIL for a whole call, so a
+    # worker thread only lets the event loop run in between
+    if depth and isinstance(value, dict) and value:
+        sep = "{"
+        for k, v in value.items():
+            yield f"{sep}{json.dumps(str(k))}: "
+            yield from iter_json(v, depth - 1)
+            sep = ", "
+        yield "}"
+    elif depth and isinstance(value, list) and value:
+        sep = "["
+        for v in value:
+            yield sep
+            yield from iter_json(v, depth - 1)
+            sep = ", "
+        yield "]"
+    else:
+        yield json.dumps(value)
+
+
+def encode_user_file(d: dict) -> dict:
+    if KEY_NAME not in d:
+        return d
+    return {**d, KEY_NAME: encode_habit_list(d[KEY_NAME], settings.HABITS_CODEC)}
+
+
+def decode_user_file(d: dict) -> dict:
+    if KEY_NAME in d:
+        d[KEY_NAME] = decode_habit_list(d[KEY_NAME])
+    return d
+
+
+def write_atomic(filepath: Path, content: str, encoding: Optional[str]) -> None:
+    # Readers and crashes see either the old or the new file, never a mix
+    tmp = filepath.with_name(f".{filepath.name}.tmp")
+    with open(tmp, "w", encoding=encoding) as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, filepath)
+
+    fd = os.open(filepath.parent, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
 
 class FilePersistentDict(observables.ObservableDict):
 
     def __init__(
-        self, filepath: Path, encoding: Optional[str] = None, *, indent: bool = False
+        self,
+        filepath: Path,
+        encoding: Optional[str] = None,
+        *,
+        indent: bool = False,
+        encode: Callable[[dict], dict] = lambda d: d,
+        decode: Callable[[dict], dict] = lambda d: d,
+        user: User | None = None,
     ) -> None:
         self.filepath = filepath
+        self.user = user
         self.encoding = encoding
         self.indent = indent
+        self.encode = encode
+        # Version of the data, and the one last written to the file
+        self.version = 0
+        self.saved = 0
         try:
             data = json.loads(filepath.read_text(encoding)) if filepath.exists() else {}
+            data = decode(data)
         except Exception as e:
             raise ValueError(f"Could not load storage file {filepath}", e)
         super().__init__(data, on_change=self.backup)
 
+    def dumps(self) -> str:
+        data = self.encode(self)
+        if self.indent:
+            return json.dumps(data, indent=self.indent)
+        return "".join(iter_json(data))
+
     def backup(self) -> None:
         """Back up the data to the given file path."""
+        self.version += 1
         if not self.filepath.exists():
             if not self:
+                self.saved = self.version
                 return
             self.filepath.parent.mkdir(exist_ok=True)
 
-        async def backup() -> None:
+        async def backup(version: int) -> None:
             try:
-                logger.debug(f"Backing up {self.filepath}")
-                content = json.dumps(self, indent=self.indent)
-                assert content, "Content to write should not be empty!"
+                await self.write(version)
             except Exception as e:
-                logger.exception(f"Error while backing up {self.filepath}: {e}")
-                return
-
-            async with aiofiles.open(self.filepath, "w", encoding=self.encoding) as f:
-                logger.debug(f"Writing content length: {len(content)}")
-                await f.write(content)
+                if self.version == version:
+                    logger.exception(f"Error while backing up {self.filepath}: {e}")
 
         if core.loop:
-            background_tasks.create_lazy(backup(), name=self.filepath.stem)
+            background_tasks.create_lazy(backup(self.version), name=self.filepath.stem)
         else:
-            core.app.on_startup(backup())
+            core.app.on_startup(backup(self.version))
+
+    async def write(self, version: int) -> None:
+        logger.debug(f"Backing up {self.filepath}")
+        content = await asyncio.to_thread(self.dumps)
+        assert content, "Content to write should not be empty!"
+
+        # Changed while serializing, the backup queued since writes it
+        if self.version != version:
+            logger.debug(f"Dropping superseded backup of {self.filepath}")
+            return
+
+        # Serialized with the user's other writes, a backup queued while
+        # waiting for them writes instead
+        lock = write_locks.hold(self.user) if self.user else contextlib.nullcontext()
+        async with lock:
+            if self.version != version:
+                return
+            logger.debug(f"Writing content length: {len(content)}")
+            await asyncio.to_thread(write_atomic, self.filepath, content, self.encoding)
+            self.saved = version
+
+    async def flush(self) -> None:
+        """Write the changes not on disk yet, without waiting for the backups."""
+        while self.saved != self.version:
+            await self.write(self.version)
+
+
+class FileJournal(Journal):
+    """
+    Snapshot in the user's json file, entries appended to a file next to it,
+    one json object per line.
+    """
+
+    def __init__(self, filepath: Path, encoding: str = "utf-8") -> None:
+        self.filepath = filepath
+        self.journal_path = filepath.with_suffix(".journal")
+        self.encoding = encoding
+
+    async def snapshot(self) -> dict:
+        if not self.filepath.exists():
+            return {}
+        async with aiofiles.open(self.filepath, encoding=self.encoding) as f:
+            return decode_user_file(json.loads(await f.read())).get(KEY_NAME) or {}
+
+    async def read(self) -> tuple[dict, list[dict], int]:
+        snapshot = await self.snapshot()
+        if not snapshot:
+            raise Exception(f"{self.filepath} does not have a habit list")
+
+        content = b""
+        if self.journal_path.exists():
+            async with aiofiles.open(self.journal_path, "rb") as f:
+                content = await f.read()
+
+        entries, position = [], 0
+        for line in content.splitlines(keepends=True):
+            try:
+                entries.append(json.loads(line.decode(self.encoding)))
+            except ValueError:
+                break
+            position += len(line)
+
+        # A line cut short by a crash, later entries are appended after it
+        if position < len(content):
+            logger.warning(f"Dropping broken entries of {self.journal_path}")
+            async with aiofiles.open(self.journal_path, "r+b") as f:
+                await f.truncate(position)
+
+        return snapshot, entries, position
+
+    async def append(self, entries: list[dict]) -> None:
+        self.journal_path.parent.mkdir(exist_ok=True)
+        lines = "".join(json.dumps(entry) + "\n" for entry in entries)
+        async with aiofiles.open(self.journal_path, "a", encoding=self.encoding) as f:
+            await f.write(lines)
+
+    async def write(self, data: dict, position: int) -> None:
+        # Swap the snapshot in first: replaying covered entries again is harmless
+        self.filepath.parent.mkdir(exist_ok=True)
+        content = await asyncio.to_thread(
+            lambda: "".join(iter_json(encode_user_file({KEY_NAME: data})))
+        )
+        await asyncio.to_thread(write_atomic, self.filepath, content, self.encoding)
+
+        if not self.journal_path.exists():
+            return
+        async with aiofiles.open(self.journal_path, "r+b") as f:
+            await f.seek(position)
+            rest = await f.read()
+            await f.seek(0)
+            await f.write(rest)
+            await f.truncate()
 
 
 class UserDiskStorage(UserStorage[DictHabitList]):
     def __init__(self):
-        self.user: dict[UUID_ID, FilePersistentDict] = {}
+        # Evicted documents are written before they may be read back
+        self.user: Residency[FilePersistentDict] = Residency(
+            settings.user_cache_max_size(),
+            settings.user_cache_ttl(),
+            flush=lambda d: d.flush(),
+        )
+        # Live habit lists, one per user so every reader shares its habits
+        self.habit_lists: Residency[DictHabitList] = Residency(
+            settings.user_cache_max_size(),
+            settings.user_cache_ttl(),
+            flush=self._flush_habit_list,
+        )
 
     def _get_persistent_dict(self, user: User) -> FilePersistentDict:
-        if user.id in self.user:
-            return self.user[user.id]
+        if (d := self.user.get(user.id)) is not None:
+            return d
 
         path = Path(f"{USER_DATA_FOLDER}/{str(user.email)}.json")
-        d = FilePersistentDict(path, encoding="utf-8")
+        d = FilePersistentDict(
+            path,
+            encoding="utf-8",
+            encode=encode_user_file,
+            decode=decode_user_file,
+            user=user,
+        )
 
         # Cache the persistent dict
-        self.user[user.id] = d
+        self.user.put(user.id, d)
 
         return d
 
-    async def get_user_habit_list(self, user: User) -> DictHabitList:
+    def _get_journal(self, user: User) -> FileJournal:
+        return FileJournal(Path(f"{USER_DATA_FOLDER}/{str(user.email)}.json"))
+
+    async def _load_journal_dict(self, user: User) -> JournalPersistentDict:
+        # Dropped with a write still queued, the journal on disk is older
+        for d in flusher.pending(user):
+            if isinstance(d, JournalPersistentDict):
+                return d
+
+        journal = self._get_journal(user)
+        data, size = await journal.load()
+        return JournalPersistentDict(user, data, journal, size)
+
+    async def _load_habit_list(self, user: User) -> DictHabitList:
+        if settings.HABITS_JOURNAL:
+            return DictHabitList(await self._load_journal_dict(user))
+
+        # The file of a list still referenced is alive too, and revived
         d = self._get_persistent_dict(user).get(KEY_NAME)
         if not d:
             raise Exception(
@@ -79,7 +279,27 @@ class UserDiskStorage(UserStorage[DictHabitList]):
             )
         return DictHabitList(d)
 
+    @staticmethod
+    async def _flush_habit_list(habit_list: DictHabitList) -> None:
+        # Plain files are written by the residency of their FilePersistentDict
+        if isinstance(habit_list.data, JournalPersistentDict):
+            await flusher.flush(habit_list.data)
+
+    async def get_user_habit_list(self, user: User) -> DictHabitList:
+        return await self.habit_lists.get_or_load(
+            user.id, lambda: self._load_habit_list(user)
+        )
+
     async def init_user_habit_list(self, user: User, habit_list: DictHabitList) -> None:
+        if settings.HABITS_JOURNAL:
+            journal = self._get_journal(user)
+            if await journal.snapshot():
+                raise Exception(
+                    f"User {user.email} already has a habit list, cannot save it."
+                )
+            await journal.write(habit_list.data, 0)
+            return
+
         d = self._get_persistent_dict(user)
         if d.get(KEY_NAME):
             raise Exception(
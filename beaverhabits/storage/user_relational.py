@@ -0,0 +1,278 @@
+import copy
+import datetime
+from typing import Hashable
+
+from nicegui import core, events
+from nicegui.storage import observables
+from sqlalchemy.exc import IntegrityError
+
+from beaverhabits.app import crud
+from beaverhabits.app.crud import HabitRowChanges, RecordRow
+from beaverhabits.app.db import HabitModel, User
+from beaverhabits.configs import settings
+from beaverhabits.logger import logger
+from beaverhabits.storage.codec import decode_habit_list
+from beaverhabits.storage.columnar import DAY_MASK, parse_day
+from beaverhabits.storage.dict import DictHabitList
+from beaverhabits.storage.flusher import flusher
+from beaverhabits.storage.residency import Residency
+from beaverhabits.storage.storage import UserStorage
+from beaverhabits.utils import generate_short_hash
+
+HABITS = "habits"
+RECORDS = "records"
+
+
+def habit_fields(habit: dict) -> dict:
+    # Everything stored in the habit row's data column
+    return copy.deepcopy({k: v for k, v in habit.items() if k not in ("id", RECORDS)})
+
+
+def record_rows(habit: dict) -> dict[datetime.date, RecordRow]:
+    # One row per day, the last record wins like in RecordColumns
+    rows = {}
+    for record in habit.get(RECORDS, []):
+        day = parse_day(record["day"])
+        rows[day] = (day, record.get("done", False), record.get("text"))
+    return rows
+
+
+def to_record(row: RecordRow) -> dict:
+    day, done, text = row
+    record = {"day": day.strftime(DAY_MASK), "done": done}
+    if text is not None:
+        record["text"] = text
+    return record
+
+
+class HabitRowsDict(observables.ObservableDict):
+    """
+    A habit list tracking its changes row by row, as in the habit and
+    habit_record tables.
+
+    Changes are tracked by the observable that raised them: the list itself,
+    a habit or its records. When flushing, only those parts are compared
+    with what was last written, so a tick ends up as a single record row.
+    Subclasses write them in their flush().
+    """
+
+    def __init__(self, user: User, data: dict) -> None:
+        self.user = user
+
+        # Last written state
+        self.written_list = self._list_data(data)
+        self.written_habits = {
+            h["id"]: (i, habit_fields(h)) for i, h in enumerate(data[HABITS])
+        }
+        self.written_records = {h["id"]: record_rows(h) for h in data[HABITS]}
+
+        # Parts changed since
+        self.dirty_list = False
+        self.dirty_habits: set[str] = set()
+        self.dirty_records: set[str] = set()
+
+        super().__init__(data, on_change=self.backup)
+
+    @property
+    def flush_key(self) -> Hashable:
+        # Each list writes its own changes
+        return (self.user.id, id(self))
+
+    @staticmethod
+    def _list_data(data: dict) -> dict:
+        return copy.deepcopy({k: v for k, v in data.items() if k != HABITS})
+
+    def backup(self, e: events.ObservableChangeEventArguments) -> None:
+        habits = self.get(HABITS)
+
+        # Walk up to the habit holding the change, if any
+        node, child = e.sender, None
+        while node is not None and node is not self and node is not habits:
+            node, child = node._parent, node
+
+        if node is habits and isinstance(child, dict):
+            habit_id = child.get("id")
+            if e.sender is child:
+                self.dirty_habits.add(habit_id)
+            self.dirty_records.add(habit_id)
+        elif node is habits:
+            # Habits added, removed or moved
+            self.dirty_habits.update(h.get("id") for h in habits)
+        else:
+            self.dirty_list = True
+            self.dirty_habits.update(h.get("id") for h in habits or [])
+            self.dirty_records.update(h.get("id") for h in habits or [])
+
+        if core.loop and core.loop.is_running():
+            flusher.mark(self)
+        else:
+            raise RuntimeError("No event loop found for scheduling backup")
+
+    def changes(self) -> HabitRowChanges:
+        changes = HabitRowChanges()
+
+        if self.dirty_list:
+            list_data = self._list_data(self)
+            if list_data != self.written_list:
+                changes.list_data = list_data
+
+        current = {h["id"]: (i, h) for i, h in enumerate(self[HABITS]) if "id" in h}
+        changes.removed_habits = set(self.written_habits) - set(current)
+        for habit_id in self.dirty_habits | self.dirty_records:
+            if habit_id not in current:
+                continue
+            position, habit = current[habit_id]
+            added = habit_id not in self.written_habits
+
+            if habit_id in self.dirty_habits or added:
+                fields = (position, habit_fields(habit))
+                if fields != self.written_habits.get(habit_id):
+                    changes.habits[habit_id] = fields
+
+            if habit_id in self.dirty_records or added:
+                rows = record_rows(habit)
+                written = self.written_records.get(habit_id, {})
+                changes.records[habit_id] = [
+                    row for day, row in rows.items() if written.get(day) != row
+                ]
+                changes.removed_records[habit_id] = [
+                    day for day in written if day not in rows
+                ]
+
+        self.dirty_list = False
+        self.dirty_habits.clear()
+        self.dirty_records.clear()
+        return changes
+
+    def rewind(self) -> None:
+        # Compare everything again on the next write
+        self.dirty_list = True
+        self.dirty_habits.update(self.written_habits)
+        self.dirty_records.update(self.written_records)
+
+    def written(self, changes: HabitRowChanges) -> None:
+        if changes.list_data is not None:
+            self.written_list = changes.list_data
+        for habit_id in changes.removed_habits:
+            self.written_habits.pop(habit_id, None)
+            self.written_records.pop(habit_id, None)
+        self.written_habits.update(changes.habits)
+        for habit_id, rows in changes.records.items():
+            written = self.written_records.setdefault(habit_id, {})
+            written.update((row[0], row) for row in rows)
+            for day in changes.removed_records.get(habit_id, []):
+                written.pop(day, None)
+
+
+class RelationalPersistentDict(HabitRowsDict):
+    """A habit list assembled from the habit and habit_record tables."""
+
+    def __init__(self, user: User, data: dict, pks: dict[str, int]) -> None:
+        self.pks = pks
+        super().__init__(user, data)
+
+    async def flush(self) -> None:
+        changes = self.changes()
+        if not changes:
+            return
+
+        try:
+            self.pks = await crud.update_user_habit_rows(self.user, changes, self.pks)
+        except Exception:
+            self.rewind()
+            raise
+        self.written(changes)
+
+
+def habit_ids(habits: list[dict]) -> list[str]:
+    # Rows are keyed by habit id: fill in missing ones and split duplicates
+    ids, seen = [], set()
+    for habit in habits:
+        habit_id = habit.get("id") or generate_short_hash(habit["name"])
+        while habit_id in seen:
+            habit_id = generate_short_hash(habit_id)
+        seen.add(habit_id)
+        ids.append(habit_id)
+    return ids
+
+
+def split_habit_list(data: dict) -> list[tuple[str, dict, list[RecordRow]]]:
+    habits = data.get(HABITS, [])
+    return [
+        (habit_id, habit_fields(habit), sorted(record_rows(habit).values()))
+        for habit_id, habit in zip(habit_ids(habits), habits)
+    ]
+
+
+def assemble_habit_list(
+    list_data: dict,
+    habits: list[HabitModel],
+    records: dict[int, list[RecordRow]],
+) -> dict:
+    data = copy.deepcopy(list_data)
+    data[HABITS] = [
+        {
+            **habit.data,
+            "id": habit.habit_id,
+            RECORDS: [to_record(row) for row in records.get(habit.id, [])],
+        }
+        for habit in habits
+    ]
+    return data
+
+
+class UserRelationalStorage(UserStorage[DictHabitList]):
+    def __init__(self) -> None:
+        # One live copy per user, so no change is written from a stale one.
+        # Loads are single-flight, which also keeps the migration one shot
+        self.habit_lists: Residency[DictHabitList] = Residency(
+            settings.user_cache_max_size(),
+            settings.user_cache_ttl(),
+            flush=lambda habit_list: flusher.flush(habit_list.data),
+        )
+
+    async def migrate(self, user: User, data: dict, version: int) -> None:
+        # One shot, on the first load of a list still stored as a document
+        habits = split_habit_list(data)
+        list_data = {k: v for k, v in data.items() if k != HABITS}
+        try:
+            await crud.migrate_user_habit_list(user, habits, list_data, version)
+        except IntegrityError:
+            # Migrated concurrently by another process
+            logger.warning(f"Habit list of {user.email} migrated concurrently")
+
+    async def get_user_habit_list(self, user: User) -> DictHabitList:
+        return await self.habit_lists.get_or_load(
+            user.id, lambda: self._load_habit_list(user)
+        )
+
+    async def _load_habit_list(self, user: User) -> DictHabitList:
+        # Dropped with a write still queued, the stored rows are older
+        for d in flusher.pending(user):
+            if isinstance(d, RelationalPersistentDict):
+                return DictHabitList(d)
+
+        user_habit_list = await crud.get_user_habit_list(user)
+        if user_habit_list is None:
+            raise Exception(f"User habit list not found for user {user.email}")
+
+        list_data = decode_habit_list(user_habit_list.data)
+        if HABITS in list_data:
+            await self.migrate(user, list_data, user_habit_list.version)
+            list_data = {k: v for k, v in list_data.items() if k != HABITS}
+
+        habits, records = await crud.get_user_habit_rows(user)
+
+        data = assemble_habit_list(list_data, list(habits), records)
+        pks = {habit.habit_id: habit.id for habit in habits}
+        return DictHabitList(RelationalPersistentDict(user, data, pks))
+
+    async def init_user_habit_list(self, user: User, habit_list: DictHabitList) -> None:
+        user_habit_list = await crud.get_user_habit_list(user)
+        if user_habit_list and user_habit_list.data:
+            raise Exception(
+                f"User habit list already exists for user {user.email}, cannot overwrite"
+            )
+
+        # Stored as a document first, moved into rows on the first load
+        await crud.update_user_habit_list(user, habit_list.data)
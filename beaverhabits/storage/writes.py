@@ -0,0 +1,87 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator
+
+from cachetools import LRUCache
+from fastapi_users_db_sqlalchemy import UUID_ID
+
+from beaverhabits.app.db import User
+from beaverhabits.configs import settings
+
+
+@dataclass
+class Contention:
+    waits: int = 0
+    wait_seconds: float = 0.0
+
+
+class _UserLock:
+    def __init__(self) -> None:
+        self.lock = asyncio.Lock()
+        self.owner: asyncio.Task | None = None
+        # Holders and waiters, the lock is dropped when none are left
+        self.users = 0
+
+
+class UserWriteLocks:
+    """
+    One lock per user, taken by everything writing to their habit list:
+    the flusher for each write, and request handlers for changes made in
+    several steps.
+
+    While a handler holds it, no write for that user starts, so all of its
+    changes are written together once it is done. A task already holding
+    the lock can take it again.
+    """
+
+    def __init__(self, tracked: int) -> None:
+        self.locks: dict[UUID_ID, _UserLock] = {}
+
+        # Metrics, per user for the latest contended ones
+        self.acquired = 0
+        self.contended = 0
+        self.wait_seconds = 0.0
+        self.users: LRUCache[UUID_ID, Contention] = LRUCache(maxsize=tracked)
+
+    @asynccontextmanager
+    async def hold(self, user: User) -> AsyncIterator[None]:
+        task = asyncio.current_task()
+        entry = self.locks.get(user.id)
+        if entry is not None and entry.owner is task:
+            yield
+            return
+
+        if entry is None:
+            entry = self.locks[user.id] = _UserLock()
+        contended = entry.users > 0
+        entry.users += 1
+        try:
+            start = time.perf_counter()
+            async with entry.lock:
+                self._acquired(user, contended, time.perf_counter() - start)
+                entry.owner = task
+                try:
+                    yield
+                finally:
+                    entry.owner = None
+        finally:
+            entry.users -= 1
+            if not entry.users:
+                self.locks.pop(user.id, None)
+
+    def _acquired(self, user: User, contended: bool, waited: float) -> None:
+        self.acquired += 1
+        if not contended:
+            return
+
+        self.contended += 1
+        self.wait_seconds += waited
+        contention = self.users.get(user.id) or Contention()
+        contention.waits += 1
+        contention.wait_seconds += waited
+        self.users[user.id] = contention
+
+
+write_locks = UserWriteLocks(settings.HABIT_LIST_LOCK_TRACKED)
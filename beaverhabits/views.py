@@ -11,6 +11,7 @@ from nicegui import app, run, ui
 
 from beaverhabits.app import crud
 from beaverhabits.app.auth import (
+    jwt_expiry,
     user_check_token,
     user_create,
     user_create_reset_token,
@@ -20,14 +21,17 @@ from beaverhabits.app.auth import (
 )
 from beaverhabits.app.crud import get_customer_list, get_user_count, get_user_list
 from beaverhabits.app.db import User
+from beaverhabits.app.token_cache import cache_token_user
 from beaverhabits.configs import settings
 from beaverhabits.core.backup import backup_to_telegram
 from beaverhabits.frontend.components import redirect
 from beaverhabits.logger import logger
+from beaverhabits.plan.entitlements import get_entitlement, invalidate_entitlement
 from beaverhabits.storage import get_user_dict_storage, session_storage
 from beaverhabits.storage.dict import DAY_MASK, DictHabitList
 from beaverhabits.storage.meta import GUI_ROOT_PATH
 from beaverhabits.storage.storage import Habit, HabitList, HabitListBuilder, HabitStatus
+from beaverhabits.storage.writes import write_locks
 from beaverhabits.utils import generate_short_hash, ratelimiter, send_email
 
 user_storage = get_user_dict_storage()
@@ -106,15 +110,17 @@ async def remove_user_habit(user: User, habit: Habit) -> None:
 
 
 async def get_or_create_user_habit_list(user: User, habit_list: HabitList) -> HabitList:
-    try:
-        return await get_user_habit_list(user)
-    except HTTPException:
-        logger.warning(f"Failed to load habit list for user {user.email}")
+    # Concurrent first requests create a single list
+    async with write_locks.hold(user):
+        try:
+            return await get_user_habit_list(user)
+        except HTTPException:
+            logger.warning(f"Failed to load habit list for user {user.email}")
 
-    logger.info(f"Creating dummy habit list for user {user.email}")
-    await user_storage.init_user_habit_list(user, habit_list)
+        logger.info(f"Creating dummy habit list for user {user.email}")
+        await user_storage.init_user_habit_list(user, habit_list)
 
-    return await get_user_habit_list(user)
+        return await get_user_habit_list(user)
 
 
 async def export_user_habit_list(habit_list: HabitList, user_identify: str) -> bool:
@@ -145,9 +151,13 @@ async def login_user(user: User) -> None:
     token = await user_create_token(user)
     if token is not None:
         app.storage.user.update({"auth_token": token})
+        cache_token_user(token, user, jwt_expiry(token))
         logger.info(f"User {user.email} logged in successfully, token: {token[:4]}***")
 
     await cache_user_configs(user)
+    if settings.ENABLE_PLAN:
+        # Warm up the pro checks of the first clicks
+        await get_entitlement(user.email)
 
 
 async def register_user(email: str, password: str = "") -> User:
@@ -328,6 +338,7 @@ def apply_theme_style() -> None:
 async def promote_user_to_pro(email: str, pro: bool = True) -> None:
     customer = await crud.get_or_create_user_identity(email, email, "", {})
     await crud.update_user_identity(customer.email, {}, activate=pro)
+    invalidate_entitlement(email)
 
 
 async def set_user_cookies(user: User) -> None:
@@ -339,8 +350,7 @@ async def set_user_cookies(user: User) -> None:
         # Set email cookie (add more properties as needed)
         ui.run_javascript(f'document.cookie = "email={user.email}; path=/; SameSite=Lax";')
 
-        customer = await crud.get_user_identity(user.email)
-        is_pro = customer.activated if customer else False
+        is_pro = await get_entitlement(user.email)
         ui.run_javascript(f'document.cookie = "is_pro={str(is_pro).lower()}; path=/; SameSite=Lax";')
     
     ui.timer(0.1, set_cookies_task, once=True)
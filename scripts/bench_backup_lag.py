@@ -0,0 +1,98 @@
+"""
+Event loop lag while a large user file is backed up.
+
+Backs up a user file of about 8 MiB (60 habits of 2000 noted records) 5
+times and reports the longest delay of a 1 ms ticker running alongside:
+with json.dumps on the loop, with json.dumps in a worker thread, and with
+FilePersistentDict.write, which serializes it piece by piece in a thread
+and replaces the file atomically.
+
+Usage:
+    ENV=production python scripts/bench_backup_lag.py
+"""
+
+import asyncio
+import datetime
+import json
+import tempfile
+import time
+from pathlib import Path
+from typing import Awaitable, Callable
+
+from beaverhabits.storage.user_file import KEY_NAME, FilePersistentDict
+
+HABITS = 60
+DAYS = 2000
+BACKUPS = 5
+TICK = 0.001
+
+
+def user_file_data() -> dict:
+    start = datetime.date(2020, 1, 1)
+    return {
+        KEY_NAME: {
+            "habits": [
+                {
+                    "id": f"h{i}",
+                    "name": f"habit {i}",
+                    "records": [
+                        {
+                            "day": (start + datetime.timedelta(days=d)).isoformat(),
+                            "done": True,
+                            "text": "x" * 20,
+                        }
+                        for d in range(DAYS)
+                    ],
+                }
+                for i in range(HABITS)
+            ]
+        }
+    }
+
+
+async def max_lag(backup: Callable[[], Awaitable[None]]) -> float:
+    lags: list[float] = []
+    done = asyncio.Event()
+
+    async def ticker() -> None:
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(TICK)
+            lags.append(time.perf_counter() - start - TICK)
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(0.05)
+    for _ in range(BACKUPS):
+        await backup()
+        await asyncio.sleep(0.02)
+    done.set()
+    await task
+    return max(lags) * 1000
+
+
+async def main() -> None:
+    with tempfile.TemporaryDirectory() as folder:
+        path = Path(folder) / "user.json"
+        path.write_text(json.dumps(user_file_data()))
+        d = FilePersistentDict(path)
+        print(f"user file: {path.stat().st_size / 2**20:.1f} MiB")
+
+        async def on_loop() -> None:
+            json.dumps(d)
+
+        async def in_thread() -> None:
+            await asyncio.to_thread(json.dumps, d)
+
+        async def write() -> None:
+            await d.write(d.version)
+
+        for label, backup in [
+            ("json.dumps on the loop", on_loop),
+            ("json.dumps in a thread", in_thread),
+            ("FilePersistentDict.write", write),
+        ]:
+            print(f"{label}: max lag {await max_lag(backup):.1f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,64 @@
+"""
+Cost of a typical API request on a loaded habit list.
+
+Looks two habits up and builds the sorted list, as the API and the pages
+do, on a 40 habit list with 1, 3 and 5 years of daily history. "cold"
+wraps the data in a new DictHabitList for every request, so no habit
+wrapper or record cache is reused; "warm" keeps the same list across
+requests.
+
+Usage:
+    python scripts/bench_habit_list_requests.py
+"""
+
+import asyncio
+import datetime
+import time
+
+from beaverhabits.storage.dict import DAY_MASK, DictHabitList
+from beaverhabits.storage.storage import HabitListBuilder
+
+HABITS = 40
+REQUESTS = 20
+
+
+def habit_list_data(years: int) -> dict:
+    today = datetime.date(2025, 1, 1)
+    days = [today - datetime.timedelta(days=i) for i in range(365 * years)]
+    records = [{"day": day.strftime(DAY_MASK), "done": True} for day in days]
+    return {
+        "habits": [
+            {"id": f"h{i}", "name": f"habit {i}", "records": list(records)}
+            for i in range(HABITS)
+        ]
+    }
+
+
+async def request(habit_list: DictHabitList) -> None:
+    await habit_list.get_habit_by(f"h{HABITS - 1}")
+    HabitListBuilder(habit_list).build()
+    await habit_list.get_habit_by(f"h{HABITS // 2}")
+
+
+async def bench(data: dict, warm: bool) -> float:
+    habit_list = DictHabitList(data)
+    await request(habit_list)
+
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        await request(habit_list if warm else DictHabitList(data))
+    return (time.perf_counter() - start) / REQUESTS * 1000
+
+
+async def main() -> None:
+    for years in (1, 3, 5):
+        data = habit_list_data(years)
+        cold = await bench(data, warm=False)
+        warm = await bench(data, warm=True)
+        print(
+            f"{years} year(s): cold {cold:.2f} ms/request, warm {warm:.2f} ms/request"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
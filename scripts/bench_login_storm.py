@@ -0,0 +1,65 @@
+"""
+Event loop lag during a burst of logins.
+
+Runs concurrent logins of one user, half of them with a wrong password,
+and reports the total time and the delay of a 10 ms ticker running
+alongside. Password hashes are worked out in the password pool, so the
+lag stays bounded however many logins queue up.
+
+Usage:
+    DATABASE_URL="sqlite+aiosqlite:///:memory:" ENV=production \
+        python scripts/bench_login_storm.py [logins]
+"""
+
+import asyncio
+import sys
+import time
+import uuid
+
+from beaverhabits.app.auth import user_authenticate, user_create
+from beaverhabits.app.db import create_db_and_tables, engine
+
+LOGINS = 8
+PASSWORD = "Passw0rd!"
+TICK = 0.01
+
+
+async def main(logins: int) -> None:
+    await create_db_and_tables()
+    email = f"{uuid.uuid1()}@bench.com"
+    await user_create(email=email, password=PASSWORD)
+
+    lags: list[float] = []
+    done = asyncio.Event()
+
+    async def ticker() -> None:
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(TICK)
+            lags.append(time.perf_counter() - start - TICK)
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(0.05)
+
+    start = time.perf_counter()
+    users = await asyncio.gather(
+        *[
+            user_authenticate(email, PASSWORD if i % 2 else "wrong")
+            for i in range(logins)
+        ]
+    )
+    total = time.perf_counter() - start
+    done.set()
+    await task
+    await engine.dispose()
+
+    lags.sort()
+    print(
+        f"{logins} logins ({sum(bool(x) for x in users)} valid): {total:.2f} s, "
+        f"loop lag p50 {lags[len(lags) // 2] * 1000:.0f} ms, "
+        f"max {lags[-1] * 1000:.0f} ms"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else LOGINS))
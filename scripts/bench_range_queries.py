@@ -0,0 +1,51 @@
+"""
+Ticked days in a date window, by a scan of ticked_days and by the range
+queries.
+
+Counts the done days of a 7 day window of a habit with 10 years of daily
+history: with a linear scan over ticked_days, with ticked_count, and
+through the done completion handler, which lists them with
+ticked_between.
+
+Usage:
+    python scripts/bench_range_queries.py
+"""
+
+import datetime
+import time
+
+from beaverhabits.core.completions import done
+from beaverhabits.storage.dict import DAY_MASK, DictHabitList
+
+DAYS = 3650
+RUNS = 2000
+
+TODAY = datetime.date(2025, 1, 1)
+START = TODAY - datetime.timedelta(days=6)
+
+
+def main() -> None:
+    days = [TODAY - datetime.timedelta(days=i) for i in range(DAYS)]
+    records = [{"day": day.strftime(DAY_MASK), "done": True} for day in days]
+    habit_list = DictHabitList(
+        {"habits": [{"id": "h", "name": "h", "records": records}]}
+    )
+    habit = habit_list.habits[0]
+
+    cases = {
+        "linear scan": lambda: sum(
+            1 for day in habit.ticked_days if START <= day <= TODAY
+        ),
+        "ticked_count": lambda: habit.ticked_count(START, TODAY),
+        "completions.done": lambda: done(habit, START, TODAY),
+    }
+    for label, run in cases.items():
+        run()
+        start = time.perf_counter()
+        for _ in range(RUNS):
+            run()
+        print(f"{label}: {(time.perf_counter() - start) / RUNS * 1e6:.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Throughput of static asset requests through the app.
+
+Sends 1000 sequential requests per round for a few /statics/ and
+/_nicegui/ assets through an in-process ASGI client, and reports the best
+and median of 7 rounds. The Cache-Control header of each asset is printed
+first.
+
+Usage:
+    DATABASE_URL="sqlite+aiosqlite:///:memory:" ENV=production \
+        python scripts/bench_static_assets.py
+"""
+
+import asyncio
+import time
+
+import httpx
+from nicegui import __version__
+
+from beaverhabits.main import app
+
+PATHS = [
+    "/statics/robots.txt",
+    "/statics/images/favicon.svg",
+    f"/_nicegui/{__version__}/static/nicegui.css",
+]
+REQUESTS = 1000
+ROUNDS = 7
+
+
+async def main() -> None:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        for path in PATHS:
+            response = await client.get(path)
+            print(path, response.status_code, response.headers.get("cache-control"))
+
+        rates = []
+        for _ in range(ROUNDS):
+            start = time.perf_counter()
+            for i in range(REQUESTS):
+                await client.get(PATHS[i % len(PATHS)])
+            rates.append(REQUESTS / (time.perf_counter() - start))
+
+    rates.sort()
+    print(f"best {rates[-1]:.0f} req/s, median {rates[len(rates) // 2]:.0f} req/s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
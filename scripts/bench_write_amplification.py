@@ -0,0 +1,92 @@
+"""
+Write amplification of a tick, per habit list storage.
+
+Ticks one habit of a 10 habit, two year list 50 times and reports the SQL
+statements and bytes (statement text and parameters) sent per tick, for
+the DATABASE and RELATIONAL storages.
+
+Usage:
+    DATABASE_URL="sqlite+aiosqlite:///:memory:" \
+        python scripts/bench_write_amplification.py
+"""
+
+import asyncio
+import datetime
+import random
+import uuid
+
+from nicegui import core
+from sqlalchemy import event
+
+from beaverhabits.app.auth import user_create
+from beaverhabits.app.db import create_db_and_tables, engine
+from beaverhabits.storage.dict import DAY_MASK, DictHabitList
+from beaverhabits.storage.flusher import flusher
+from beaverhabits.storage.storage import UserStorage
+from beaverhabits.storage.user_db import UserDatabaseStorage
+from beaverhabits.storage.user_relational import UserRelationalStorage
+
+HABITS = 10
+DAYS = 730
+TICKS = 50
+
+stats = {"statements": 0, "bytes": 0}
+
+
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def count_statement(conn, cursor, statement, parameters, context, executemany):
+    stats["statements"] += 1
+    stats["bytes"] += len(statement) + len(repr(parameters))
+
+
+def habit_list_data() -> dict:
+    rng = random.Random(0)
+    start = datetime.date(2023, 1, 1)
+    return {
+        "habits": [
+            {
+                "id": f"h{i}",
+                "name": f"habit {i}",
+                "records": [
+                    {
+                        "day": (start + datetime.timedelta(days=d)).strftime(DAY_MASK),
+                        "done": True,
+                    }
+                    for d in range(DAYS)
+                    if rng.random() < 0.6
+                ],
+            }
+            for i in range(HABITS)
+        ]
+    }
+
+
+async def bench(storage: UserStorage, label: str) -> None:
+    user = await user_create(email=f"{uuid.uuid1()}@bench.com", password="bench")
+    await storage.init_user_habit_list(user, DictHabitList(habit_list_data()))
+    habit_list = await storage.get_user_habit_list(user)
+    await flusher.flush_all()
+
+    habit = habit_list.habits[0]
+    stats.update(statements=0, bytes=0)
+    for i in range(TICKS):
+        day = datetime.date(2025, 1, 1) + datetime.timedelta(days=i)
+        await habit.tick(day, True)
+        await flusher.flush_all()
+
+    print(
+        f"{label}: {stats['statements'] / TICKS:.1f} statements, "
+        f"{stats['bytes'] / TICKS / 1024:.1f} KiB sent per tick"
+    )
+
+
+async def main() -> None:
+    core.loop = asyncio.get_running_loop()
+    await create_db_and_tables()
+    await bench(UserDatabaseStorage(), "DATABASE  ")
+    await bench(UserRelationalStorage(), "RELATIONAL")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1 +1,12 @@
+import pytest
+
+from beaverhabits.storage import user_file
+
 pytest_plugins = ["nicegui.testing.plugin"]
+
+
+@pytest.fixture(autouse=True)
+def user_data_folder(tmp_path, monkeypatch):
+    # User files go to a folder of the test, never to the real .user/
+    monkeypatch.setattr(user_file, "USER_DATA_FOLDER", str(tmp_path))
+    return tmp_path
@@ -206,6 +206,74 @@ async def test_old_token_rejected_after_reset(user_a, client: TestClient):
     assert resp.status_code in AUTHENTICATED_CODES
 
 
+async def test_tokens_cached_until_reset(user_a, client: TestClient):
+    """Test that polling resolves tokens from cache until the API token is reset."""
+    from beaverhabits.app.crud import reset_user_api_token
+    from beaverhabits.app.token_cache import (
+        get_token_user,
+        token_cache,
+        token_cache_stats,
+    )
+
+    user = user_a["user"]
+    api_token = await reset_user_api_token(user)
+
+    for token in (api_token, user_a["jwt"]):
+        headers = {"Authorization": f"Bearer {token}"}
+        client.get("/api/v1/habits", headers=headers)
+        hits = token_cache_stats["hits"]
+        resp = client.get("/api/v1/habits", headers=headers)
+        assert resp.status_code in AUTHENTICATED_CODES
+        assert token_cache_stats["hits"] == hits + 1
+        assert str(get_token_user(token).id) == str(user.id)
+
+    # Both dropped, the old API token is looked up again and rejected
+    await reset_user_api_token(user)
+    assert api_token not in token_cache and user_a["jwt"] not in token_cache
+    resp = client.get(
+        "/api/v1/habits",
+        headers={"Authorization": f"Bearer {api_token}"},
+    )
+    assert resp.status_code == 401
+
+
+async def test_tokens_invalidated_on_user_update(user_a, client: TestClient):
+    """Test that cached users are per request and dropped when the user changes."""
+    from beaverhabits.app.auth import (
+        user_get_by_email,
+        user_manager_context,
+        user_reset_password,
+    )
+    from beaverhabits.app.crud import reset_user_api_token
+    from beaverhabits.app.token_cache import get_token_user, token_cache
+
+    user = await user_get_by_email(user_a["user"].email)
+    assert user is not None
+    api_token = await reset_user_api_token(user)
+    headers = {"Authorization": f"Bearer {api_token}"}
+    client.get("/api/v1/habits", headers=headers)
+
+    # Each hit gets an instance of its own
+    first, second = get_token_user(api_token), get_token_user(api_token)
+    assert first is not None and second is not None
+    assert first is not second
+    assert str(first.id) == str(user.id)
+
+    await user_reset_password(user, PASSWORD)
+    assert api_token not in token_cache
+
+    client.get("/api/v1/habits", headers=headers)
+    assert api_token in token_cache
+    async with user_manager_context() as user_manager:
+        user = await user_manager._update(user, {"is_active": False})
+    assert api_token not in token_cache
+    client.get("/api/v1/habits", headers=headers)
+    assert get_token_user(api_token).is_active is False
+
+    async with user_manager_context() as user_manager:
+        await user_manager._update(user, {"is_active": True})
+
+
 # ============================================================================
 # Multi-user isolation
 # ============================================================================
@@ -7,6 +7,7 @@ from datetime import date, datetime
 
 import pytest
 from fastapi import Depends, FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.testclient import TestClient
 from loguru import logger
 from nicegui import core
@@ -14,10 +15,12 @@ from nicegui import core
 from beaverhabits.app.db import User, engine
 from beaverhabits.app.dependencies import current_admin_user
 from beaverhabits.app.schemas import UserCreate, UserRead
+from beaverhabits.app.token_cache import token_cache
 from beaverhabits.app.users import auth_backend, fastapi_users
 from beaverhabits.configs import settings
 from beaverhabits.main import app
 from beaverhabits.routes.api import init_api_routes
+from beaverhabits.routes.middleware import STATIC_CACHE_CONTROL, DynamicMiddleware
 
 PASSWORD = "TestPassword123!"
 
@@ -323,6 +326,48 @@ def test_get_habit_detail(auth_headers, sample_habit, client: TestClient):
     assert "tags" in data
 
 
+def test_request_query_count(auth_headers, sample_habit, client: TestClient):
+    """Test the database queries of a request are reported."""
+    # The user is looked up again
+    token_cache.clear()
+    response = client.get(
+        f"/api/v1/habits/{sample_habit['id']}",
+        headers=auth_headers,
+    )
+
+    assert response.status_code == 200
+    assert int(response.headers["X-DB-Queries"]) >= 1
+
+
+def test_static_assets_skip_middleware(client: TestClient):
+    """Test static assets are served around the auth and digest middleware."""
+    response = client.get("/statics/robots.txt")
+
+    assert response.status_code == 200
+    assert "X-Process-Time" not in response.headers
+    assert "max-age" in response.headers["Cache-Control"]
+
+
+def test_static_assets_cache_control():
+    """Test static assets get a Cache-Control, dynamic responses do not."""
+    assets = FastAPI()
+
+    @assets.get("/{path:path}")
+    def asset(path: str):
+        return PlainTextResponse(path)
+
+    async def dispatch(request, call_next):
+        return await call_next(request)
+
+    assets.add_middleware(DynamicMiddleware, dispatch=dispatch)
+    with TestClient(assets) as client:
+        for path in ("/statics/app.css", "/_astro/index.js", "/_nicegui/client.js"):
+            response = client.get(path)
+            assert response.headers["Cache-Control"] == STATIC_CACHE_CONTROL
+
+        assert "Cache-Control" not in client.get("/api/v1/habits").headers
+
+
 def test_update_habit(auth_headers, sample_habit, client: TestClient):
     """Test updating habit properties."""
     response = client.put(
@@ -509,6 +554,62 @@ def test_show_recent_completions(auth_headers, sample_habit, client: TestClient)
     assert "16-12-2024" in completions
 
 
+def test_list_habits_with_completions(auth_headers, sample_habit, client: TestClient):
+    """Test listing habits with their completions in a date range."""
+    for day in ("10-12-2024", "12-12-2024", "20-01-2025"):
+        client.post(
+            f"/api/v1/habits/{sample_habit['id']}/completions",
+            json={"date_fmt": "%d-%m-%Y", "date": day, "done": True},
+            headers=auth_headers,
+        )
+
+    response = client.get(
+        "/api/v1/habits",
+        params={"date_start": "01-12-2024", "date_end": "31-12-2024"},
+        headers=auth_headers,
+    )
+
+    assert response.status_code == 200
+    habits = {x["id"]: x for x in response.json()}
+    assert habits[sample_habit["id"]]["completions"] == ["10-12-2024", "12-12-2024"]
+
+
+def test_batch_completions(auth_headers, sample_habit, client: TestClient):
+    """Test ticking several habits and days in one request."""
+    habit_id = sample_habit["id"]
+    response = client.post(
+        "/api/v1/completions:batch",
+        json={
+            "ticks": [
+                {"habit_id": habit_id, "date": "10-12-2024", "done": True},
+                {"habit_id": habit_id, "date": "11-12-2024", "done": True},
+                {"habit_id": habit_id, "date": "2024-12-12", "done": True},
+                {"habit_id": "missing", "date": "12-12-2024", "done": True},
+                {"habit_id": habit_id, "date": "10-12-2024", "done": False},
+            ]
+        },
+        headers=auth_headers,
+    )
+
+    assert response.status_code == 200
+    results = response.json()
+    assert [x["status"] for x in results] == [200, 200, 400, 404, 200]
+    assert results[0] == {
+        "habit_id": habit_id,
+        "day": "10-12-2024",
+        "done": True,
+        "status": 200,
+    }
+
+    # Applied in order, the last tick undid the first one
+    response = client.get(
+        f"/api/v1/habits/{habit_id}/completions",
+        params={"date_start": "01-12-2024", "date_end": "31-12-2024"},
+        headers=auth_headers,
+    )
+    assert response.json() == ["11-12-2024"]
+
+
 def test_completions_sorted_descending(auth_headers, sample_habit, client: TestClient):
     """Test that completions can be sorted in descending order."""
     # Complete on two dates
@@ -0,0 +1,121 @@
+import asyncio
+import uuid
+
+from fastapi_users.jwt import generate_jwt
+from nicegui.testing import User
+
+from beaverhabits import views
+from beaverhabits.app.auth import (
+    user_authenticate,
+    user_create,
+    user_manager_context,
+    user_reset_password,
+)
+from beaverhabits.app.db import create_db_and_tables, engine
+from beaverhabits.app.passwords import PasswordPool, password_helper, password_pool
+from beaverhabits.plan import entitlements
+from beaverhabits.plan.entitlements import (
+    entitlement_cache,
+    entitlement_cache_stats,
+    get_entitlement,
+    invalidate_entitlement,
+)
+
+PASSWORD = "test"
+
+
+async def test_password_pool():
+    pool = PasswordPool(concurrency=1)
+    ticks = []
+
+    async def ticker():
+        while pool.in_flight or not ticks:
+            await asyncio.sleep(0.01)
+            ticks.append(pool.count)
+
+    # A login storm: the loop keeps running, the hashes queue for the thread
+    tick = asyncio.create_task(ticker())
+    hashes = await asyncio.gather(*[pool.hash(PASSWORD) for _ in range(3)])
+    await tick
+    assert pool.count == 3 and not pool.in_flight
+    # The loop ran between the hashes, not only once they were all done
+    assert 0 in ticks and 1 in ticks and 2 in ticks
+
+    verified, _ = await pool.verify_and_update(PASSWORD, hashes[0])
+    assert verified
+    verified, _ = await pool.verify_and_update("wrong", hashes[0])
+    assert not verified
+
+
+async def test_user_manager_password_pool(user: User):
+    await create_db_and_tables()
+    email = f"{uuid.uuid1()}@test.com"
+    inline = password_helper.inline
+
+    user = await user_create(email=email, password=PASSWORD)
+    assert await user_authenticate(email=email, password=PASSWORD)
+    assert not await user_authenticate(email=email, password="wrong")
+    assert not await user_authenticate(email=f"x{email}", password=PASSWORD)
+    user = await user_reset_password(user, "new password")
+
+    async with user_manager_context() as user_manager:
+        await user_manager.forgot_password(user)
+
+        fingerprint = await password_pool.hash(user.hashed_password)
+        token = generate_jwt(
+            {
+                "sub": str(user.id),
+                "password_fgpt": fingerprint,
+                "aud": user_manager.reset_password_token_audience,
+            },
+            user_manager.reset_password_token_secret,
+        )
+        await user_manager.reset_password(token, PASSWORD)
+    assert await user_authenticate(email=email, password=PASSWORD)
+
+    # Nothing was hashed on the event loop
+    assert password_helper.inline == inline
+
+    await engine.dispose()
+
+
+async def test_entitlement_cache(user: User):
+    await create_db_and_tables()
+    email = f"{uuid.uuid1()}@test.com"
+
+    assert not await get_entitlement(email)
+    hits = entitlement_cache_stats["hits"]
+    assert not await get_entitlement(email)
+    assert entitlement_cache_stats["hits"] == hits + 1
+
+    # Promoting invalidates the cached answer, as the Paddle callbacks do
+    await views.promote_user_to_pro(email)
+    assert await get_entitlement(email)
+    await views.promote_user_to_pro(email, False)
+    assert not await get_entitlement(email)
+
+    await engine.dispose()
+
+
+async def test_entitlement_invalidated_while_looked_up(user: User):
+    await create_db_and_tables()
+    email, other = f"{uuid.uuid1()}@test.com", f"{uuid.uuid1()}@test.com"
+
+    async def racing(invalidated: str) -> None:
+        entitlement_cache.pop(email, None)
+        lookup = asyncio.create_task(get_entitlement(email))
+        while email not in entitlements._lookups:
+            await asyncio.sleep(0)
+        invalidate_entitlement(invalidated)
+        await lookup
+
+    # Another user changing plan leaves the answer cacheable
+    await racing(other)
+    assert email in entitlement_cache
+
+    # The same user may have changed plan after the read, it is not cached
+    await racing(email)
+    assert email not in entitlement_cache
+    assert not entitlements._lookups
+
+    await engine.dispose()
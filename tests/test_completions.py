@@ -0,0 +1,170 @@
+import datetime
+import random
+
+import pytest
+
+from beaverhabits.core.completions import (
+    COMPLETION_HANDLERS,
+    CStatus,
+    PeriodIterator,
+    completion_cache_stats,
+    get_habit_date_completion,
+    get_habits_date_completion,
+    period,
+)
+from beaverhabits.core.streaks import StreakIndex
+from beaverhabits.storage.dict import DAY_MASK, DictHabitList
+from beaverhabits.storage.storage import Habit, HabitFrequency
+from beaverhabits.utils import PERIOD_TYPES, date_move
+
+TODAY = datetime.date(2025, 3, 15)
+
+
+def reference_period(habit: Habit, start: datetime.date, end: datetime.date):
+    # Quadratic implementation the period handler is checked against
+    p = habit.period
+    assert p is not None
+
+    days_min = date_move(start, -p.period_count, p.period_type)
+    days_max = date_move(end, p.period_count, p.period_type)
+    cache = [x for x in habit.ticked_days if days_min <= x <= days_max]
+
+    result: set[datetime.date] = set()
+    for left, right in PeriodIterator(cache, p):
+        done_days = sum(1 for d in cache if left <= d < right)
+        if done_days >= p.target_count:
+            for i in range((right - left).days):
+                result.add(left + datetime.timedelta(days=i))
+
+    return {day: CStatus.PERIOD_DONE for day in result}
+
+
+def reference_streaks(today: datetime.date, habit: Habit):
+    # Day by day walk the streak index is checked against
+    status = get_habit_date_completion(habit, today.replace(year=today.year - 1), today)
+    dates = sorted(status.keys(), reverse=True)
+    if len(dates) <= 1:
+        return
+
+    months, data = [], []
+    streak_count = 1
+    for i in range(1, len(dates)):
+        if (dates[i] - dates[i - 1]).days == -1:
+            streak_count += 1
+        else:
+            months.insert(0, dates[i - 1])
+            data.insert(0, streak_count)
+            streak_count = 1
+            if len(months) >= 5:
+                break
+    else:
+        months.insert(0, dates[-1])
+        data.insert(0, streak_count)
+
+    return {"months": months, "data": data}
+
+
+def assert_streaks_match(today: datetime.date, habit: Habit):
+    expected = reference_streaks(today, habit)
+    streaks = habit.streaks.recent(5, today.replace(year=today.year - 1))
+    if expected is None:
+        assert sum(length for _, length in streaks) <= 1
+    else:
+        assert streaks == list(zip(expected["months"], expected["data"]))
+
+
+def random_habit(rng: random.Random, density: float, history: int = 800) -> Habit:
+    days = [TODAY - datetime.timedelta(days=i) for i in range(history)]
+    records = [
+        {"day": day.strftime(DAY_MASK), "done": rng.random() < density}
+        for day in days
+        if rng.random() < density
+    ]
+    habit_list = DictHabitList({"habits": [{"name": "test", "records": records}]})
+    return habit_list.habits[0]
+
+
+@pytest.mark.parametrize("period_type", PERIOD_TYPES)
+def test_period_matches_reference(period_type: str):
+    rng = random.Random(period_type)
+    for _ in range(30):
+        habit = random_habit(rng, rng.choice([0.05, 0.3, 0.8]))
+        period_count = rng.randint(1, 3)
+        target_count = rng.randint(1, 4)
+        habit.period = HabitFrequency(period_type, period_count, target_count)
+
+        start = TODAY - datetime.timedelta(days=rng.randint(0, 600))
+        end = start + datetime.timedelta(days=rng.randint(0, 200))
+        if (period_type, period_count, target_count) == ("D", 1, 1):
+            assert period(habit, start, end) is None
+            continue
+
+        assert period(habit, start, end) == reference_period(habit, start, end)
+
+
+def test_habits_date_completion_matches_handlers():
+    rng = random.Random("batch")
+    habits = []
+    for i in range(20):
+        habit = random_habit(rng, rng.choice([0.05, 0.3, 0.8]))
+        habit.id = f"habit-{i}"
+        if rng.random() < 0.7:
+            period_type = rng.choice(PERIOD_TYPES)
+            habit.period = HabitFrequency(
+                period_type, rng.randint(1, 3), rng.randint(1, 4)
+            )
+        habits.append(habit)
+    start, end = TODAY - datetime.timedelta(days=120), TODAY
+
+    status_maps = get_habits_date_completion(habits, start, end)
+    for habit in habits:
+        expected: dict[datetime.date, list[CStatus]] = {}
+        for handler in COMPLETION_HANDLERS:
+            for day, status in (handler(habit, start, end) or {}).items():
+                expected.setdefault(day, []).append(status)
+        assert status_maps[habit.id] == expected
+        assert get_habit_date_completion(habit, start, end) is status_maps[habit.id]
+
+
+async def test_completion_cache_revision():
+    habit = random_habit(random.Random(0), 0.5)
+    start, end = TODAY - datetime.timedelta(days=30), TODAY
+
+    first = get_habit_date_completion(habit, start, end)
+    hits = completion_cache_stats["hits"]
+    assert get_habit_date_completion(habit, start, end) is first
+    assert completion_cache_stats["hits"] == hits + 1
+
+    # Tick and period changes take a new revision
+    done = CStatus.DONE in first.get(TODAY, [])
+    await habit.tick(TODAY, not done)
+    second = get_habit_date_completion(habit, start, end)
+    assert (CStatus.DONE in second.get(TODAY, [])) is not done
+
+    habit.period = HabitFrequency("W", 1, 1)
+    third = get_habit_date_completion(habit, start, end)
+    assert any(CStatus.PERIOD_DONE in status for status in third.values())
+
+
+@pytest.mark.parametrize("period_type", PERIOD_TYPES)
+async def test_streak_index(period_type: str):
+    rng = random.Random(f"streaks-{period_type}")
+    for _ in range(20):
+        # Keep the history inside the one year window of the badges
+        habit = random_habit(rng, rng.choice([0.1, 0.5, 0.9]), history=300)
+        habit.period = HabitFrequency(period_type, rng.randint(1, 3), rng.randint(1, 4))
+        assert_streaks_match(TODAY, habit)
+
+        # Incremental updates agree with a fresh index
+        for _ in range(20):
+            day = TODAY - datetime.timedelta(days=rng.randint(0, 299))
+            await habit.tick(day, rng.random() < 0.5)
+            fresh = StreakIndex(habit)
+            assert (habit.streaks.starts, habit.streaks.ends) == (
+                fresh.starts,
+                fresh.ends,
+            )
+        assert_streaks_match(TODAY, habit)
+
+        lengths = [b - a + 1 for a, b in zip(fresh.starts, fresh.ends)]
+        assert habit.streaks.longest() == max(lengths, default=0)
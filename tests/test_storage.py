@@ -1,14 +1,62 @@
+import asyncio
+import contextlib
+import copy
+import datetime
+import gc
+import json
+import random
+import time
 import uuid
+from pathlib import Path
 
 import pytest
 from nicegui import ui
 from nicegui.testing import User
 
 from beaverhabits import views
-from beaverhabits.app.auth import user_authenticate, user_create
+from beaverhabits.accessibility import build_months_text_alternative
+from beaverhabits.app import crud
+from beaverhabits.app.auth import user_authenticate, user_create, user_get_by_email
 from beaverhabits.app.db import User as HabitUser
-from beaverhabits.app.db import create_db_and_tables, engine
-from beaverhabits.configs import StorageType, settings
+from beaverhabits.app.db import (
+    create_db_and_tables,
+    engine,
+    get_async_session,
+    request_session,
+    request_session_scope,
+)
+from beaverhabits.configs import (
+    Settings,
+    StorageCodec,
+    StorageType,
+    settings,
+)
+from beaverhabits.routes.metrics import lock_contention_metrics, user_label
+from beaverhabits.storage.codec import FORMAT_KEY, decode_habit_list, encode_habit_list
+from beaverhabits.storage.columnar import RecordColumns
+from beaverhabits.storage.dict import DictHabitList, HabitDataCache
+from beaverhabits.storage.journal import replay
+from beaverhabits.storage.merge import merge_habit_list
+from beaverhabits.storage.storage import HabitListBuilder, HabitStatus
+from beaverhabits.storage.residency import Residency
+from beaverhabits.storage.user_db import (
+    DatabasePersistentDict,
+    UserDatabaseStorage,
+    flusher,
+    write_stats,
+)
+from beaverhabits.storage.user_file import (
+    FilePersistentDict,
+    UserDiskStorage,
+    decode_user_file,
+    iter_json,
+)
+from beaverhabits.storage.user_relational import (
+    UserRelationalStorage,
+    habit_fields,
+    record_rows,
+)
+from beaverhabits.storage.writes import UserWriteLocks, write_locks
 from beaverhabits.utils import dummy_days
 
 EMAIL = f"{uuid.uuid1()}@test.com"
@@ -59,6 +107,385 @@ async def test_user_db(user: User, habit_user: HabitUser):
     await engine.dispose()
 
 
+async def test_user_db_flush_coalesced(user: User, habit_user: HabitUser):
+    days = [datetime.date(2024, 1, 1) + datetime.timedelta(days=i) for i in range(5)]
+    habit_list = views.dummy_habit_list(days)
+    habit_list = DictHabitList(DatabasePersistentDict(habit_user, habit_list.data))
+
+    coalesced = flusher.coalesced
+    habit = habit_list.habits[0]
+    for day in days:
+        await habit.tick(day, True)
+    assert list(flusher.dirty) == [habit_user.id]
+    assert flusher.coalesced > coalesced
+
+    # Pending writes are flushed at once, e.g. on shutdown
+    await flusher.flush_all()
+    assert not flusher.dirty
+    stored = await crud.get_user_habit_list(habit_user)
+    assert stored is not None and stored.data == habit_list.data
+
+    await engine.dispose()
+
+
+async def test_user_db_cache(user: User):
+    await create_db_and_tables()
+    habit_user = await user_create(email=f"{uuid.uuid1()}@test.com", password=PASSWORD)
+    days = [datetime.date(2024, 1, 1) + datetime.timedelta(days=i) for i in range(5)]
+    storage = UserDatabaseStorage()
+    await storage.init_user_habit_list(habit_user, views.dummy_habit_list(days))
+
+    # One load shared by concurrent requests, then served from memory
+    first, second = await asyncio.gather(
+        storage.get_user_habit_list(habit_user),
+        storage.get_user_habit_list(habit_user),
+    )
+    assert first is second and storage.habit_lists.shared == 1
+    assert await storage.get_user_habit_list(habit_user) is first
+    assert storage.habit_lists.hits == 1 and not storage.habit_lists.loading
+
+    # Written through to the database
+    await first.habits[0].tick(days[0], True, "cached")
+    await flusher.flush_all()
+    reloaded = await UserDatabaseStorage().get_user_habit_list(habit_user)
+    assert reloaded.habits[0].record_by(days[0]).text == "cached"
+
+    await engine.dispose()
+
+
+async def test_request_session(user: User):
+    await create_db_and_tables()
+    habit_user = await user_create(email=f"{uuid.uuid1()}@test.com", password=PASSWORD)
+    await crud.update_user_habit_list(habit_user, {"habits": []})
+    sessions = contextlib.asynccontextmanager(get_async_session)
+
+    async def session_id() -> int:
+        async with sessions() as session:
+            return id(session)
+
+    async with request_session_scope() as scope:
+        first = await session_id()
+        assert await user_get_by_email(habit_user.email) is not None
+        assert await crud.get_user_habit_list(habit_user) is not None
+        assert await session_id() == first
+
+        assert await asyncio.create_task(session_id()) == first
+
+        # Another task asking while it is in use gets its own
+        async with sessions() as session:
+            assert id(session) == first
+            assert await asyncio.create_task(session_id()) != first
+    assert scope.sessions == 2 and scope.queries == 2
+
+    # Nothing shared once the request is done
+    assert request_session.get() is None
+
+    await engine.dispose()
+
+
+async def test_request_session_read_after_update(user: User):
+    await create_db_and_tables()
+    habit_user = await user_create(email=f"{uuid.uuid1()}@test.com", password=PASSWORD)
+    await crud.update_user_habit_list(habit_user, {"habits": []})
+
+    async with request_session_scope():
+        habit_list = await crud.get_user_habit_list(habit_user)
+        assert habit_list is not None
+        version = habit_list.version
+
+        data = {"habits": [], "order": ["a"]}
+        digest = crud.habit_list_digest(data)
+        assert await crud.save_user_habit_list(habit_user, data, digest, version)
+        # Read back through the same session, not its identity map
+        habit_list = await crud.get_user_habit_list(habit_user)
+        assert habit_list is not None
+        assert habit_list.version == version + 1 and habit_list.data == data
+
+        data = {"habits": [], "order": ["b"]}
+        await crud.update_user_habit_list(habit_user, data)
+        habit_list = await crud.get_user_habit_list(habit_user)
+        assert habit_list is not None
+        assert habit_list.version == version + 2 and habit_list.data == data
+
+        # Rows written by an upsert
+        assert await crud.migrate_user_habit_list(
+            habit_user, [("h", {"name": "old"}, [])], data, version + 2
+        )
+        habits, _ = await crud.get_user_habit_rows(habit_user)
+        pks = {habit.habit_id: habit.id for habit in habits}
+        changes = crud.HabitRowChanges(habits={"h": (0, {"name": "new"})})
+        await crud.update_user_habit_rows(habit_user, changes, pks)
+        habits, _ = await crud.get_user_habit_rows(habit_user)
+        assert [habit.data for habit in habits] == [{"name": "new"}]
+
+    await engine.dispose()
+
+
+async def test_user_db_version(user: User):
+    await create_db_and_tables()
+    habit_user = await user_create(email=f"{uuid.uuid1()}@test.com", password=PASSWORD)
+    days = [datetime.date(2024, 1, 1) + datetime.timedelta(days=i) for i in range(5)]
+    await UserDatabaseStorage().init_user_habit_list(
+        habit_user, views.dummy_habit_list(days)
+    )
+    first = await UserDatabaseStorage().get_user_habit_list(habit_user)
+    second = await UserDatabaseStorage().get_user_habit_list(habit_user)
+    version = first.data.version
+
+    # Unchanged lists are not written
+    skipped = write_stats["skipped"]
+    first.habits[0].name = first.habits[0].name
+    await flusher.flush_all()
+    assert write_stats["skipped"] == skipped + 1
+
+    await first.habits[0].tick(days[0], True, "first")
+    await flusher.flush_all()
+    assert first.data.version == version + 1
+
+    # A stale writer is caught by the version, merged with the newer list
+    # and retried: both changes are kept
+    conflicts = write_stats["conflicts"]
+    await second.habits[0].tick(days[1], True, "second")
+    await second.habits[0].tick(days[2], False)
+    await flusher.flush_all()
+    assert write_stats["conflicts"] == conflicts + 1
+    stored = await crud.get_user_habit_list(habit_user)
+    assert stored is not None and stored.version == version + 2
+    assert stored.digest == crud.habit_list_digest(
+        encode_habit_list(second.data, settings.HABITS_CODEC)
+    )
+    stored_list = DictHabitList(decode_habit_list(stored.data))
+    for habit_list in (stored_list, second):
+        habit = habit_list.habits[0]
+        assert habit.record_by(days[0]).text == "first"
+        assert habit.record_by(days[1]).text == "second"
+        assert not habit.record_by(days[2]).done
+
+    await engine.dispose()
+
+
+async def test_user_db_edit_during_save(user: User, monkeypatch):
+    await create_db_and_tables()
+    habit_user = await user_create(email=f"{uuid.uuid1()}@test.com", password=PASSWORD)
+    days = [datetime.date(2024, 1, 1) + datetime.timedelta(days=i) for i in range(5)]
+    await UserDatabaseStorage().init_user_habit_list(
+        habit_user, views.dummy_habit_list(days)
+    )
+    habit_list = await UserDatabaseStorage().get_user_habit_list(habit_user)
+    habit = habit_list.habits[0]
+    await habit.tick(days[0], True, "saved")
+
+    # A tick landing while the list is being saved, on a day with no record
+    later = days[-1] + datetime.timedelta(days=1)
+    save = crud.save_user_habit_list
+
+    async def save_and_tick(*args):
+        saved = await save(*args)
+        await habit.tick(later, True, "during")
+        return saved
+
+    monkeypatch.setattr(crud, "save_user_habit_list", save_and_tick)
+    await habit_list.data.flush()
+    monkeypatch.setattr(crud, "save_user_habit_list", save)
+
+    # Neither stored nor taken as written, so the next flush writes it
+    stored = await crud.get_user_habit_list(habit_user)
+    assert stored is not None and stored.digest == habit_list.data.digest
+    for data in (decode_habit_list(stored.data), json.loads(habit_list.data.written)):
+        written = DictHabitList(data).habits[0]
+        assert written.record_by(days[0]).text == "saved"
+        assert written.record_by(later) is None
+
+    await flusher.flush_all()
+    stored = await crud.get_user_habit_list(habit_user)
+    assert stored is not None
+    written = DictHabitList(decode_habit_list(stored.data)).habits[0]
+    assert written.record_by(later).text == "during"
+
+    await engine.dispose()
+
+
+def test_merge_habit_list():
+    def habit(id: str, *records: dict, **fields) -> dict:
+        return {"id": id, "name": id, **fields, "records": list(records)}
+
+    day1 = {"day": "2024-01-01", "done": True}
+    day2 = {"day": "2024-01-02", "done": True}
+    base = {"order": ["a", "b"], "habits": [habit("a", day1), habit("b")]}
+    theirs = {
+        "order": ["b", "a"],
+        "habits": [
+            habit("a", {**day1, "text": "theirs"}, day2, star=True),
+            habit("c"),
+        ],
+    }
+    ours = copy.deepcopy(base)
+    ours["habits"][0]["records"][0]["text"] = "ours"
+    ours["habits"][0]["name"] = "renamed"
+
+    # Their changes are kept, ours win where both changed the same thing
+    merge_habit_list(ours, base, theirs)
+    assert ours == {
+        "order": ["b", "a"],
+        "habits": [
+            habit("a", {**day1, "text": "ours"}, day2, name="renamed", star=True),
+            habit("c"),
+        ],
+    }
+
+
+async def test_user_relational(user: User):
+    await create_db_and_tables()
+    habit_user = await user_create(email=f"{uuid.uuid1()}@test.com", password=PASSWORD)
+    days = [datetime.date(2024, 1, 1) + datetime.timedelta(days=i) for i in range(30)]
+    document = views.dummy_habit_list(days)
+    document.order = [str(x.id) for x in reversed(document.habits)]
+
+    # The document is moved into rows on the first load
+    storage = UserRelationalStorage()
+    await storage.init_user_habit_list(habit_user, document)
+    habit_list = await storage.get_user_habit_list(habit_user)
+    stored = await crud.get_user_habit_list(habit_user)
+    assert stored is not None and "habits" not in stored.data
+    assert habit_list.order == document.order
+    assert [x.id for x in habit_list.habits] == [x.id for x in document.habits]
+    for habit, expected in zip(habit_list.habits, document.habits):
+        assert habit.ticked_days == expected.ticked_days
+
+    # A tick is written as a single record row
+    habit = habit_list.habits[0]
+    await habit.tick(days[0], not days[0] in habit.ticked_days, "note")
+    changes = habit_list.data.changes()
+    assert changes.list_data is None and not changes.habits
+    assert changes.records == {
+        habit.id: [(days[0], days[0] in habit.ticked_days, "note")]
+    }
+    habit_list.data.dirty_records.add(habit.id)
+
+    habit.name = "Renamed"
+    await habit_list.remove(habit_list.habits[-1])
+    await flusher.flush_all()
+    assert await storage.get_user_habit_list(habit_user) is habit_list
+
+    reloaded = await UserRelationalStorage().get_user_habit_list(habit_user)
+    assert [
+        (h["id"], habit_fields(h), record_rows(h)) for h in reloaded.data["habits"]
+    ] == [(h["id"], habit_fields(h), record_rows(h)) for h in habit_list.data["habits"]]
+    assert reloaded.habits[0].name == "Renamed"
+    assert reloaded.habits[0].record_by(days[0]).text == "note"
+
+    await engine.dispose()
+
+
+async def test_user_write_locks():
+    locks = UserWriteLocks(tracked=1)
+    users = [HabitUser(id=uuid.uuid4(), email=f"{i}@test.com") for i in range(2)]
+    order = []
+
+    async def change(user, name):
+        async with locks.hold(user):
+            # Taken again by the same task
+            async with locks.hold(user):
+                order.append(f"{name} start")
+                await asyncio.sleep(0.01)
+                order.append(f"{name} end")
+
+    await asyncio.gather(
+        change(users[0], "a"), change(users[0], "b"), change(users[1], "c")
+    )
+    assert order.index("a end") < order.index("b start")
+    assert order.index("c start") < order.index("a end")
+    assert locks.acquired == 3 and locks.contended == 1
+    assert list(locks.users) == [users[0].id]
+    assert locks.users[users[0].id].wait_seconds > 0
+    assert not locks.locks
+
+    # Exported under a hash of the id, never the id itself
+    text = lock_contention_metrics(locks)
+    assert f'user="{user_label(users[0].id)}"' in text
+    assert str(users[0].id) not in text
+
+
+async def test_user_db_flush_waits_for_lock(user: User):
+    await create_db_and_tables()
+    habit_user = await user_create(email=f"{uuid.uuid1()}@test.com", password=PASSWORD)
+    days = [datetime.date(2024, 1, 1) + datetime.timedelta(days=i) for i in range(5)]
+    storage = UserDatabaseStorage()
+    await storage.init_user_habit_list(habit_user, views.dummy_habit_list(days))
+    habit_list = await storage.get_user_habit_list(habit_user)
+    version = habit_list.data.version
+
+    # Changes made while holding the lock are written together afterwards
+    async with write_locks.hold(habit_user):
+        await habit_list.habits[0].tick(days[0], True, "locked")
+        flush = asyncio.create_task(flusher.flush_all())
+        await asyncio.sleep(0.01)
+        assert not flush.done()
+        habit_list.habits[0].name = "Renamed"
+    await flush
+
+    stored = await crud.get_user_habit_list(habit_user)
+    assert stored is not None and stored.version == version + 1
+    assert stored.data["habits"][0]["name"] == "Renamed"
+
+    await engine.dispose()
+
+
+@pytest.mark.parametrize("storage_type", [UserDatabaseStorage, UserDiskStorage])
+async def test_user_journal(user: User, storage_type, monkeypatch):
+    monkeypatch.setattr(settings, "HABITS_JOURNAL", True)
+    monkeypatch.setattr(settings, "HABITS_JOURNAL_COMPACT_SIZE", 10)
+    await create_db_and_tables()
+    habit_user = await user_create(email=f"{uuid.uuid1()}@test.com", password=PASSWORD)
+    days = [datetime.date(2024, 1, 1) + datetime.timedelta(days=i) for i in range(30)]
+    document = views.dummy_habit_list(days)
+
+    storage = storage_type()
+    await storage.init_user_habit_list(habit_user, document)
+    habit_list = await storage.get_user_habit_list(habit_user)
+    snapshot, entries, _ = await habit_list.data.journal.read()
+    assert not entries
+    assert [h["id"] for h in snapshot["habits"]] == [x.id for x in habit_list.habits]
+
+    # A tick is appended as a single entry
+    habit = habit_list.habits[0]
+    await habit.tick(days[0], not days[0] in habit.ticked_days, "note")
+    await flusher.flush_all()
+    _, entries, _ = await habit_list.data.journal.read()
+    assert entries == [
+        {
+            "op": "record",
+            "id": habit.id,
+            "day": "2024-01-01",
+            "done": days[0] in habit.ticked_days,
+            "text": "note",
+        }
+    ]
+
+    habit.name = "Renamed"
+    await habit_list.remove(habit_list.habits[-1])
+    await habit_list.add("New habit")
+    await flusher.flush_all()
+    snapshot, entries, _ = await habit_list.data.journal.read()
+    assert replay(snapshot, entries) == replay(habit_list.data, [])
+    assert replay(snapshot, entries + entries) == replay(snapshot, entries)
+
+    # Compacted into the snapshot past the threshold
+    for day in days[1:12]:
+        await habit.tick(day, True)
+        await flusher.flush_all()
+    snapshot, entries, _ = await habit_list.data.journal.read()
+    assert len(entries) < 10
+    assert replay(snapshot, entries) == replay(habit_list.data, [])
+
+    reloaded = await storage_type().get_user_habit_list(habit_user)
+    assert replay(reloaded.data, []) == replay(habit_list.data, [])
+    assert reloaded.habits[0].name == "Renamed"
+    assert reloaded.habits[0].record_by(days[0]).text == "note"
+
+    await engine.dispose()
+
+
 async def test_user_disk(user: User, habit_user: HabitUser):
     settings.HABITS_STORAGE = StorageType.USER_DISK
 
@@ -76,3 +503,396 @@ async def test_user_disk(user: User, habit_user: HabitUser):
     await user.open("/")
     # close db connection after test
     await engine.dispose()
+
+
+async def test_file_backup_atomic(user: User, tmp_path):
+    days = [datetime.date(2024, 1, 1) + datetime.timedelta(days=i) for i in range(30)]
+    document = views.dummy_habit_list(days)
+    document.order = ["a", "b"]
+    assert "".join(iter_json({"data": document.data})) == json.dumps(
+        {"data": document.data}
+    )
+
+    path = tmp_path / "test.json"
+    d = FilePersistentDict(path, encoding="utf-8")
+    d["data"] = document.data
+    habit_list = DictHabitList(d["data"])
+    for day in days:
+        await habit_list.habits[0].tick(day, True)
+
+    # Superseded backups are dropped, the last one is written in one piece
+    for _ in range(100):
+        await asyncio.sleep(0.01)
+        if path.exists() and json.loads(path.read_text()) == d:
+            break
+    assert json.loads(path.read_text()) == d
+    assert [x.name for x in tmp_path.iterdir()] == ["test.json"]
+
+
+@pytest.mark.parametrize("codec", StorageCodec)
+def test_habit_list_codec(codec: StorageCodec):
+    rng = random.Random(codec.value)
+    days = [datetime.date(2020, 1, 1) + datetime.timedelta(days=i) for i in range(900)]
+    data = views.dummy_habit_list(days[:5]).data
+    data["order"] = ["a"]
+    for habit in data["habits"]:
+        habit["records"] = [
+            {"day": day.strftime("%Y-%m-%d"), "done": rng.random() < 0.7}
+            for day in rng.sample(days, rng.randint(0, 600))
+        ]
+        for record in rng.sample(habit["records"], len(habit["records"]) // 10):
+            record["text"] = rng.choice(["", "note", "ünïcode " * 30])
+
+    encoded = json.loads(json.dumps(encode_habit_list(data, codec)))
+    assert (FORMAT_KEY in encoded) is (codec != StorageCodec.JSON)
+
+    decoded = decode_habit_list(encoded)
+    assert decoded["order"] == data["order"]
+    for habit, expected in zip(decoded["habits"], data["habits"]):
+        assert habit_fields(habit) == habit_fields(expected)
+        assert record_rows(habit) == record_rows(expected)
+
+
+async def test_user_db_codec(user: User, monkeypatch):
+    monkeypatch.setattr(settings, "HABITS_CODEC", StorageCodec.VARINT_ZLIB)
+    await create_db_and_tables()
+    habit_user = await user_create(email=f"{uuid.uuid1()}@test.com", password=PASSWORD)
+    days = [datetime.date(2024, 1, 1) + datetime.timedelta(days=i) for i in range(30)]
+    await UserDatabaseStorage().init_user_habit_list(
+        habit_user, views.dummy_habit_list(days)
+    )
+    habit_list = await UserDatabaseStorage().get_user_habit_list(habit_user)
+    await habit_list.habits[0].tick(days[0], True, "encoded")
+    await flusher.flush_all()
+
+    stored = await crud.get_user_habit_list(habit_user)
+    assert stored is not None and "habits" not in stored.data
+
+    # Rows are decoded by their marker, whatever the codec set now
+    monkeypatch.setattr(settings, "HABITS_CODEC", StorageCodec.JSON)
+    reloaded = await UserDatabaseStorage().get_user_habit_list(habit_user)
+    assert reloaded.habits[0].record_by(days[0]).text == "encoded"
+    assert [x.ticked_days for x in reloaded.habits] == [
+        x.ticked_days for x in habit_list.habits
+    ]
+
+    await engine.dispose()
+
+
+def test_residency():
+    class Doc(dict):
+        pass
+
+    residency: Residency[Doc] = Residency(maxsize=2, ttl=0.5)
+    docs = [Doc(id=i) for i in range(3)]
+    for i, doc in enumerate(docs):
+        residency.put(i, doc)
+    assert len(residency) == 2 and residency.evicted == 1
+
+    # Still referenced, the evicted document is reused rather than reloaded
+    assert residency.get(0) is docs[0]
+    assert residency.revived == 1 and residency.evicted == 2
+
+    del docs[1]
+    gc.collect()
+    assert residency.get(1) is None and residency.misses == 1
+
+    # Idle ones still count until the next access drops them
+    time.sleep(0.6)
+    assert len(residency) == 2 and residency.expired == 0
+    assert residency.get(2) is docs[1]
+    assert len(residency) == 1 and residency.expired == 2
+
+
+def test_user_cache_settings():
+    # The USER_DISK_CACHE_* names still apply unless the new ones are set
+    old = Settings(USER_DISK_CACHE_SIZE=8, USER_DISK_CACHE_TTL=30)
+    assert (old.user_cache_max_size(), old.user_cache_ttl()) == (8, 30)
+    new = Settings(USER_CACHE_MAX_SIZE=4, USER_CACHE_TTL=10, USER_DISK_CACHE_SIZE=8)
+    assert (new.user_cache_max_size(), new.user_cache_ttl()) == (4, 10)
+
+
+async def test_user_disk_eviction(user: User, monkeypatch, user_data_folder: Path):
+    monkeypatch.setattr(settings, "USER_CACHE_MAX_SIZE", 1)
+    await create_db_and_tables()
+    users = [
+        await user_create(email=f"{uuid.uuid1()}@test.com", password=PASSWORD)
+        for _ in range(2)
+    ]
+    days = [datetime.date(2024, 1, 1) + datetime.timedelta(days=i) for i in range(5)]
+    storage = UserDiskStorage()
+    for habit_user in users:
+        await storage.init_user_habit_list(habit_user, views.dummy_habit_list(days))
+
+    habit_list = await storage.get_user_habit_list(users[0])
+    await habit_list.habits[0].tick(days[0], False, "evicted")
+    await storage.get_user_habit_list(users[1])
+    assert len(storage.user) == 1 and storage.user.evicted >= 1
+
+    # Kept until its write has landed, even once nothing else refers to it
+    assert users[0].id in storage.user.flushing
+    del habit_list
+    gc.collect()
+    assert users[0].id in storage.user.alive
+    for _ in range(100):
+        await asyncio.sleep(0.01)
+        if users[0].id not in storage.user.flushing:
+            break
+    path = user_data_folder / f"{users[0].email}.json"
+    stored = FilePersistentDict(path, decode=decode_user_file)
+    assert DictHabitList(stored["data"]).habits[0].record_by(days[0]).text == (
+        "evicted"
+    )
+
+    # Then freed, and loaded again from disk
+    for _ in range(100):
+        await asyncio.sleep(0.01)
+        gc.collect()
+        if users[0].id not in storage.user.alive:
+            break
+    reloaded = await storage.get_user_habit_list(users[0])
+    assert reloaded.habits[0].record_by(days[0]).text == "evicted"
+
+    await engine.dispose()
+
+
+@pytest.mark.parametrize("journal", [False, True])
+async def test_user_disk_shared_habit_list(user: User, monkeypatch, journal):
+    monkeypatch.setattr(settings, "HABITS_JOURNAL", journal)
+    await create_db_and_tables()
+    habit_user = await user_create(email=f"{uuid.uuid1()}@test.com", password=PASSWORD)
+    days = [datetime.date(2024, 1, 1) + datetime.timedelta(days=i) for i in range(5)]
+    storage = UserDiskStorage()
+    await storage.init_user_habit_list(habit_user, views.dummy_habit_list(days))
+
+    # An open page, and an API call ticking the same day
+    page = (await storage.get_user_habit_list(habit_user)).habits[0]
+    assert page.ticked_days is not None
+    api = (await storage.get_user_habit_list(habit_user)).habits[0]
+    day = datetime.date(2023, 12, 31)
+    await api.tick(day, True)
+    assert day in page.ticked_days
+
+    # The page updates the record instead of adding a second one
+    await page.tick(day, False)
+    records = [x for x in page.data["records"] if x["day"] == "2023-12-31"]
+    assert records == [{"day": "2023-12-31", "done": False}]
+
+    await flusher.flush_all()
+    await engine.dispose()
+
+
+async def test_user_db_eviction(user: User, monkeypatch):
+    monkeypatch.setattr(settings, "USER_CACHE_MAX_SIZE", 1)
+    await create_db_and_tables()
+    users = [
+        await user_create(email=f"{uuid.uuid1()}@test.com", password=PASSWORD)
+        for _ in range(2)
+    ]
+    days = [datetime.date(2024, 1, 1) + datetime.timedelta(days=i) for i in range(5)]
+    storage = UserDatabaseStorage()
+    for habit_user in users:
+        await storage.init_user_habit_list(habit_user, views.dummy_habit_list(days))
+
+    # Evicted with its write pending: kept, then revived rather than reloaded
+    habit_list = await storage.get_user_habit_list(users[0])
+    await habit_list.habits[0].tick(days[0], True, "evicted")
+    await storage.get_user_habit_list(users[1])
+    assert users[0].id in storage.habit_lists.flushing
+    d = habit_list.data
+    del habit_list
+    gc.collect()
+    revived = await storage.get_user_habit_list(users[0])
+    assert revived.data is d
+
+    # Another list of the user is not read back while the write is queued
+    await revived.habits[0].tick(days[1], True, "pending")
+    assert flusher.pending(users[0]) == [d]
+    other = await UserDatabaseStorage().get_user_habit_list(users[0])
+    assert other.data is d
+
+    await flusher.flush_all()
+    stored = await crud.get_user_habit_list(users[0])
+    assert stored is not None
+    reloaded = DictHabitList(decode_habit_list(stored.data))
+    assert reloaded.habits[0].record_by(days[0]).text == "evicted"
+    assert reloaded.habits[0].record_by(days[1]).text == "pending"
+
+    await engine.dispose()
+
+
+async def test_habit_list_pool():
+    days = [datetime.date(2024, 1, 1) + datetime.timedelta(days=i) for i in range(30)]
+    habit_list = views.dummy_habit_list(days)
+
+    habits = habit_list.habits
+    assert all(a is b for a, b in zip(habits, habit_list.habits))
+
+    habit_id = await habit_list.add("New habit")
+    new_habit = await habit_list.get_habit_by(habit_id)
+    assert new_habit is not None
+    assert new_habit is await habit_list.get_habit_by(habit_id)
+    assert all(a is b for a, b in zip(habits, habit_list.habits))
+
+    await habit_list.remove(new_habit)
+    assert await habit_list.get_habit_by(habit_id) is None
+    assert new_habit.id not in habit_list.pool
+
+
+async def test_habit_cache_incremental_tick():
+    days = [datetime.date(2024, 1, 1) + datetime.timedelta(days=i) for i in range(60)]
+    habit_list = views.dummy_habit_list(days)
+    habit = habit_list.habits[0]
+
+    rng = random.Random(42)
+    for _ in range(200):
+        day = rng.choice(days + [datetime.date(2023, 12, 31)])
+        text = rng.choice([None, "", "note"])
+        await habit.tick(day, rng.random() < 0.5, text)
+
+        expected = HabitDataCache(habit)
+        assert habit.ticked_days == expected.ticked_days
+        assert habit.ticked_data.keys() == expected.ticked_data.keys()
+        for day, record in expected.ticked_data.items():
+            assert habit.ticked_data[day].data is record.data
+
+
+def test_record_columns():
+    records = [
+        {"day": "2024-01-03", "done": True},
+        {"day": "2024-01-01", "done": False, "text": "skip"},
+        {"day": "2024-1-2", "done": True, "text": ""},
+        {"day": "2024-01-05", "done": True},
+    ]
+    columns = RecordColumns.from_records(records)
+    assert [datetime.date.fromordinal(x) for x in columns.days] == [
+        datetime.date(2024, 1, 1),
+        datetime.date(2024, 1, 2),
+        datetime.date(2024, 1, 3),
+        datetime.date(2024, 1, 5),
+    ]
+    assert list(columns.rows) == [1, 2, 0, 3]
+    assert [columns.is_done(i) for i in range(len(columns))] == [False] + [True] * 3
+    assert columns.notes == {
+        datetime.date(2024, 1, 1).toordinal(): "skip",
+        datetime.date(2024, 1, 2).toordinal(): "",
+    }
+    assert columns.index(datetime.date(2024, 1, 4)) is None
+
+    # Ticked days already listed are updated in place
+    ticked_days = columns.ticked_days
+    columns.set(datetime.date(2024, 1, 4), True, "new")
+    columns.set(datetime.date(2024, 1, 3), False)
+    columns.set(datetime.date(2024, 1, 5), True)
+    assert columns.ticked_days is ticked_days
+    assert ticked_days == [
+        datetime.date(2024, 1, 2),
+        datetime.date(2024, 1, 4),
+        datetime.date(2024, 1, 5),
+    ]
+    assert ticked_days == columns.ticked_between(datetime.date.min, datetime.date.max)
+
+
+async def test_habit_range_queries():
+    days = [datetime.date(2024, 1, 1) + datetime.timedelta(days=i) for i in range(90)]
+    habit = views.dummy_habit_list(days).habits[0]
+    await habit.tick(datetime.date(2024, 2, 1), True)
+    await habit.tick(datetime.date(2024, 2, 2), False)
+
+    rng = random.Random(7)
+    for _ in range(100):
+        start, end = sorted(rng.sample(days, 2))
+        expected = [x for x in habit.ticked_days if start <= x <= end]
+        assert habit.ticked_between(start, end) == expected
+        assert habit.ticked_count(start, end) == len(expected)
+
+    assert habit.ticked_count() == len(habit.ticked_days)
+    assert habit.ticked_between(days[-1], days[0]) == []
+
+
+async def test_habit_calendar_buckets():
+    days = [datetime.date(2023, 12, 1) + datetime.timedelta(days=i) for i in range(120)]
+    habit = views.dummy_habit_list(days).habits[0]
+    assert habit.buckets.total == len(habit.ticked_days)
+
+    rng = random.Random(9)
+    for _ in range(50):
+        await habit.tick(rng.choice(days), rng.random() < 0.5)
+
+    ticked_days = habit.ticked_days
+    buckets = habit.buckets
+    assert buckets.total == len(ticked_days)
+    for day in days:
+        week = day - datetime.timedelta(days=day.weekday())
+        assert buckets.week(day) == habit.ticked_count(
+            week, week + datetime.timedelta(days=6)
+        )
+        assert buckets.month(day) == sum(
+            1 for x in ticked_days if (x.year, x.month) == (day.year, day.month)
+        )
+    assert buckets.year(datetime.date(2023, 1, 1)) == habit.ticked_count(
+        datetime.date(2023, 1, 1), datetime.date(2023, 12, 31)
+    )
+
+
+async def test_months_text_alternative():
+    days = [datetime.date(2024, 1, 31), datetime.date(2024, 2, 1)]
+    days += [datetime.date(2024, 2, 29), datetime.date(2024, 3, 15)]
+    habit = views.dummy_habit_list(days).habits[0]
+    for day in days:
+        await habit.tick(day, True)
+
+    # Each month also counts the last day of the month before it
+    text = build_months_text_alternative(datetime.date(2024, 4, 10), habit)
+    assert text == "last 3 months progress: 2 3 1 "
+
+
+def reference_build(habit_list, *status: HabitStatus):
+    # Three stable sorts the builder is checked against
+    habits = [x for x in habit_list.habits if x.status in status]
+    if o := habit_list.order:
+        habits.sort(
+            key=lambda x: (o.index(str(x.id)) if str(x.id) in o else float("inf"))
+        )
+    habits.sort(key=lambda x: x.star, reverse=True)
+    all_status = HabitStatus.all()
+    habits.sort(key=lambda x: all_status.index(x.status))
+    return habits
+
+
+async def test_habit_list_builder():
+    habit_list = views.dummy_habit_list([])
+    rng = random.Random(3)
+    for i in range(30):
+        await habit_list.add(f"habit-{i}")
+    for habit in habit_list.habits:
+        habit.star = rng.random() < 0.3
+        habit.status = rng.choice([HabitStatus.ACTIVE, HabitStatus.ARCHIVED])
+    ids = [str(x.id) for x in habit_list.habits]
+    habit_list.order = rng.sample(ids, 25)
+
+    status = (HabitStatus.ACTIVE, HabitStatus.ARCHIVED)
+    habits = HabitListBuilder(habit_list).status(*status).build()
+    assert habits == reference_build(habit_list, *status)
+
+    # Cached until the list changes
+    habits.pop()
+    assert HabitListBuilder(habit_list).status(*status).build() != habits
+    views_before = dict(habit_list.views)
+    HabitListBuilder(habit_list).status(*status).build()
+    assert habit_list.views == views_before
+
+    habit_list.habits[0].star = not habit_list.habits[0].star
+    habits = HabitListBuilder(habit_list).status(HabitStatus.ACTIVE).build()
+    assert habits == reference_build(habit_list, HabitStatus.ACTIVE)
+
+    # Views of other filters are kept side by side, like the order page's
+    archived = HabitListBuilder(habit_list).status(HabitStatus.ARCHIVED).build()
+    assert archived == reference_build(habit_list, HabitStatus.ARCHIVED)
+    assert len(habit_list.views) == 2
+    HabitListBuilder(habit_list).status(HabitStatus.ACTIVE).build()
+    assert len(habit_list.views) == 2
+
+    habit_list.habits[0].star = not habit_list.habits[0].star
+    HabitListBuilder(habit_list).status(HabitStatus.ACTIVE).build()
+    assert len(habit_list.views) == 1